@@ -0,0 +1,61 @@
+"""
+Micro-benchmark of due-date range queries: a full scan that re-parses every due date (the old tasks.overdue and
+tasks.get_tasks_between_dates approach) versus bisecting a DueIndex built once per board snapshot.
+
+Run from the repo's top-level directory:
+python -m benchmarks.bench_due_index
+"""
+
+import random
+import timeit
+from datetime import datetime, timedelta
+
+import pytz
+
+from secretary.due_index import DueIndex
+
+
+def make_board(n_cards: int, undated_fraction: float = 0.2, seed: int = 0):
+    rng = random.Random(seed)
+    now = datetime.now(pytz.utc)
+    cards = []
+    for i in range(n_cards):
+        due = None
+        if rng.random() > undated_fraction:
+            due_time = now + timedelta(minutes=rng.randint(-60*24*30, 60*24*30))
+            due = due_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        cards.append({'id': f'{i:024x}', 'name': f'Task {i}', 'due': due})
+    return cards
+
+
+def scan_between(cards, start, end):
+    filtered_cards = []
+    for card in cards:
+        if card['due'] is None:
+            continue
+        utc_time = datetime.fromisoformat(card['due'][:-1] + '+00:00')
+        if start <= utc_time <= end:
+            filtered_cards.append(card)
+    return filtered_cards
+
+
+def main():
+    now = datetime.now(pytz.utc)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=1)
+
+    print(f"{'cards':>8} {'scan query':>12} {'index build':>12} {'index query':>12} {'speedup':>9}")
+    for n_cards in [100, 10_000, 100_000]:
+        cards = make_board(n_cards)
+        index = DueIndex(cards)
+        assert len(index.between(start, end)) == len(scan_between(cards, start, end))
+
+        repeats = max(1, 100_000 // n_cards)
+        scan = min(timeit.repeat(lambda: scan_between(cards, start, end), number=repeats, repeat=3)) / repeats
+        build = min(timeit.repeat(lambda: DueIndex(cards), number=repeats, repeat=3)) / repeats
+        query = min(timeit.repeat(lambda: index.between(start, end), number=repeats*10, repeat=3)) / (repeats*10)
+        print(f"{n_cards:>8} {scan*1e3:>10.3f}ms {build*1e3:>10.3f}ms {query*1e3:>10.3f}ms {scan/query:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark of top-k task retrieval: the old per-card dist() loop (re-computing both norms for every card) versus
+one matrix-vector product over SimilarityIndex's pre-normalized matrix, in float32 and int8-quantized form.
+
+Run from the repo's top-level directory:
+python -m benchmarks.bench_similarity
+"""
+
+import time
+
+import numpy as np
+
+from secretary.similarity import SimilarityIndex
+
+DIMS = 1536 # text-embedding-3-small
+TOP_K = 20
+
+
+def loop_top_k(embeddings, content_embedding, k):
+    def dist(embedding):
+        dot_product = np.dot(embedding, content_embedding)
+        norm_vec1 = np.linalg.norm(embedding)
+        norm_vec2 = np.linalg.norm(content_embedding)
+        similarity = dot_product / (norm_vec1 * norm_vec2)
+        return similarity
+
+    similarity = np.array([dist(embedding) for embedding in embeddings])
+    return sorted(range(len(similarity)), key=lambda i: similarity[i], reverse=True)[:k]
+
+
+def best_time(fcn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fcn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(DIMS).astype(np.float32)
+
+    print(f"{'cards':>8} {'loop':>10} {'float32':>10} {'int8':>10} {'speedup':>8} {'float32 MB':>11} {'int8 MB':>8} {'int8 recall':>12}")
+    for n_cards in [1_000, 10_000, 100_000]:
+        embeddings = rng.standard_normal((n_cards, DIMS)).astype(np.float32)
+        ids = [f'{i:024x}' for i in range(n_cards)]
+        index = SimilarityIndex(DIMS)
+        index.add(ids, embeddings)
+        quantized_index = SimilarityIndex(DIMS, quantize=True)
+        quantized_index.add(ids, embeddings)
+
+        repeats = 3 if n_cards < 100_000 else 1
+        loop = best_time(lambda: loop_top_k(embeddings, query, TOP_K), repeats)
+        dense = best_time(lambda: index.top_k(query, TOP_K), repeats * 5)
+        quantized = best_time(lambda: quantized_index.top_k(query, TOP_K), repeats * 5)
+
+        expected = {ids[i] for i in loop_top_k(embeddings, query, TOP_K)}
+        assert {id for id, _ in index.top_k(query, TOP_K)} == expected
+        recall = len(expected & {id for id, _ in quantized_index.top_k(query, TOP_K)}) / TOP_K
+
+        print(f"{n_cards:>8} {loop*1e3:>8.1f}ms {dense*1e3:>8.2f}ms {quantized*1e3:>8.2f}ms {loop/dense:>7.0f}x "
+              f"{index.nbytes/1e6:>11.1f} {quantized_index.nbytes/1e6:>8.1f} {recall:>12.2f}")
+        del embeddings, index, quantized_index
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the prompt size of a synthetic board's tasks: the old json.dumps() of the cleaned tasks versus the
+compact TaskAliases encoding. Sizes are counted in tokens with tiktoken if it is installed (and its encoding can be
+downloaded), and in UTF-8 bytes otherwise. Bytes are not a stand-in for tokens: json punctuation and long hex ids
+cost fewer tokens per byte than words do, so the saving in bytes overstates the saving in tokens.
+
+Run from the repo's top-level directory:
+python -m benchmarks.bench_task_encoding
+"""
+
+import json
+import random
+
+from secretary.task_encoding import TaskAliases
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('o200k_base') # gpt-4o. Downloaded on first use
+    measure = lambda text: len(_encoding.encode(text))
+    UNIT = 'tokens'
+except Exception: # not installed, or the encoding couldn't be downloaded
+    measure = lambda text: len(text.encode('utf-8'))
+    UNIT = 'bytes'
+
+WORDS = ['buy', 'eggs', 'call', 'Silvia', 'about', 'the', 'paper', 'draft', 'submit', 'expense', 'report',
+         'book', 'flights', 'to', 'Boston', 'review', 'PR', 'for', 'billing', 'service', 'renew', 'passport']
+
+
+def synthetic_tasks(n_cards, rng):
+    tasks = []
+    for i in range(n_cards):
+        name = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+        task = {'id': f'{rng.getrandbits(96):024x}',
+                'name': name,
+                'closed': False,
+                'url': f"https://trello.com/c/{rng.getrandbits(40):010x}/{i+1}-{name.lower().replace(' ', '-')}"}
+        if rng.random() < 0.5:
+            task['desc'] = f"Requestor: Jack\nActor: Jack\n\n{' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))}"
+        if rng.random() < 0.7:
+            task['due'] = f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00 -0700'
+        tasks.append({k: task[k] for k in ['id', 'name', 'desc', 'closed', 'url', 'due'] if k in task})
+    return tasks
+
+
+def main():
+    rng = random.Random(0)
+    if UNIT == 'bytes':
+        print('tiktoken or its encoding is not available, so sizes are in bytes, which overstate the saving in tokens.')
+        print('These are not token figures.')
+    print(f"{'cards':>6} {'json ' + UNIT:>12} {'compact ' + UNIT:>15} {'saved':>7}")
+    for n_cards in [20, 200, 1000]:
+        tasks = synthetic_tasks(n_cards, rng)
+        json_size = measure(json.dumps(tasks))
+        compact_size = measure(TaskAliases(tasks).encode())
+        print(f'{n_cards:>6} {json_size:>12} {compact_size:>15} {1 - compact_size/json_size:>7.0%}')
+
+
+if __name__ == '__main__':
+    main()
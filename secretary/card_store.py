@@ -0,0 +1,229 @@
+"""
+A local SQLite replica of a Trello board's cards, lists and labels.
+
+After the first full load, the replica is kept up to date incrementally from the board's actions feed, so reads
+don't have to re-download every card on the board.
+
+Usage example:
+store = CardStore('secretary_board.sqlite', board_name='Secretary', max_staleness=30)
+cards = store.get_cards()                  # served locally, synced first if older than 30 seconds
+cards = store.get_cards(consistent=True)   # synced with Trello before reading, eg. before a mutation
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+import secretary.utils_trello as utils_trello
+
+# Actions after which a card is no longer on the board
+CARD_REMOVAL_ACTIONS = ['deleteCard', 'moveCardFromBoard']
+# Actions after which the board's lists or labels need to be reloaded
+LIST_ACTIONS = ['createList', 'updateList', 'moveListToBoard', 'moveListFromBoard']
+LABEL_ACTIONS = ['createLabel', 'updateLabel', 'deleteLabel']
+
+class CardStore():
+
+    def __init__(self, path: str, board_name: str, max_staleness: float = 30.0):
+        """
+        path: The SQLite file to keep the replica in. Use ':memory:' for a replica that isn't persisted.
+        board_name: The name of the board to mirror.
+        max_staleness: Reads sync with Trello first if the last sync was more than this many seconds ago.
+        """
+        self.path = path
+        self.board_name = board_name
+        self.max_staleness = max_staleness
+        self.version = 0 # bumped whenever the replica's contents may have changed
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS cards (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS lists (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS labels (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    ### Sync state ###
+
+    def _get_state(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, value: Any):
+        self._db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def board_id(self) -> Optional[str]:
+        with self._lock:
+            return self._get_state('board_id')
+
+    def seconds_since_sync(self) -> float:
+        """Seconds since the replica was last synced with Trello, or infinity if it never was."""
+        with self._lock:
+            synced_at = self._get_state('synced_at')
+        if synced_at is None:
+            return float('inf')
+        return time.time() - float(synced_at)
+
+    ### Syncing ###
+
+    def refresh(self):
+        """Sync the replica with Trello. The first sync (or a sync for a different board) is a full load."""
+        with self._lock:
+            board_id = utils_trello.get_board_id(board_name=self.board_name)
+            last_action_id = self._get_state('last_action_id')
+            if board_id != self._get_state('board_id') or last_action_id is None:
+                changed = self._full_load(board_id)
+            else:
+                changed = self._incremental_sync(board_id, last_action_id)
+            self._set_state('synced_at', time.time())
+            self._db.commit()
+            if changed:
+                self.version += 1
+
+    def _full_load(self, board_id: str):
+        # Note the latest action before downloading, so anything that happens during the download is replayed next sync
+        latest_actions = utils_trello.get_board_actions(board_id, limit=1)
+        cards = utils_trello.get_cards_on_board(board_id)
+
+        self._db.execute("DELETE FROM cards")
+        self._replace_rows('cards', cards)
+        self._load_lists(board_id)
+        self._load_labels(board_id)
+        self._set_state('board_id', board_id)
+        self._set_state('last_action_id', latest_actions[0]['id'] if latest_actions else '')
+        return True
+
+    def _incremental_sync(self, board_id: str, last_action_id: str, limit: int = 1000):
+        actions = utils_trello.get_board_actions(board_id, since=last_action_id or None, limit=limit)
+        if len(actions) >= limit:
+            # Too far behind to replay the feed reliably
+            return self._full_load(board_id)
+        if not actions:
+            return False
+
+        # Actions come newest first. Only the latest action per card matters.
+        card_actions = {}
+        reload_lists = False
+        reload_labels = False
+        for action in actions:
+            card = action.get('data', {}).get('card')
+            if card and card['id'] not in card_actions:
+                card_actions[card['id']] = action['type']
+            reload_lists = reload_lists or action['type'] in LIST_ACTIONS
+            reload_labels = reload_labels or action['type'] in LABEL_ACTIONS
+
+        for card_id, action_type in card_actions.items():
+            if action_type in CARD_REMOVAL_ACTIONS:
+                self._db.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+            else:
+                self._sync_card(board_id, card_id)
+        if reload_lists:
+            self._load_lists(board_id)
+        if reload_labels:
+            self._load_labels(board_id)
+
+        self._set_state('last_action_id', actions[0]['id'])
+        return True
+
+    def _sync_card(self, board_id: str, card_id: str):
+        response = utils_trello.get_default_client().request("GET", f"cards/{card_id}")
+        if response.status_code == 404:
+            self._db.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+            return
+        if response.status_code >= 400:
+            raise utils_trello.TrelloError(response)
+        card = json.loads(response.text)
+        if card.get('closed') or card.get('idBoard') != board_id:
+            self._db.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+        else:
+            self._replace_rows('cards', [card])
+
+    def _load_lists(self, board_id: str):
+        # Bypass the metadata cache, and refresh it while we're at it
+        lists = utils_trello.get_default_client().get_lists_on_board(board_id)
+        utils_trello.metadata_cache.put('lists', board_id, lists)
+        self._db.execute("DELETE FROM lists")
+        self._replace_rows('lists', lists)
+
+    def _load_labels(self, board_id: str):
+        labels = utils_trello.get_default_client().get_labels_on_board(board_id)
+        utils_trello.metadata_cache.put('labels', board_id, labels)
+        self._db.execute("DELETE FROM labels")
+        self._replace_rows('labels', labels)
+
+    def _replace_rows(self, table: str, items: list[dict[str, Any]]):
+        self._db.executemany(f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)",
+                             [(item['id'], json.dumps(item)) for item in items])
+
+    def ensure_fresh(self, consistent: bool = False, max_staleness: Optional[float] = None):
+        """Sync with Trello if the replica is staler than max_staleness (default: the store's bound), or if consistent."""
+        if max_staleness is None:
+            max_staleness = self.max_staleness
+        if consistent or self.seconds_since_sync() > max_staleness:
+            self.refresh()
+
+    ### Reads ###
+
+    def _read_rows(self, table: str) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(f"SELECT data FROM {table} ORDER BY rowid").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_cards(self, consistent: bool = False, max_staleness: Optional[float] = None) -> list[dict[str, Any]]:
+        """
+        Get all cards on the board.
+        consistent: Sync with Trello before reading, regardless of staleness.
+        max_staleness: Override the store's staleness bound for this read.
+        """
+        self.ensure_fresh(consistent, max_staleness)
+        return self._read_rows('cards')
+
+    def get_card(self, card_id: str, consistent: bool = False) -> Optional[dict[str, Any]]:
+        """Get one card, or None if it is not on the board. A consistent read fetches the card from Trello."""
+        if consistent:
+            with self._lock:
+                if self.board_id is None:
+                    self.refresh()
+                self._sync_card(self.board_id, card_id)
+                self._db.commit()
+                self.version += 1
+        else:
+            self.ensure_fresh(False, None)
+        with self._lock:
+            row = self._db.execute("SELECT data FROM cards WHERE id = ?", (card_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_lists(self, consistent: bool = False) -> list[dict[str, Any]]:
+        self.ensure_fresh(consistent, None)
+        return self._read_rows('lists')
+
+    def get_labels(self, consistent: bool = False) -> list[dict[str, Any]]:
+        self.ensure_fresh(consistent, None)
+        return self._read_rows('labels')
+
+    ### Write-through from local mutations ###
+
+    def upsert_card(self, card: dict[str, Any]):
+        """Record a card that was just created or updated through the API."""
+        with self._lock:
+            if card.get('closed'):
+                self._db.execute("DELETE FROM cards WHERE id = ?", (card['id'],))
+            else:
+                self._replace_rows('cards', [card])
+            self._db.commit()
+            self.version += 1
+
+    def remove_card(self, card_id: str):
+        """Record that a card was just deleted through the API."""
+        with self._lock:
+            self._db.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+            self._db.commit()
+            self.version += 1
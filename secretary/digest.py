@@ -0,0 +1,187 @@
+"""
+Daily digests (tasks due later today, and overdue tasks) for many users at once.
+
+Every user's digest is computed from one shared snapshot (a DueIndex) of their board, which is taken at most once
+per snapshot_ttl seconds, instead of fetching every card for each user. Each user's due-later-today and overdue
+sets are then two bisections of the snapshot, in the user's own timezone. A digest is rendered into one Block Kit
+message, and posted by a SlackSender, which posts on a small pool of threads at a bounded rate, and logs and
+counts the posts that fail.
+
+Digests can be prepared a few minutes ahead of their delivery time (as of that time), so that at delivery they
+only have to be posted.
+
+Usage example:
+engine = DigestEngine(lambda board: tasks.get_due_index(), SlackSender(app.client, RequestScheduler(20, 1.0)))
+engine.prepare(user_id, user_name, time_zone, board, deliver_at=time.time() + 300)
+...
+engine.deliver(user_id, user_name, time_zone, board)
+"""
+
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+import contextvars
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import pytz
+from slack_sdk.errors import SlackApiError
+
+from secretary.due_index import DueIndex
+import secretary.tracing as tracing
+
+logger = logging.getLogger(__name__)
+
+# Slack truncates section text at 3000 characters, so long lists of tasks are cut short before that
+MAX_SECTION_CHARS = 2900
+
+
+class SlackSender():
+    """
+    Posts messages with chat_postMessage on a pool of threads, at a bounded rate, retrying when Slack responds 429.
+    Posts that fail for good (eg. not_in_channel, or still rate limited after max_retries) are logged and counted.
+    """
+
+    def __init__(self, client, rate_limiter, max_workers: int = 8, max_retries: int = 5):
+        """
+        client: A Slack WebClient.
+        rate_limiter: Paces the posts, eg. a rate_limit.RequestScheduler sized to Slack's rate limits.
+        max_workers: Number of posts in flight at once.
+        max_retries: How many times to retry a post that got a 429 before giving up.
+        """
+        self.client = client
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='slack-sender')
+        self._lock = threading.Lock()
+        self.stats = {'sent': 0, 'failed': 0}
+
+    def _post(self, **message):
+        with tracing.span('slack.chat_postMessage', blocks=len(message['blocks'] or [])) as span:
+            for attempt in range(self.max_retries + 1):
+                span.set(attempts=attempt + 1)
+                self.rate_limiter.acquire('background')
+                try:
+                    return self.client.chat_postMessage(**message)
+                except SlackApiError as e:
+                    if e.response.status_code != 429 or attempt == self.max_retries:
+                        raise
+                    self.rate_limiter.rate_limited(attempt, e.response.headers.get('Retry-After'))
+
+    def send(self, channel: str, text: str, blocks: Optional[list[dict]] = None) -> Future:
+        """Queue a message to post. Returns a Future of Slack's response."""
+        context = contextvars.copy_context() # so the post is traced as part of the caller's trace
+        future = self._pool.submit(context.run, self._post, channel=channel, text=text, blocks=blocks)
+        future.add_done_callback(lambda done: self._done(channel, done))
+        return future
+
+    def _done(self, channel: str, future: Future):
+        error = CancelledError() if future.cancelled() else future.exception()
+        with self._lock:
+            self.stats['failed' if error is not None else 'sent'] += 1
+        if error is not None:
+            reason = error.response.get('error') if isinstance(error, SlackApiError) else None
+            logger.error('Could not post to %s (%s)', channel, reason or repr(error), exc_info=error)
+
+
+def compute_digest(index: DueIndex, time_zone: str, as_of: Optional[float] = None) -> dict[str, list]:
+    """The user's tasks due later today and overdue tasks, as of the timestamp as_of (default: now), in their time zone."""
+    tz = pytz.timezone(time_zone)
+    now = datetime.fromtimestamp(as_of if as_of is not None else time.time(), tz)
+    tonight_midnight = tz.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+    return {'due_later_today': index.between(now, tonight_midnight),
+            'overdue': index.before(now)}
+
+
+def _task_list(cards: list[dict[str, Any]]) -> str:
+    lines = []
+    length = 0
+    for i, card in enumerate(cards):
+        line = f"• <{card['url']}|{card['name']}>"
+        if length + len(line) > MAX_SECTION_CHARS:
+            lines.append(f'…and {len(cards) - i} more')
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines)
+
+
+def render_digest(user_name: Optional[str], digest: dict[str, list]) -> tuple[str, list[dict]]:
+    """Render a digest into one Slack message: (fallback text, Block Kit blocks)."""
+    greeting = f'Good morning {user_name}!' if user_name else 'Good morning!'
+    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'*{greeting}*'}}]
+    due_later_today, overdue = digest['due_later_today'], digest['overdue']
+    if not due_later_today and not overdue:
+        summary = "Relax, you don't have anything to do today :beach_with_umbrella:"
+        blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text': summary}})
+        return f'{greeting} {summary}', blocks
+
+    summaries = []
+    if due_later_today:
+        title = 'You have only this one task to do later today:' if len(due_later_today) == 1 else 'You have these tasks to do later today:'
+        blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'{title}\n{_task_list(due_later_today)}'}})
+        summaries.append(f'{len(due_later_today)} due later today')
+    if overdue:
+        title = 'Just a reminder, you have only this one overdue task...' if len(overdue) == 1 else 'Just a reminder, you have these overdue tasks...'
+        if due_later_today:
+            blocks.append({'type': 'divider'})
+        blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'{title}\n{_task_list(overdue)}'}})
+        summaries.append(f'{len(overdue)} overdue')
+    return f"{greeting} You have {' and '.join(summaries)}.", blocks
+
+
+class DigestEngine():
+
+    def __init__(self, get_index: Callable[[str], DueIndex], sender: SlackSender,
+                 snapshot_ttl: float = 120, max_prepared_age: float = 1800):
+        """
+        get_index: Takes a snapshot of a board: gets a DueIndex over its cards.
+        sender: Posts the digests.
+        snapshot_ttl: Seconds to share one snapshot of a board between users' digests.
+        max_prepared_age: Prepared digests more than this many seconds away from the delivery time are recomputed.
+        """
+        self.get_index = get_index
+        self.sender = sender
+        self.snapshot_ttl = snapshot_ttl
+        self.max_prepared_age = max_prepared_age
+        self._snapshots = {} # board -> (taken at, DueIndex)
+        self._snapshot_locks = {} # board -> Lock, so concurrent digests of one board share one snapshot
+        self._prepared = {} # user id -> (deliver at, text, blocks)
+        self._lock = threading.Lock()
+        self.stats = {'snapshots': 0, 'prepared': 0, 'delivered': 0, 'delivered_prepared': 0}
+
+    def snapshot(self, board: str) -> DueIndex:
+        with self._lock:
+            board_lock = self._snapshot_locks.setdefault(board, threading.Lock())
+        with board_lock:
+            taken_at, index = self._snapshots.get(board, (None, None))
+            if index is None or time.monotonic() - taken_at > self.snapshot_ttl:
+                index = self.get_index(board)
+                self._snapshots[board] = (time.monotonic(), index)
+                self.stats['snapshots'] += 1
+            return index
+
+    def _render(self, user_name, time_zone: str, board: str, as_of: float) -> tuple[str, list[dict]]:
+        return render_digest(user_name, compute_digest(self.snapshot(board), time_zone, as_of))
+
+    def prepare(self, user_id: str, user_name: Optional[str], time_zone: str, board: str, deliver_at: float):
+        """Compute and render the user's digest as of deliver_at, ready for deliver()."""
+        text, blocks = self._render(user_name, time_zone, board, deliver_at)
+        with self._lock:
+            self._prepared[user_id] = (deliver_at, text, blocks)
+            self.stats['prepared'] += 1
+
+    def deliver(self, user_id: str, user_name: Optional[str], time_zone: str, board: str) -> Future:
+        """Post the user's digest: the prepared one, if it was prepared for about now, or else a fresh one."""
+        now = time.time()
+        with self._lock:
+            prepared = self._prepared.pop(user_id, None)
+            use_prepared = prepared is not None and abs(prepared[0] - now) <= self.max_prepared_age
+            self.stats['delivered'] += 1
+            self.stats['delivered_prepared'] += use_prepared
+        if use_prepared:
+            _, text, blocks = prepared
+        else:
+            text, blocks = self._render(user_name, time_zone, board, now)
+        return self.sender.send(user_id, text, blocks)
@@ -0,0 +1,56 @@
+"""
+A due-date index over a snapshot of cards, so date-range queries are bisections instead of full scans.
+
+Each card's due date is parsed once, when the index is built. Dated cards are kept sorted by their due time
+(as epoch seconds) and undated cards are kept separately.
+
+Usage example:
+index = DueIndex(cards)
+overdue_cards = index.before(datetime.now(pytz.utc))
+due_today = index.between(lastnight_midnight, tonight_midnight)
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Optional
+
+
+def parse_due(due: Optional[str]) -> Optional[float]:
+    """Convert a Trello ISO 8601 due date (eg. '2024-08-20T17:00:00.000Z') to epoch seconds, or None if there isn't one."""
+    if not due:
+        return None
+    if due.endswith('Z'):
+        due = due[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(due).timestamp()
+    except ValueError:
+        return None
+
+
+class DueIndex():
+
+    def __init__(self, cards: list[dict[str, Any]]):
+        dated = []
+        self.undated = []
+        for card in cards:
+            due = parse_due(card.get('due'))
+            if due is None:
+                self.undated.append(card)
+            else:
+                dated.append((due, card))
+        dated.sort(key=lambda item: item[0])
+        self.due_times = [due for due, _ in dated]
+        self.cards = [card for _, card in dated]
+
+    def __len__(self):
+        return len(self.cards) + len(self.undated)
+
+    def between(self, start: datetime, end: datetime) -> list[dict[str, Any]]:
+        """Get the cards due between start and end, inclusive, in order of due date."""
+        lo = bisect_left(self.due_times, start.timestamp())
+        hi = bisect_right(self.due_times, end.timestamp())
+        return self.cards[lo:hi]
+
+    def before(self, time: datetime) -> list[dict[str, Any]]:
+        """Get the cards due strictly before time, in order of due date."""
+        return self.cards[:bisect_left(self.due_times, time.timestamp())]
@@ -0,0 +1,201 @@
+"""
+A persistent, content-addressed store of text embeddings.
+
+Embeddings are keyed by (model, dims, sha256(text)), so the same text is never embedded twice, across restarts too.
+The vectors live in a float32 .npy file that is opened as a memory map, so reopening the store doesn't load them
+all into RAM. Which row holds which key, and which card uses which key, is kept in an append-only log that is
+replayed on open.
+
+Rows that no card uses any more (eg. after mark_task_completed deletes a card, or a card's text changed) are
+garbage-collected by gc(), which compacts the vectors and the log.
+
+Usage example:
+store = EmbeddingStore('.secretary_embeddings', model='text-embedding-3-small', dims=1536)
+vector = store.get(text)
+if vector is None:
+    store.put(text, ai.get_embedding(text), card_id=card['id'])
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+LOG_FILE = 'log.jsonl'
+
+class EmbeddingStore():
+
+    def __init__(self, path: str, model: str, dims: int, initial_capacity: int = 1024, gc_garbage_fraction: float = 0.5):
+        """
+        path: Directory to keep the store in. Each (model, dims) pair gets its own subdirectory.
+        model, dims: The embedding model and its output size. Part of every key.
+        initial_capacity: Number of rows to allocate in a new vectors file. The file doubles in size whenever it fills up.
+        gc_garbage_fraction: Run gc() automatically when more than this fraction of the rows are unused.
+        """
+        self.model = model
+        self.dims = dims
+        self.path = os.path.join(path, f'{model}-{dims}')
+        self.gc_garbage_fraction = gc_garbage_fraction
+        self._lock = threading.RLock()
+        self._rows = {} # key -> row
+        self._card_keys = {} # card id -> key
+        self._vectors = None
+        self._vectors_file = None
+        self._n_rows = 0
+        os.makedirs(self.path, exist_ok=True)
+
+        if os.path.exists(os.path.join(self.path, LOG_FILE)):
+            self._replay_log()
+        else:
+            self._vectors_file = 'vectors-0.npy'
+            self._vectors = self._create_vectors_file(self._vectors_file, initial_capacity)
+            self._write_log([{'vectors': self._vectors_file}])
+        self._log = open(os.path.join(self.path, LOG_FILE), 'a')
+
+    def key(self, text: str) -> str:
+        return f"{self.model}:{self.dims}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, text: str):
+        return self.key(text) in self._rows
+
+    def close(self):
+        with self._lock:
+            self._log.close()
+            self._vectors.flush()
+
+    ### Files ###
+
+    def _create_vectors_file(self, file_name: str, capacity: int) -> np.memmap:
+        return np.lib.format.open_memmap(os.path.join(self.path, file_name),
+                                         mode='w+', dtype=np.float32, shape=(capacity, self.dims))
+
+    def _write_log(self, entries: list[dict]):
+        """Atomically replace the log with these entries."""
+        tmp_path = os.path.join(self.path, LOG_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, os.path.join(self.path, LOG_FILE))
+
+    def _append_log(self, entry: dict):
+        self._log.write(json.dumps(entry) + '\n')
+        self._log.flush()
+
+    def _replay_log(self):
+        with open(os.path.join(self.path, LOG_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break # a torn write at the end of the log, from a crash
+                if 'vectors' in entry:
+                    self._vectors_file = entry['vectors']
+                elif 'row' in entry:
+                    self._rows[entry['key']] = entry['row']
+                    self._n_rows = max(self._n_rows, entry['row'] + 1)
+                elif 'card' in entry:
+                    if entry['key'] is None:
+                        self._card_keys.pop(entry['card'], None)
+                    else:
+                        self._card_keys[entry['card']] = entry['key']
+        self._vectors = np.load(os.path.join(self.path, self._vectors_file), mmap_mode='r+')
+
+    def _switch_vectors_file(self, vectors: np.memmap, file_name: str):
+        old_file = self._vectors_file
+        self._vectors = vectors
+        self._vectors_file = file_name
+        if old_file != file_name:
+            try:
+                os.remove(os.path.join(self.path, old_file))
+            except FileNotFoundError:
+                pass
+
+    def _next_vectors_file(self) -> str:
+        generation = int(self._vectors_file.split('-')[1].split('.')[0]) + 1
+        return f'vectors-{generation}.npy'
+
+    def _grow(self):
+        file_name = self._next_vectors_file()
+        vectors = self._create_vectors_file(file_name, 2 * len(self._vectors))
+        vectors[:self._n_rows] = self._vectors[:self._n_rows]
+        vectors.flush()
+        self._append_log({'vectors': file_name})
+        self._switch_vectors_file(vectors, file_name)
+
+    ### Reads and writes ###
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Get the embedding of the text, or None if it isn't in the store."""
+        with self._lock:
+            row = self._rows.get(self.key(text))
+            if row is None:
+                return None
+            return np.array(self._vectors[row])
+
+    def put(self, text: str, vector: np.ndarray, card_id: Optional[str] = None):
+        """Store the embedding of the text, and optionally record that the card with card_id has this text."""
+        key = self.key(text)
+        with self._lock:
+            if key not in self._rows:
+                if self._n_rows == len(self._vectors):
+                    self._grow()
+                row = self._n_rows
+                # Write the vector before the log entry that points at it, so a crash never leaves a dangling row
+                self._vectors[row] = np.asarray(vector, dtype=np.float32)
+                self._vectors.flush()
+                self._append_log({'key': key, 'row': row})
+                self._rows[key] = row
+                self._n_rows += 1
+            if card_id is not None:
+                self._assign_card(card_id, key)
+
+    def assign_card(self, card_id: str, text: str):
+        """Record that the card with card_id now has this text."""
+        with self._lock:
+            self._assign_card(card_id, self.key(text))
+
+    def _assign_card(self, card_id: str, key: str):
+        if self._card_keys.get(card_id) != key:
+            self._append_log({'card': card_id, 'key': key})
+            self._card_keys[card_id] = key
+
+    def remove_card(self, card_id: str):
+        """Record that the card with card_id was deleted, so its embedding can be garbage-collected."""
+        with self._lock:
+            if card_id in self._card_keys:
+                self._append_log({'card': card_id, 'key': None})
+                del self._card_keys[card_id]
+            if self._n_rows > 0 and 1 - len(set(self._card_keys.values())) / self._n_rows > self.gc_garbage_fraction:
+                self.gc()
+
+    ### Garbage collection ###
+
+    def gc(self):
+        """Drop the rows that no card uses, compacting the vectors file and the log."""
+        with self._lock:
+            live_keys = sorted(set(self._card_keys.values()) & set(self._rows))
+            file_name = self._next_vectors_file()
+            vectors = self._create_vectors_file(file_name, max(len(live_keys), 1) * 2)
+            rows = {}
+            for row, key in enumerate(live_keys):
+                vectors[row] = self._vectors[self._rows[key]]
+                rows[key] = row
+            vectors.flush()
+
+            entries = [{'vectors': file_name}]
+            entries += [{'key': key, 'row': row} for key, row in rows.items()]
+            entries += [{'card': card_id, 'key': key} for card_id, key in self._card_keys.items() if key in rows]
+            self._log.close()
+            self._write_log(entries) # the switch to the new vectors file happens atomically here
+            self._log = open(os.path.join(self.path, LOG_FILE), 'a')
+
+            self._switch_vectors_file(vectors, file_name)
+            self._rows = rows
+            self._card_keys = {card_id: key for card_id, key in self._card_keys.items() if key in rows}
+            self._n_rows = len(rows)
@@ -0,0 +1,128 @@
+"""
+Idempotent Slack event processing: remembers which events have been seen, so redeliveries aren't handled twice.
+
+Slack redelivers an event when it isn't acknowledged in time, or when it is retried after an error. Each event is
+identified by its event_id, and a user's message also by its client_msg_id (which stays the same across
+redeliveries, and across the different events for the same message). claim() records the ids of a new event as
+in flight, and returns 'in_flight' or 'done' for a redelivery, which should then be dropped: an in-flight retry
+joins the turn that is already running, since that turn will reply. finish() marks the event done, and release()
+forgets it (eg. when its turn could not be queued, so the message can be sent again).
+
+Ids are kept for window seconds, and at most max_entries in memory. With a path, done events are also kept in a
+SQLite table, so redeliveries are recognized across restarts too.
+
+Usage example:
+dedup = EventDedupStore(path='events.sqlite')
+keys = event_keys(body)
+if dedup.claim(keys) != 'new':
+    return
+...
+dedup.finish(keys)
+"""
+
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+from typing import Any, Literal, Optional
+
+
+def event_keys(body: dict[str, Any]) -> list[str]:
+    """The ids that identify an event: its event_id and, for messages, the client_msg_id."""
+    keys = []
+    if body.get('event_id'):
+        keys.append(f"event:{body['event_id']}")
+    if body.get('event', {}).get('client_msg_id'):
+        keys.append(f"msg:{body['event']['client_msg_id']}")
+    return keys
+
+
+def retry_number(body: dict[str, Any], headers: Optional[dict[str, Any]] = None) -> int:
+    """How many times Slack has retried this event: from the X-Slack-Retry-Num header, or Socket Mode's retry_attempt."""
+    retry = (headers or {}).get('x-slack-retry-num')
+    if isinstance(retry, (list, tuple)):
+        retry = retry[0] if retry else None
+    if retry is None:
+        retry = body.get('retry_attempt')
+    try:
+        return int(retry or 0)
+    except ValueError:
+        return 0
+
+
+class EventDedupStore():
+
+    def __init__(self, window: float = 3600, max_entries: int = 10000, path: Optional[str] = None):
+        """
+        window: Seconds to remember an event for. Slack retries within minutes, so an hour is plenty.
+        max_entries: The most events remembered in memory. The oldest are forgotten first.
+        path: Optionally, a SQLite file to remember done events in, across restarts.
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (seen at, state), oldest first
+        self._lock = threading.Lock()
+        self.stats = {'new': 0, 'in_flight': 0, 'done': 0}
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS seen_events (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)')
+            self._db.commit()
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, (seen_at, _) = next(iter(self._entries.items()))
+            if now - seen_at <= self.window and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def _state(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] <= self.window:
+            return entry[1]
+        if self._db is not None:
+            row = self._db.execute('SELECT seen_at FROM seen_events WHERE key = ?', (key,)).fetchone()
+            if row is not None and time.time() - row[0] <= self.window:
+                return 'done'
+        return None
+
+    def claim(self, keys: list[str]) -> Literal['new', 'in_flight', 'done']:
+        """
+        Record the event with these keys as in flight, if none of them has been seen.
+        Returns 'new' if so, otherwise the state of the event that was seen: 'in_flight' or 'done'.
+        An event with no keys can't be deduplicated, and is always new.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            states = [self._state(key, now) for key in keys]
+            if 'in_flight' in states:
+                result = 'in_flight'
+            elif 'done' in states:
+                result = 'done'
+            else:
+                result = 'new'
+                for key in keys:
+                    self._entries[key] = (now, 'in_flight')
+            self.stats[result] += 1
+            return result
+
+    def finish(self, keys: list[str]):
+        """Mark the event with these keys as done."""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (now, 'done')
+                self._entries.move_to_end(key)
+            if self._db is not None and keys:
+                wall_now = time.time()
+                self._db.executemany('INSERT OR REPLACE INTO seen_events (key, seen_at) VALUES (?, ?)',
+                                     [(key, wall_now) for key in keys])
+                self._db.execute('DELETE FROM seen_events WHERE seen_at < ?', (wall_now - self.window,))
+                self._db.commit()
+
+    def release(self, keys: list[str]):
+        """Forget the event with these keys, so it is handled again if it is redelivered."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
@@ -0,0 +1,149 @@
+"""
+Client-side rate limiting for the APIs Secretary calls, shared by the Trello client and the Slack sender.
+
+A RequestScheduler is a token bucket sized to one API's rate limits, with two priorities: background requests
+yield to interactive ones. When the API responds 429 anyway, all requests pause for its Retry-After time.
+
+Usage example:
+scheduler = RequestScheduler(max_requests=100, window=10.0)
+for attempt in range(scheduler.max_retries + 1):
+    scheduler.acquire('background')
+    response = send_request()
+    if response.status_code != 429:
+        break
+    scheduler.rate_limited(attempt, response.headers.get('Retry-After'))
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+PRIORITIES = ['interactive', 'background']
+
+
+class RequestScheduler():
+    """
+    Paces requests to an API with a token bucket sized to its rate limits, and backs off when it responds 429.
+
+    Requests wait for a token before they are sent. Background requests (eg. the morning digest or a card store sync)
+    only get a token when no interactive request (eg. a Slack turn) is waiting for one.
+    A 429 pauses all requests for the Retry-After time if the API gives one, or else for a jittered exponential backoff.
+    """
+
+    def __init__(self,
+                 max_requests: int,
+                 window: float,
+                 max_retries: int = 5,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        max_requests, window: Allow bursts of up to max_requests, refilled at max_requests per window seconds.
+        max_retries: How many times to retry a request that got a 429 before giving up.
+        base_backoff, max_backoff: Bounds, in seconds, of the exponential backoff used when there is no Retry-After.
+        clock: Gets the time in seconds. Tests pass a fake one.
+        """
+        self.clock = clock
+        self.capacity = max_requests
+        self.refill_rate = max_requests / window
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Condition()
+        self._tokens = float(max_requests)
+        self._refilled_at = clock()
+        self._paused_until = 0.0
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._requests = {priority: 0 for priority in PRIORITIES}
+        self._throttled = {priority: 0 for priority in PRIORITIES}
+        self._throttle_wait = {priority: 0.0 for priority in PRIORITIES}
+        self._rate_limited_responses = 0
+
+    def try_acquire(self, priority: str = 'interactive') -> float:
+        """
+        Take a token if one is free for this priority, without blocking.
+        Returns 0 if it got one, else how many seconds to wait before trying again.
+        """
+        with self._lock:
+            return self._try_take(priority)
+
+    def _try_take(self, priority: str) -> float:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled_at) * self.refill_rate)
+        self._refilled_at = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if priority != 'interactive' and self._waiting['interactive'] > 0:
+            return 1 / self.refill_rate
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.refill_rate
+
+    def _record(self, priority: str, waited: float):
+        self._requests[priority] += 1
+        if waited > 0:
+            self._throttled[priority] += 1
+            self._throttle_wait[priority] += waited
+
+    def acquire(self, priority: str = 'interactive'):
+        """Block until a request of this priority may be sent."""
+        start = self.clock()
+        throttled = False
+        with self._lock:
+            self._waiting[priority] += 1
+            try:
+                while (wait := self._try_take(priority)) > 0:
+                    throttled = True
+                    self._lock.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+            self._record(priority, self.clock() - start if throttled else 0)
+            self._lock.notify_all()
+
+    async def acquire_async(self, priority: str = 'interactive'):
+        """Wait, without blocking the event loop, until a request of this priority may be sent."""
+        start = self.clock()
+        throttled = False
+        with self._lock:
+            self._waiting[priority] += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_take(priority)
+                if wait <= 0:
+                    break
+                throttled = True
+                await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self._waiting[priority] -= 1
+                self._record(priority, self.clock() - start if throttled else 0)
+                self._lock.notify_all()
+
+    def rate_limited(self, attempt: int, retry_after: Optional[str] = None):
+        """Record a 429 response to the attempt'th try of a request, and pause all requests accordingly."""
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(self.max_backoff, self.base_backoff * 2**attempt)
+        delay += random.uniform(0, min(self.max_backoff, self.base_backoff * 2**attempt)) # jitter so paused requests don't all retry at once
+        with self._lock:
+            self._rate_limited_responses += 1
+            self._paused_until = max(self._paused_until, self.clock() + delay)
+            self._lock.notify_all()
+
+    def metrics(self) -> dict[str, Any]:
+        """
+        Get the scheduler's counters: how many requests are queued for a token and how many were sent, per priority,
+        how many of those had to wait and for how many seconds in total, and how many 429 responses came back.
+        """
+        with self._lock:
+            return {'queue_depth': dict(self._waiting),
+                    'requests': dict(self._requests),
+                    'throttled_requests': dict(self._throttled),
+                    'throttle_wait_seconds': dict(self._throttle_wait),
+                    'rate_limited_responses': self._rate_limited_responses}
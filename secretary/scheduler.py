@@ -0,0 +1,274 @@
+"""
+A scheduler for daily jobs that run at a local time in each user's own timezone (eg. the 07:00 morning update).
+
+All the runs are kept in one heap, ordered by when they are due, and one timing thread sleeps until the next one
+and hands it to a bounded pool of workers, so a slow run doesn't hold up the runs for other keys. A key's runs
+never overlap: a run that comes due while its key is busy waits for it, and then runs in order.
+Local times are converted with the user's timezone on the day of each run, so runs follow DST transitions: a time
+that doesn't exist that day (skipped by springing forward) runs an hour later, and a time that happens twice
+(falling back) runs the first time.
+
+Each key gets a fixed jitter of up to max_jitter seconds, so thousands of users' 07:00 runs are spread
+out instead of all firing in the same second. The date of each pair's last run is saved in a state file, along with
+the schedule itself, so after a restart the runs that were missed within catch_up_window seconds are run right away,
+once, and the rest are skipped.
+
+Usage example:
+scheduler = Scheduler(state_path='schedule.json', max_jitter=300, workers=8)
+scheduler.add_job('morning_update', '07:00', send_morning_update) # called with the key
+scheduler.schedule('morning_update', user_id, 'America/Los_Angeles')
+scheduler.start()
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as datetime_time, timedelta
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# Longest the timing thread sleeps without checking the clock again, in case the system clock jumps (eg. after a suspend)
+MAX_SLEEP = 60.0
+
+
+class Scheduler():
+
+    def __init__(self, state_path: Optional[str] = None, max_jitter: float = 0, catch_up_window: Optional[float] = 3 * 3600,
+                 workers: int = 8):
+        """
+        state_path: A JSON file to save the schedule and each run's last date in, so they survive restarts.
+        max_jitter: Spread each key's runs up to this many seconds after the scheduled time.
+        catch_up_window: Run the runs missed (eg. while Secretary was down) within this many seconds, once. None to skip them.
+        workers: How many runs can run at once.
+        """
+        self.state_path = state_path
+        self.max_jitter = max_jitter
+        self.catch_up_window = catch_up_window
+        self.workers = workers
+        self._jobs = {} # job name -> (local time, fcn)
+        self._schedules = {} # (job name, key) -> {'time_zone', 'last_run', 'version'}
+        self._heap = [] # (due timestamp, sequence number, job name, key, version, local date of the run, is a catch-up run)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pool = None
+        self._slots = threading.Semaphore(workers) # free workers, so due runs wait in the heap rather than the pool's queue
+        self._busy_keys = {} # key -> runs that came due while one of the key's runs was running
+        self._stopped = False
+        self._dirty = False
+        self.stats = {'runs': 0, 'catch_up_runs': 0, 'failures': 0}
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            for job, schedules in state.get('schedules', {}).items():
+                for key, schedule in schedules.items():
+                    self._schedules[(job, key)] = {'time_zone': schedule['time_zone'],
+                                                   'last_run': schedule.get('last_run'),
+                                                   'version': 0}
+
+    ### Schedules ###
+
+    def add_job(self, job: str, local_time: str, fcn: Callable[[str], Any]):
+        """Define a daily job that runs fcn(key) at local_time (HH:MM) for every key it is scheduled for."""
+        hours, minutes = local_time.split(':')
+        with self._condition:
+            self._jobs[job] = (datetime_time(int(hours), int(minutes)), fcn)
+            # Schedules restored from the state file start once their job is defined
+            for (schedule_job, key), schedule in self._schedules.items():
+                if schedule_job == job:
+                    schedule['version'] += 1 # drops any runs queued by an earlier definition of the job
+                    self._push(job, key, time.time())
+
+    def schedule(self, job: str, key: str, time_zone: str):
+        """Run job for key every day, in time_zone. Rescheduling with a new time zone replaces the old schedule."""
+        with self._condition:
+            schedule = self._schedules.get((job, key))
+            if schedule is not None and schedule['time_zone'] == time_zone:
+                return
+            if schedule is None:
+                schedule = {'last_run': None, 'version': 0}
+                self._schedules[(job, key)] = schedule
+            schedule['time_zone'] = time_zone
+            schedule['version'] += 1
+            self._dirty = True
+            if job in self._jobs:
+                self._push(job, key, time.time())
+
+    def unschedule(self, job: str, key: str):
+        with self._condition:
+            if self._schedules.pop((job, key), None) is not None:
+                self._dirty = True
+
+    def scheduled(self, job: str) -> list[str]:
+        """The keys job is scheduled for."""
+        with self._condition:
+            return [key for schedule_job, key in self._schedules if schedule_job == job]
+
+    ### Deadlines ###
+
+    def jitter(self, job: str, key: str) -> float:
+        """
+        A fixed delay for key, spread evenly over [0, max_jitter]. It is the same for all of key's jobs,
+        so jobs that are scheduled a few minutes apart (eg. preparing a message, then sending it) stay in order.
+        """
+        if not self.max_jitter:
+            return 0.0
+        fraction = int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return fraction * self.max_jitter
+
+    def deadline(self, job: str, key: str, day: date) -> float:
+        """The timestamp at which job runs for key on the local date day, including jitter."""
+        local_time, _ = self._jobs[job]
+        tz = pytz.timezone(self._schedules[(job, key)]['time_zone'])
+        naive = datetime.combine(day, local_time)
+        try:
+            local = tz.localize(naive, is_dst=None)
+        except pytz.exceptions.NonExistentTimeError:
+            local = tz.normalize(tz.localize(naive, is_dst=False)) # skipped by springing forward, so an hour later
+        except pytz.exceptions.AmbiguousTimeError:
+            local = tz.localize(naive, is_dst=True) # happens twice when falling back, so the first time
+        return local.timestamp() + self.jitter(job, key)
+
+    def next_run(self, job: str, key: str, now: float) -> tuple[float, date]:
+        """
+        When job should next run for key, as of now, and the local date that run is for.
+        If the job has run for key before, and missed runs since then within catch_up_window,
+        the latest of them is due now (so several missed runs are caught up once).
+        """
+        schedule = self._schedules[(job, key)]
+        tz = pytz.timezone(schedule['time_zone'])
+        last_run = date.fromisoformat(schedule['last_run']) if schedule['last_run'] else None
+        today = datetime.fromtimestamp(now, tz).date()
+        missed = None
+        for day in [today - timedelta(days=1), today, today + timedelta(days=1), today + timedelta(days=2)]:
+            if last_run is not None and day <= last_run:
+                continue
+            due = self.deadline(job, key, day)
+            if due >= now:
+                return (now, missed) if missed is not None else (due, day)
+            if last_run is not None and self.catch_up_window is not None and now - due <= self.catch_up_window:
+                missed = day
+        raise RuntimeError(f'No next run for {job} {key}') # unreachable: one of the next two days is in the future
+
+    def _push(self, job: str, key: str, now: float):
+        schedule = self._schedules[(job, key)]
+        due, day = self.next_run(job, key, now)
+        catch_up = due > self.deadline(job, key, day) # due now, after the missed deadline
+        heapq.heappush(self._heap, (due, next(self._sequence), job, key, schedule['version'], day.isoformat(), catch_up))
+        self._condition.notify_all()
+
+    ### Running ###
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._stopped = False
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduled-job')
+                self._thread = threading.Thread(target=self._work, name='scheduler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop handing out runs, wait for the ones that are running, and save the schedule."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self.save()
+
+    def _pop_due(self) -> Optional[tuple]:
+        """Wait for the next run that is due, and pop it. None when stopped."""
+        with self._condition:
+            while not self._stopped:
+                # Drop runs of schedules that were since changed or removed
+                while self._heap and self._schedules.get((self._heap[0][2], self._heap[0][3]), {}).get('version') != self._heap[0][4]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait(MAX_SLEEP)
+                    continue
+                wait = self._heap[0][0] - time.time()
+                if wait > 0:
+                    if self._dirty:
+                        self._save_locked() # save while idle, not after every run
+                    self._condition.wait(min(wait, MAX_SLEEP))
+                    continue
+                return heapq.heappop(self._heap)
+            return None
+
+    def _work(self):
+        """The timing thread: hand each run to a worker when it is due, or queue it behind its key's running run."""
+        while (run := self._pop_due()) is not None:
+            key = run[3]
+            with self._condition:
+                if key in self._busy_keys:
+                    self._busy_keys[key].append(run)
+                    continue
+                self._busy_keys[key] = deque()
+            self._slots.acquire()
+            self._pool.submit(self._run_key, run)
+
+    def _run_key(self, run: tuple):
+        """Run a key's run on a worker, then the key's runs that came due meanwhile, in order."""
+        try:
+            while run is not None:
+                self._run(run)
+                with self._condition:
+                    waiting = self._busy_keys[run[3]]
+                    if waiting:
+                        run = waiting.popleft()
+                    else:
+                        del self._busy_keys[run[3]]
+                        run = None
+        finally:
+            self._slots.release()
+
+    def _run(self, run: tuple):
+        due, _, job, key, _, day, catch_up = run
+        failed = False
+        try:
+            self._jobs[job][1](key)
+        except Exception:
+            logger.exception('Scheduled job %s for %s failed', job, key)
+            failed = True
+        with self._condition:
+            self.stats['failures'] += failed
+            self.stats['runs'] += 1
+            self.stats['catch_up_runs'] += catch_up
+            schedule = self._schedules.get((job, key))
+            if schedule is not None:
+                schedule['last_run'] = day
+                self._dirty = True
+                if schedule['version'] != run[4]:
+                    # Rescheduled while running: schedule() queued a run without knowing about this one, so replace it
+                    self._heap = [entry for entry in self._heap if entry[2:4] != (job, key)]
+                    heapq.heapify(self._heap)
+                self._push(job, key, max(time.time(), due + 1))
+
+    def save(self):
+        with self._condition:
+            self._save_locked()
+
+    def _save_locked(self):
+        self._dirty = False
+        if self.state_path is None:
+            return
+        schedules = {}
+        for (job, key), schedule in self._schedules.items():
+            schedules.setdefault(job, {})[key] = {'time_zone': schedule['time_zone'], 'last_run': schedule['last_run']}
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'schedules': schedules}, f)
+        os.replace(tmp_path, self.state_path)
@@ -1,12 +1,12 @@
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+import logging
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
-import threading
 import time
-from typing import Annotated, Any
+from typing import Annotated, Any, Optional
 
 import json
 import sys
@@ -15,16 +15,61 @@ sys.path.append('../secretary')
 import secretary.system_messages as sm
 import secretary.utils_openai as ai
 import secretary.tasks as tasks
+import secretary.utils_trello as utils_trello
+import secretary.sessions as sessions
+import secretary.tracing as tracing
+from secretary.sessions import current_session, use_session
+from secretary.user_profiles import UserProfileCache, profile_from_user
+from secretary.turn_queue import TurnQueue
+from secretary.event_dedup import EventDedupStore, event_keys, retry_number
+from secretary.scheduler import Scheduler
+from secretary.digest import DigestEngine, SlackSender
+from secretary.rate_limit import RequestScheduler
+from secretary.task_encoding import TaskAliases
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # https://github.com/slackapi/bolt-python#creating-an-app
 app = App(token=os.environ['SLACK_BOT_TOKEN'])
 
-convo_global = ai.Messages()
-user_time_zone_global = 'UTC'
-user_id_global = None
-user_name_global = None
+# Stream responses into Slack as they are generated, instead of posting them once they are complete
+STREAM_RESPONSES = os.environ.get('SECRETARY_STREAM_RESPONSES', 'true').lower() != 'false'
+STREAM_UPDATE_INTERVAL = 1.0 # seconds between edits of a streaming message, to stay well within Slack's rate limits
+
+# Each turn is traced: its spans (Slack, Trello and OpenAI calls, tool calls, ...) are written to a JSONL file,
+# and/or to a file of OTLP/JSON for an OpenTelemetry Collector. Summarize them with `python -m secretary.tracing`
+TRACE_FILE = os.environ.get('SECRETARY_TRACE_FILE')
+OTLP_TRACE_FILE = os.environ.get('SECRETARY_OTLP_TRACE_FILE')
+tracing.set_exporters(([tracing.JsonlExporter(TRACE_FILE)] if TRACE_FILE else [])
+                      + ([tracing.OtlpJsonExporter(OTLP_TRACE_FILE)] if OTLP_TRACE_FILE else []))
+
+# Minutes ahead of the morning update that its digest is computed, so it is delivered on time
+DIGEST_LEAD_MINUTES = int(os.environ.get('SECRETARY_DIGEST_LEAD_MINUTES', 5))
+
+# Estimated tokens of conversation history sent with each message. Older messages are folded into a short summary
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get('SECRETARY_CONVERSATION_TOKEN_BUDGET', 2000))
+# Estimated tokens of the longest message handled. The newest message is always sent whole, even over the budget above,
+# so longer messages are turned away instead of being cut short
+MAX_MESSAGE_TOKENS = int(os.environ.get('SECRETARY_MAX_MESSAGE_TOKENS', 30000))
+
+# Sessions hold each user's conversation, timezone and profile. Idle sessions are evicted after a few days
+MAX_SESSIONS = int(os.environ.get('SECRETARY_MAX_SESSIONS', 1000))
+SESSION_IDLE_TIMEOUT = float(os.environ.get('SECRETARY_SESSION_IDLE_TIMEOUT', 3 * 24 * 3600))
+
+def new_conversation() -> ai.Messages:
+    return ai.Messages(token_budget=CONVERSATION_TOKEN_BUDGET, summarize=True)
+
+session_store = sessions.SessionStore(new_conversation, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT)
+sessions.default_session.messages = new_conversation()
+
+# The tools the model can call while responding to a user. Schematized once, here, and reused every turn
+secretary_tools = ai.ToolRegistry()
+secretary_tools.register(tasks.update_task_description)
+secretary_tools.register(tasks.update_task_due_date)
+secretary_tools.register(tasks.mark_task_completed)
+secretary_tools.register(tasks.add_label_to_task)
 
 def extract_tasks_base(message: Annotated[str, "The message content to extract tasks from."],
                        current_user_local_time: Annotated[str, "The user's local datetime formatted as '%Y-%m-%d %H:%M:%S %z'"]) -> list[Any]:
@@ -36,104 +81,186 @@ def extract_tasks_base(message: Annotated[str, "The message content to extract t
     system_message += f'\nThe current date and time is {current_user_local_time}.'
     existing_labels_str = ', '.join(tasks.get_labels().keys())
     comment = f'{message}\n\nExisting Labels:\n{existing_labels_str}'
-    response, _ = ai.get_completion(comment=comment, system_message=system_message)
+    # Extraction depends only on the message, labels and date, so it is the one completion worth caching
+    response, _ = ai.get_completion(comment=comment, system_message=system_message, use_cache=True)
     new_tasks = json.loads(ai.clean_response_json(response))
     return new_tasks
 
-def extract_tasks(message: Annotated[str, "The verbatim user message content to extract tasks from. This should include all content and context relevant to the task(s)."]) -> list[Any]:
+@secretary_tools.register
+def extract_tasks(message: Annotated[str, "The verbatim user message content to extract tasks from. This should include all content and context relevant to the task(s)."]) -> dict[str, list]:
     """
     Given raw unformatted content from a user that mentions action items, tasks, or to-dos, this function extracts individual tasks in a structured format.
     """
-    global user_time_zone_global
-    current_user_local_time = datetime.now(pytz.timezone(user_time_zone_global)).strftime('%Y-%m-%d %H:%M:%S %z')
+    current_user_local_time = datetime.now(pytz.timezone(current_session().time_zone)).strftime('%Y-%m-%d %H:%M:%S %z')
     new_tasks = extract_tasks_base(message, current_user_local_time)
-    new_cards = tasks.add_new_tasks(new_tasks)
-    return new_cards
+    new_cards, failures = tasks.add_new_tasks(new_tasks)
+    # The summaries of the tasks whose cards couldn't be created, to tell the user about
+    return {'created': new_cards, 'failed': [task.get('summary') for task, _ in failures]}
 
-def task_follow_up(tasks):
+@tracing.traced()
+def task_follow_up(cards):
     """
     Given tasks without due dates, ask for due dates.
     """
-    global user_time_zone_global
-    global convo_global
+    tracing.current_span().set(cards=len(cards))
+    session = current_session()
 
     # Build the system and user messages
-    tasks_json = json.dumps(tasks)
+    tasks_table = TaskAliases(tasks.clean_tasks(cards)).encode()
     system_message = sm.follow_up_on_tasks
-    current_user_local_time = datetime.now(pytz.timezone(user_time_zone_global)).strftime('%Y-%m-%d %H:%M:%S %z')
+    current_user_local_time = datetime.now(pytz.timezone(session.time_zone)).strftime('%Y-%m-%d %H:%M:%S %z')
     system_message += f'\nThe current date and time is {current_user_local_time}.'
     full_messages = [{"role": "system", "content": system_message}]
-    full_messages += [{"role": "user", "content": f'Tasks:\n{tasks_json}'}]
-    full_messages += convo_global.messages
+    full_messages += [{"role": "user", "content": f'Tasks:\n{tasks_table}'}]
+    full_messages += session.messages.window()
     # Get the response/tool calls from the Chat API
     response, _ = ai.get_conversation_completion(messages=full_messages)
 
     return response
 
-def process_user_message(messages: list[Any]):
+def process_user_message(messages: list[Any], stream_writer: Optional['SlackStreamWriter'] = None):
     """
     Given a message from a user, decide what to do and then do it.
+    If a stream_writer is given, the response is streamed into it as it is generated.
     """
-    global user_time_zone_global
+    time_zone = current_session().time_zone
 
     # Build the system and user messages
-    existing_tasks = tasks.get_relevant_tasks(messages, user_time_zone_global)
-    tasks_json = json.dumps(existing_tasks)
+    with tracing.span('tasks.get_relevant_tasks') as span:
+        existing_tasks = tasks.get_relevant_tasks(messages, time_zone)
+        span.set(cards=len(existing_tasks))
+    # Tasks are shown to the model with short aliases instead of ids and urls, which are put back afterwards
+    aliases = TaskAliases(existing_tasks)
     system_message = sm.base_secretary
-    current_user_local_time = datetime.now(pytz.timezone(user_time_zone_global)).strftime('%Y-%m-%d %H:%M:%S %z')
+    current_user_local_time = datetime.now(pytz.timezone(time_zone)).strftime('%Y-%m-%d %H:%M:%S %z')
     system_message += f'\nThe current date and time is {current_user_local_time}.'
     full_messages = [{"role": "system", "content": system_message}]
-    full_messages += [{"role": "user", "content": f'Existing Tasks:\n{tasks_json}'}]
+    full_messages += [{"role": "user", "content": f'Existing Tasks:\n{aliases.encode()}'}]
     full_messages += messages
 
-    # Build the tools
-    tools = {}
-    ai.add_function_to_tools(tools, tasks.update_task_description)
-    ai.add_function_to_tools(tools, tasks.update_task_due_date)
-    ai.add_function_to_tools(tools, tasks.mark_task_completed)
-    ai.add_function_to_tools(tools, tasks.add_label_to_task)
-    ai.add_function_to_tools(tools, extract_tasks)
-    tool_schemas = [tools[name]['schema'] for name in tools]
+    # Tool calls run concurrently, except calls on the same task, which run in order
+    executor = ai.ToolExecutor(secretary_tools, prepare_arguments=aliases.resolve_arguments)
+    tool_schemas = secretary_tools.schemas
+
+    if stream_writer is None:
+        # Get the response/tool calls from the Chat API
+        response, tool_calls = ai.get_conversation_completion(messages=full_messages,
+                                                              tools=tool_schemas)
+        response = aliases.attach_urls(response)
+        for tool_call in tool_calls or []:
+            executor.submit(tool_call)
+    else:
+        # Stream the response into Slack as it arrives, and start each tool call as soon as it is complete
+        response = ''
+        stream_writer.transform = aliases.attach_urls
+        for kind, value in ai.stream_conversation_completion(messages=full_messages,
+                                                             tools=tool_schemas):
+            if kind == 'text':
+                response += value
+                stream_writer.write(value)
+            else:
+                executor.submit(value)
+        stream_writer.close()
+        response = aliases.attach_urls(response) or None
 
-    # Get the response/tool calls from the Chat API
-    response, tool_calls = ai.get_conversation_completion(messages=full_messages,
-                                                          tools=tool_schemas)
-    
+    # Collect the results in the order the model asked for them
     created_cards = []
     updated_cards = []
     done_cards = []
     tools_called = []
-    if tool_calls is not None:
-        # Iterate through tool calls
-        for tool_call in tool_calls:
-            func_name = tool_call.function.name
-            tools_called.append(func_name)
-            arguments = json.loads(tool_call.function.arguments)
-            func = tools[func_name]['callable']
-            card = func(**arguments)
-            if func_name=='extract_tasks':
-                created_cards += card # extract_tasks return a list of tasks
-            elif func_name=='mark_task_completed':
-                done_cards.append(card)
-            else:
-                updated_cards.append(card)
+    failed_tools = []
+    failed_tasks = []
+    with tracing.span('tool_calls') as span:
+        results = executor.results()
+        span.set(tools=[result['name'] for result in results])
+    for result in results:
+        func_name = result['name']
+        tools_called.append(func_name)
+        if result['error'] is not None:
+            logger.warning('Tool call %s(%s) failed', func_name, result['arguments'], exc_info=result['error'])
+            failed_tools.append(result)
+        elif func_name=='extract_tasks':
+            created_cards.extend(result['result']['created'])
+            failed_tasks.extend(result['result']['failed'])
+        elif func_name=='mark_task_completed':
+            done_cards.append(result['result'])
+        else:
+            updated_cards.append(result['result'])
     
-    return response, created_cards, updated_cards, done_cards, tools_called
+    return response, created_cards, updated_cards, done_cards, tools_called, failed_tools, failed_tasks
+
+def fetch_user_profile(userID) -> dict[str, str]:
+    with tracing.span('slack.users_info'):
+        response = app.client.users_info(user=userID)
+    return profile_from_user(response['user'])
+
+# Seconds to keep users' names and timezones before looking them up again. user_change events update them sooner
+USER_PROFILE_TTL = float(os.environ.get('SECRETARY_USER_PROFILE_TTL', 3600))
+user_profiles = UserProfileCache(fetch_user_profile, ttl=USER_PROFILE_TTL)
 
 def get_user_name(userID) -> str:
-    response = app.client.users_profile_get(user=userID)
-    return response['profile']['real_name_normalized']
+    return user_profiles.get(userID)['name']
 
 def get_user_timezone(userID) -> str:
-    response = app.client.users_info(user=userID)
-    user_info = response['user']
-    return user_info.get('tz', 'Unknown Timezone')
+    return user_profiles.get(userID)['tz']
     
-def say_on_the_record(say, message):
-    global convo_global
+class SlackStreamWriter():
+    """
+    Posts text streamed from the Chat API to Slack as one message: posted as soon as the first text arrives,
+    then edited with chat_update as more arrives, at most once every min_update_interval seconds.
+    If transform is set, it is applied to the whole text before each post (eg. to turn task aliases into links).
+    """
 
+    def __init__(self, say, client, min_update_interval: float = STREAM_UPDATE_INTERVAL, transform=None):
+        self.say = say
+        self.client = client
+        self.min_update_interval = min_update_interval
+        self.transform = transform
+        self.text = ''
+        self.posted_text = ''
+        self.channel = None
+        self.ts = None
+        self._updated_at = 0.0
+
+    def write(self, delta: str):
+        self.text += delta
+        if not self.text.strip():
+            return
+        if self.ts is None:
+            response = self.say(self._render())
+            self.channel, self.ts = response['channel'], response['ts']
+            self.posted_text = self.text
+            self._updated_at = time.monotonic()
+        elif time.monotonic() - self._updated_at >= self.min_update_interval:
+            self._update()
+
+    def _render(self) -> str:
+        return self.transform(self.text) if self.transform else self.text
+
+    def _update(self):
+        with tracing.span('slack.chat_update', chars=len(self.text)):
+            self.client.chat_update(channel=self.channel, ts=self.ts, text=self._render())
+        self.posted_text = self.text
+        self._updated_at = time.monotonic()
+
+    def close(self):
+        """Post whatever text hasn't been posted yet."""
+        if self.ts is not None and self.text != self.posted_text:
+            self._update()
+
+
+def traced_say(say):
+    """Wrap a Slack say() so that each message it posts is a span of the current trace."""
+    if say is None:
+        return None
+    def say_traced(text: str = '', **kwargs):
+        with tracing.span('slack.say', chars=len(text or '')):
+            return say(text, **kwargs)
+    return say_traced
+
+def say_on_the_record(say, message):
     if message and len(message)>0:
-        convo_global.add_message('assistant', message)
+        current_session().messages.add_message('assistant', message)
         if say: say(message)
 
 def format_card_links(cards) -> str:
@@ -160,65 +287,81 @@ def card_link_description(cards, comment_single: str = "", comment_multiple: str
     return ""
 
 
+def get_board_snapshot(board: str):
+    """A due-date index over the board's cards, for digests. Secretary has one board, tasks.BOARD_NAME."""
+    with utils_trello.request_priority('background'):
+        return tasks.get_due_index()
+
+# Slack allows about one message per second per channel, and every user's digest goes to their own channel,
+# so the overall rate is bounded only to stay well clear of the workspace's limits
+SLACK_POST_RATE_REQUESTS = 20
+SLACK_POST_RATE_WINDOW = 1.0
+
+# Every user's digest is computed from one shared snapshot of the board, and posted at a bounded rate
+digest_engine = DigestEngine(get_board_snapshot,
+                             SlackSender(app.client, RequestScheduler(SLACK_POST_RATE_REQUESTS, SLACK_POST_RATE_WINDOW)))
+
+def prepare_morning_push_update():
+    """Compute the current session's user's morning digest ahead of time, as of when it will be delivered."""
+    session = current_session()
+    digest_engine.prepare(session.user_id, session.user_name, session.time_zone, tasks.BOARD_NAME,
+                          deliver_at=time.time() + 60 * DIGEST_LEAD_MINUTES)
+
 def morning_push_update():
     """
-    Send an update to the user (the global user_id_global) about the status of their tasks
+    Send an update to the current session's user about the status of their tasks
     due today and overdue.
     """
-    global user_id_global
-    global user_name_global
-    due_later_today = tasks.due_later_today()
-    overdue = tasks.overdue()
-    app.client.chat_postMessage(channel=user_id_global, text=f"Good morning {user_name_global}!")
-    if (len(due_later_today) == 0) & (len(overdue) == 0):
-        msg = f"Relax, you don't have anything to do today :beach_with_umbrella:"
-    else: 
-        if len(due_later_today) > 0:
-            msg = card_link_description(due_later_today,
-                                        f"You have only this one task to do later today:",
-                                        f"You have these tasks to do later today:")
-            app.client.chat_postMessage(channel=user_id_global, text=msg)
-        if len(overdue) > 0:
-            msg = card_link_description(overdue,
-                                        f"Just a reminder, you have only this one overdue task...",
-                                        f"Just a reminder, you have these overdue tasks...")
-            app.client.chat_postMessage(channel=user_id_global, text=msg)
+    session = current_session()
+    return digest_engine.deliver(session.user_id, session.user_name, session.time_zone, tasks.BOARD_NAME)
     
 def evening_push_update():
     """
-    Send an update to the user (the global user_id_global) about the status of their work today.
+    Send an update to the current session's user about the status of their work today.
     """
-    app.client.chat_postMessage(channel=user_id_global, text=f"Good night {user_name_global} :yawning_face:, really nice work today.")
+    session = current_session()
+    return digest_engine.sender.send(session.user_id, f"Good night {session.user_name} :yawning_face:, really nice work today.")
 
+@tracing.traced()
 def handle_message(user_name, message_text, say=None):
-    global convo_global
+    """Handle a message from the current session's user."""
+    convo = current_session().messages
+    say = traced_say(say)
 
     if message_text.strip().lower() == 'clear':
-        convo_global.clear()
+        convo.clear()
         if say: say('(My mind is a blank slate)')
         return
     
     if message_text.strip().lower() == 'overdue':
         # msg = f"From {user_name}:\nWhat tasks are overdue?"
-        # convo_global.add_message('user', msg)
+        # convo.add_message('user', msg)
         # card_link_description(say, tasks.overdue(), "This is the only overdue task:", "These tasks are overdue:")
         morning_push_update()
         return
 
     # say("(I hear you, let me think...)")
 
-    convo_global.keep_last(6)
-
     responses = {'initial': None,
                  'follow_up': None}
     
     msg = f"From {user_name}:\n{message_text}"
-    convo_global.add_message('user', msg)
+    if ai.estimate_tokens(msg) > MAX_MESSAGE_TOKENS:
+        # Not added to the conversation, so the next message isn't crowded out by it either
+        if say: say("Sorry, that message is too long for me to read in one go. Could you send it in smaller parts?")
+        return responses, []
+    convo.add_message('user', msg)
+    convo.trim()
     
-    response, created_cards, updated_cards, done_cards, tools_called = process_user_message(convo_global.messages)
+    stream_writer = SlackStreamWriter(say, app.client) if (say and STREAM_RESPONSES) else None
+    with tracing.span('process_user_message', messages=len(convo.messages), summarized=bool(convo.summary)):
+        response, created_cards, updated_cards, done_cards, tools_called, failed_tools, failed_tasks = process_user_message(convo.window(), stream_writer)
     responses['initial'] = response
 
-    say_on_the_record(say, response)
+    if stream_writer is not None:
+        say_on_the_record(None, response) # already said while streaming
+    else:
+        say_on_the_record(say, response)
 
     # Tell the user about completed, updated, and created tasks
     card_description = card_link_description(done_cards, "Great! I marked this task as done (and deleted it):", "Cool, I marked these tasks as done (and deleted them):")
@@ -227,6 +370,11 @@ def handle_message(user_name, message_text, say=None):
     say_on_the_record(say, card_description)
     card_description = card_link_description(created_cards, "I created this task:", "I created these tasks:")
     say_on_the_record(say, card_description)
+    if failed_tasks:
+        title = "Sorry, I couldn't create this task, please try again:" if len(failed_tasks) == 1 else "Sorry, I couldn't create these tasks, please try again:"
+        say_on_the_record(say, title + "\n" + "\n".join(f"• {summary}" for summary in failed_tasks))
+    if failed_tools:
+        say_on_the_record(say, "Something went wrong, and I couldn't finish everything you asked. Failed: " + ", ".join(result['name'] for result in failed_tools))
 
     # Follow up on tasks with no due date
     cards_without_due_dates = [card for card in updated_cards if card['due'] is None] + [card for card in created_cards if card['due'] is None]
@@ -240,41 +388,109 @@ def handle_message(user_name, message_text, say=None):
 
     return responses, tools_called
 
-@app.event("message")
-def handle_message_events(body, say):
-    global user_time_zone_global
-    global user_id_global
-    global user_name_global
+# Slack redelivers events that aren't acknowledged in time, or that failed. Remember which ones have been handled,
+# so a redelivered message doesn't create its tasks again. Optionally in a SQLite file, to survive restarts
+EVENT_DEDUP_WINDOW = float(os.environ.get('SECRETARY_EVENT_DEDUP_WINDOW', 3600))
+seen_events = EventDedupStore(window=EVENT_DEDUP_WINDOW, path=os.environ.get('SECRETARY_EVENT_DEDUP_STORE'))
+
+def run_turn(turn):
+    """Handle a queued turn, in its user's session."""
+    user_id = turn.key
+    keys = [key for context in turn.contexts for key in context.get('event_keys', [])]
+    # Events are acknowledged before their turn runs, so Slack never retries them, and a failed turn is done too.
+    # The turn queue logs the failure
+    try:
+        with tracing.trace('turn', user_id=user_id, messages=len(turn.texts)), use_session(session_store.get(user_id)) as session:
+            with tracing.span('get_user_profile'):
+                profile = user_profiles.get(user_id)
+            session.user_name = profile['name']
+            session.time_zone = profile['tz']
+            schedule_daily_updates(user_id, session.time_zone)
+
+            handle_message(session.user_name,
+                           turn.text,
+                           turn.context['say'])
+    finally:
+        seen_events.finish(keys)
+
+# Turns are handled on a pool of workers, so the listener can return (and Slack's event be acknowledged) right away.
+# When a user sends more messages while their turn is waiting, they are merged into it by default (see turn_queue.py)
+TURN_WORKERS = int(os.environ.get('SECRETARY_TURN_WORKERS', 8))
+MAX_QUEUED_TURNS = int(os.environ.get('SECRETARY_MAX_QUEUED_TURNS', 100))
+BACKPRESSURE_POLICY = os.environ.get('SECRETARY_BACKPRESSURE_POLICY', 'merge')
+turn_queue = TurnQueue(run_turn, workers=TURN_WORKERS, max_pending=MAX_QUEUED_TURNS, policy=BACKPRESSURE_POLICY)
 
+@app.event("message")
+def handle_message_events(body, say, request=None):
     if 'text' not in body['event']:
         return
+
+    # Drop redeliveries. A retry of a message that is still being handled joins that turn, which will do the replying
+    keys = event_keys(body)
+    state = seen_events.claim(keys)
+    if state != 'new':
+        retry = retry_number(body, request.headers if request is not None else None)
+        logger.info('Ignoring a redelivered event %s (retry %s), which is already %s', keys, retry, state)
+        return
     
-    user_id_global = body['event']['user']
-    user_name_global = get_user_name(body['event']['user'])
-    user_time_zone_global = get_user_timezone(body['event']['user'])
-
-    handle_message(user_name_global,
-                   body['event']['text'],
-                   say)
-
-def scheduled_daily_function_execution(target_time: str, fcn: callable):
-    """Run a task function every day at the target time (HH:MM) in the specified time zone."""
-    print(f"The function {fcn} will be run everyday at {target_time}")
-    while True:
-        # Get the current time in the user's time zone
-        current_user_local_time = datetime.now(pytz.timezone(user_time_zone_global))
-        if current_user_local_time.strftime("%H:%M") == target_time:
-            fcn()  # Execute the function
-            time.sleep(60)  # Avoid multiple executions within the same minute
-        time.sleep(30)  # Check every 30 seconds
+    # Turns for the same user run one at a time, in order, and different users run in parallel
+    if turn_queue.submit(body['event']['user'], body['event']['text'], say=say, event_keys=keys) == 'rejected':
+        seen_events.release(keys)
+        say("(Sorry, I'm still working on your earlier messages. Please try again in a moment)")
+
+@app.event("user_change")
+def handle_user_change_events(body):
+    user = body['event']['user']
+    profile = profile_from_user(user)
+    user_profiles.put(user['id'], profile)
+    if user['id'] in session_store:
+        session = session_store.get(user['id'])
+        session.user_name = profile['name']
+        session.time_zone = profile['tz']
+    if user['id'] in scheduler.scheduled('morning_push_update'):
+        # So the daily updates follow the user's new timezone before their next message
+        schedule_daily_updates(user['id'], profile['tz'])
+
+# Daily updates run at these local times, in each user's own timezone. Users get them once they've messaged Secretary.
+# Runs are spread over DAILY_UPDATE_JITTER seconds, and runs missed while Secretary was down for up to
+# DAILY_UPDATE_CATCH_UP seconds are run when it restarts, if the schedule is saved in SECRETARY_SCHEDULE_STATE.
+# Up to DAILY_UPDATE_WORKERS users' updates are sent at once, so a slow one doesn't delay the others
+MORNING_UPDATE_TIME = '07:00'
+EVENING_UPDATE_TIME = '22:30'
+DAILY_UPDATES = {'prepare_morning_push_update': ((datetime.strptime(MORNING_UPDATE_TIME, '%H:%M') - timedelta(minutes=DIGEST_LEAD_MINUTES)).strftime('%H:%M'),
+                                                 prepare_morning_push_update),
+                 'morning_push_update': (MORNING_UPDATE_TIME, morning_push_update),
+                 'evening_push_update': (EVENING_UPDATE_TIME, evening_push_update)}
+DAILY_UPDATE_JITTER = float(os.environ.get('SECRETARY_DAILY_UPDATE_JITTER', 300))
+DAILY_UPDATE_CATCH_UP = float(os.environ.get('SECRETARY_DAILY_UPDATE_CATCH_UP', 3 * 3600))
+DAILY_UPDATE_WORKERS = int(os.environ.get('SECRETARY_DAILY_UPDATE_WORKERS', 8))
+scheduler = Scheduler(state_path=os.environ.get('SECRETARY_SCHEDULE_STATE'),
+                      max_jitter=DAILY_UPDATE_JITTER, catch_up_window=DAILY_UPDATE_CATCH_UP, workers=DAILY_UPDATE_WORKERS)
+
+def run_daily_update(fcn):
+    """Make a scheduler job that runs fcn in a user's session."""
+    def run(user_id):
+        with tracing.trace(fcn.__name__, user_id=user_id), use_session(session_store.get(user_id)) as session:
+            profile = user_profiles.get(user_id)
+            session.user_name = profile['name']
+            session.time_zone = profile['tz']
+            fcn()
+    return run
+
+for job, (local_time, fcn) in DAILY_UPDATES.items():
+    scheduler.add_job(job, local_time, run_daily_update(fcn))
+
+def schedule_daily_updates(user_id: str, time_zone: str):
+    """Start (or move to a new timezone) the user's daily updates."""
+    for job in DAILY_UPDATES:
+        scheduler.schedule(job, user_id, time_zone)
 
 if __name__ == "__main__":
-    # Start the scheduling thread with time zone support
-    morning_push_update_thread = threading.Thread(target=scheduled_daily_function_execution, args=("07:00", morning_push_update), daemon=True)
-    evening_push_update_thread = threading.Thread(target=scheduled_daily_function_execution, args=("22:30", evening_push_update), daemon=True)
-    
-    morning_push_update_thread.start()
-    evening_push_update_thread.start()
+    logging.basicConfig(level=os.environ.get('SECRETARY_LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    # Start the scheduler for the daily updates
+    scheduler.start()
 
     # Start the Slack app
     handler = SocketModeHandler(app, os.environ['SLACK_APP_TOKEN'])
@@ -0,0 +1,123 @@
+"""
+Per-user session state for the Slack bot: each user's conversation history, timezone and profile.
+
+Sessions are kept in a SessionStore, keyed by Slack user id. The store is bounded: the least recently used sessions
+are evicted when there are more than max_sessions, and sessions that have been idle for longer than idle_timeout
+are evicted too. A turn runs inside use_session(), which holds the session's lock, so one user's turns run one at
+a time while different users' turns run in parallel, and makes it the current_session() for the code it calls
+(including tool calls running on other threads, which get a copy of the context).
+
+Usage example:
+sessions = SessionStore()
+with use_session(sessions.get(user_id)) as session:
+    session.messages.add_message('user', text)
+    ...
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+from typing import Callable, Optional
+
+import secretary.utils_openai as ai
+
+
+class Session():
+
+    def __init__(self, key: str, messages: ai.Messages, user_id: Optional[str] = None,
+                 user_name: Optional[str] = None, time_zone: str = 'UTC'):
+        self.key = key
+        self.messages = messages
+        self.user_id = user_id
+        self.user_name = user_name
+        self.time_zone = time_zone
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.active_turns = 0 # turns running or waiting in use_session(). Sessions with active turns aren't evicted
+        self._active_turns_lock = threading.Lock()
+
+    def _add_active_turns(self, n: int):
+        with self._active_turns_lock:
+            self.active_turns += n
+
+    def __repr__(self):
+        return f'Session({self.key!r}, user_name={self.user_name!r}, time_zone={self.time_zone!r})'
+
+
+class SessionStore():
+
+    def __init__(self, new_messages: Callable[[], ai.Messages] = ai.Messages,
+                 max_sessions: int = 1000, idle_timeout: Optional[float] = 3 * 24 * 3600):
+        """
+        new_messages: Makes the conversation history of a new session.
+        max_sessions: The most sessions to keep. The least recently used session is evicted to make room.
+        idle_timeout: Evict sessions that haven't been used for this many seconds. None to never time out.
+        """
+        self.new_messages = new_messages
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict() # key -> Session, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key: str):
+        return key in self._sessions
+
+    def get(self, key: str, user_id: Optional[str] = None) -> Session:
+        """Get the session for key, creating it if there isn't one. user_id defaults to key."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = Session(key, self.new_messages(), user_id=user_id or key)
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            session.last_used = now
+            self._evict(now)
+            return session
+
+    def sessions(self) -> list[Session]:
+        """All the sessions, least recently used first."""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def remove(self, key: str):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def _evict(self, now: float):
+        """Drop idle sessions, then the least recently used ones while there are too many. Sessions in use are kept."""
+        for key, session in list(self._sessions.items()):
+            over_capacity = len(self._sessions) > self.max_sessions
+            idle = self.idle_timeout is not None and now - session.last_used > self.idle_timeout
+            if not (over_capacity or idle):
+                break # the rest were used more recently
+            if session.active_turns == 0:
+                del self._sessions[key]
+
+
+# The session of the turn being handled. Outside of a turn (eg. in tests and scripts), a default session is used
+default_session = Session('default', ai.Messages())
+_current_session = contextvars.ContextVar('current_session', default=None)
+
+def current_session() -> Session:
+    return _current_session.get() or default_session
+
+@contextmanager
+def use_session(session: Session):
+    """Make session the current session, holding its lock so no other turn for the same session runs meanwhile."""
+    session._add_active_turns(1)
+    try:
+        with session.lock:
+            token = _current_session.set(session)
+            try:
+                yield session
+            finally:
+                session.last_used = time.monotonic()
+                _current_session.reset(token)
+    finally:
+        session._add_active_turns(-1)
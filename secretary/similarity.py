@@ -0,0 +1,150 @@
+"""
+A vectorized cosine-similarity index over task embeddings.
+
+The index keeps the embeddings L2-normalized in one float32 matrix (optionally int8-quantized, for 4x less memory),
+so scoring a query against every task is a single matrix-vector product, and picking the top k is an argpartition.
+Rows can be added, replaced and removed incrementally as cards are created, edited and deleted.
+
+Usage example:
+index = SimilarityIndex(dims=1536)
+index.add(['card1', 'card2'], embeddings)
+for card_id, score in index.top_k(query_embedding, k=10, threshold=0.2):
+    ...
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# Rows are scored in blocks of this many when quantized, to bound the size of the temporary float32 copy
+QUANTIZED_BLOCK_ROWS = 8192
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row. All-zero rows stay zero."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class SimilarityIndex():
+
+    def __init__(self, dims: int, quantize: bool = False, initial_capacity: int = 1024):
+        """
+        dims: The size of the embeddings.
+        quantize: Store rows as int8 with one float32 scale per row, instead of as float32.
+        initial_capacity: Number of rows to allocate up front. The matrix doubles in size whenever it fills up.
+        """
+        self.dims = dims
+        self.quantize = quantize
+        self.ids = []
+        self._row_of = {}
+        self._matrix = np.zeros((initial_capacity, dims), dtype=np.int8 if quantize else np.float32)
+        self._scales = np.zeros(initial_capacity, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id: str):
+        return id in self._row_of
+
+    @property
+    def nbytes(self) -> int:
+        return self._matrix[:len(self)].nbytes + (self._scales[:len(self)].nbytes if self.quantize else 0)
+
+    ### Updates ###
+
+    def _grow(self, min_capacity: int, n_rows: int):
+        """Reallocate to hold at least min_capacity rows, keeping the first n_rows rows."""
+        capacity = max(min_capacity, 2 * len(self._matrix))
+        matrix = np.zeros((capacity, self.dims), dtype=self._matrix.dtype)
+        matrix[:n_rows] = self._matrix[:n_rows]
+        scales = np.zeros(capacity, dtype=np.float32)
+        scales[:n_rows] = self._scales[:n_rows]
+        self._matrix = matrix
+        self._scales = scales
+
+    def _set_rows(self, rows: np.ndarray, vectors: np.ndarray):
+        vectors = normalize(vectors)
+        if self.quantize:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self._matrix[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[rows] = scales
+        else:
+            self._matrix[rows] = vectors
+
+    def add(self, ids: list[str], vectors: np.ndarray):
+        """Add rows for the ids, replacing the rows of ids that are already in the index."""
+        vectors = np.atleast_2d(vectors)
+        n_rows = len(self)
+        rows = []
+        for id in ids:
+            if id not in self._row_of:
+                self._row_of[id] = len(self.ids)
+                self.ids.append(id)
+            rows.append(self._row_of[id])
+        if len(self) > len(self._matrix):
+            self._grow(len(self), n_rows)
+        self._set_rows(np.array(rows, dtype=np.int64), vectors)
+
+    def remove(self, ids: list[str]):
+        """Remove the rows for the ids that are in the index, by moving the last row into each one's place."""
+        for id in ids:
+            row = self._row_of.pop(id, None)
+            if row is None:
+                continue
+            last = len(self.ids) - 1
+            if row != last:
+                last_id = self.ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._scales[row] = self._scales[last]
+                self.ids[row] = last_id
+                self._row_of[last_id] = row
+            self.ids.pop()
+
+    def rows(self, ids: list[str]) -> np.ndarray:
+        """Get the rows of the ids, for indexing the output of scores()."""
+        return np.array([self._row_of[id] for id in ids], dtype=np.int64)
+
+    ### Queries ###
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Get the cosine similarity of every row to the query. Returns one score per row, in row order (see ids).
+        A batch of queries (one per row of queries) gives a matrix of scores, one row per query.
+        """
+        single = np.ndim(queries) == 1
+        queries = normalize(queries)
+        n = len(self)
+        if not self.quantize:
+            scores = queries @ self._matrix[:n].T
+        else:
+            scores = np.empty((len(queries), n), dtype=np.float32)
+            for start in range(0, n, QUANTIZED_BLOCK_ROWS):
+                end = min(start + QUANTIZED_BLOCK_ROWS, n)
+                block = self._matrix[start:end].astype(np.float32)
+                scores[:, start:end] = (queries @ block.T) * self._scales[start:end]
+        return scores[0] if single else scores
+
+    def top_k(self, query: np.ndarray, k: int, threshold: Optional[float] = None) -> list[tuple[str, float]]:
+        """Get the (id, score) of the k rows most similar to the query, best first, leaving out scores below threshold."""
+        return self.top_k_batch(np.atleast_2d(query), k, threshold)[0]
+
+    def top_k_batch(self, queries: np.ndarray, k: int, threshold: Optional[float] = None) -> list[list[tuple[str, float]]]:
+        """The batch version of top_k(): one list of (id, score) per row of queries."""
+        n = len(self)
+        k = min(k, n)
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        scores = self.scores(np.atleast_2d(queries))
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (len(scores), 1))
+        results = []
+        for query_scores, query_top in zip(scores, top):
+            query_top = query_top[np.argsort(-query_scores[query_top], kind='stable')]
+            results.append([(self.ids[row], float(query_scores[row])) for row in query_top
+                            if threshold is None or query_scores[row] >= threshold])
+        return results
@@ -0,0 +1,71 @@
+"""
+A compact encoding of tasks for prompts.
+
+Instead of a json list of dicts with 24-character Trello ids and full urls, tasks are encoded as a header row and
+one tab-separated row per task, with a short alias (T1, T2, ...) in place of the id and no url. The model refers
+to tasks by their alias, and TaskAliases maps the aliases in tool-call arguments back to the real ids, and
+turns <alias|name> links in the model's responses back into <url|name> links.
+
+Usage example:
+aliases = TaskAliases(tasks)
+prompt = f'Existing Tasks:\n{aliases.encode()}'
+...
+arguments = aliases.resolve_arguments(arguments)
+response = aliases.attach_urls(response)
+"""
+
+import re
+from typing import Any
+
+# Columns in the order they are encoded, after the alias. Columns that are empty for every task are left out
+COLUMNS = ['name', 'due', 'closed', 'email', 'desc']
+
+ALIAS_LINK_PATTERN = re.compile(r'<(T\d+)\|')
+
+def _cell(value) -> str:
+    """Flatten a value onto one line, so it can't break the row structure."""
+    if value is True:
+        return 'yes'
+    if value is False or value is None:
+        return ''
+    return str(value).replace('\\', '\\\\').replace('\t', ' ').replace('\r', '').replace('\n', '\\n')
+
+
+class TaskAliases():
+
+    def __init__(self, tasks: list[dict[str, Any]], prefix: str = 'T'):
+        """tasks: Cleaned tasks (see tasks.clean_tasks()). Each gets the alias {prefix}1, {prefix}2, ... in order."""
+        self.tasks = tasks
+        self.ids = {}  # alias -> id
+        self.aliases = {}  # id -> alias
+        self.urls = {}  # alias -> url
+        for i, task in enumerate(tasks):
+            alias = f'{prefix}{i+1}'
+            self.ids[alias] = task['id']
+            self.aliases[task['id']] = alias
+            if task.get('url'):
+                self.urls[alias] = task['url']
+
+    def encode(self) -> str:
+        """A header row, then one tab-separated row per task."""
+        columns = [column for column in COLUMNS if any(task.get(column) for task in self.tasks)]
+        rows = ['\t'.join(['alias'] + columns)]
+        for task in self.tasks:
+            rows.append('\t'.join([self.aliases[task['id']]] + [_cell(task.get(column)) for column in columns]))
+        return '\n'.join(rows)
+
+    def resolve_id(self, id: str) -> str:
+        """The real id for an alias. Anything else (eg. an id the model copied from elsewhere) is returned unchanged."""
+        return self.ids.get(id.strip(), id) if isinstance(id, str) else id
+
+    def resolve_arguments(self, arguments: dict[str, Any]) -> dict[str, Any]:
+        """Tool-call arguments with any alias in the id argument replaced by the real id."""
+        if 'id' in arguments:
+            arguments = {**arguments, 'id': self.resolve_id(arguments['id'])}
+        return arguments
+
+    def attach_urls(self, text: str) -> str:
+        """Turn the <alias|name> task links in text into <url|name> links."""
+        if not text:
+            return text
+        return ALIAS_LINK_PATTERN.sub(lambda match: f'<{self.urls[match[1]]}|' if match[1] in self.urls else match[0], text)
@@ -1,13 +1,109 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import numpy as np
+import os
+import re
+import threading
 from typing import Annotated
 from datetime import datetime, timedelta
 import pytz
-from typing import Annotated, Any
+from typing import Annotated, Any, Optional
 
 import secretary.utils_trello as utils_trello
 import secretary.utils_openai as ai
+from secretary.card_store import CardStore
+from secretary.due_index import DueIndex
+from secretary.embedding_store import EmbeddingStore
+from secretary.similarity import SimilarityIndex
+
+logger = logging.getLogger(__name__)
 
 BOARD_NAME = 'Secretary'
+MAX_CARD_CREATION_WORKERS = 8
+RELEVANT_TASKS_TOP_K = 20 # at most this many tasks (plus any referenced in the conversation) go into the prompt
+SIMILAR_TASK_THRESHOLD = 0.2 # a bit of ad-hoc testing showed about 0.2 is a good threshold
+RELEVANT_TASKS_RECENT_MESSAGES = 4
+TASK_EMBEDDING_CACHE_SIZE = 5000 # embeddings kept in memory when there is no embedding store, about 6 KB each
+
+# Optional local replica of the board that reads are served from. See enable_card_store().
+card_store = None
+
+def enable_card_store(path: str, max_staleness: float = 30.0, board_name: Optional[str] = None):
+    """
+    Serve task reads from a local SQLite replica of the board at path, synced with Trello whenever it is
+    more than max_staleness seconds old. The replica mirrors board_name (default: BOARD_NAME at the time of the call).
+    """
+    global card_store
+    card_store = CardStore(path, board_name or BOARD_NAME, max_staleness=max_staleness)
+    return card_store
+
+if os.environ.get('SECRETARY_CARD_STORE'):
+    enable_card_store(os.environ['SECRETARY_CARD_STORE'],
+                      max_staleness=float(os.environ.get('SECRETARY_CARD_STORE_MAX_STALENESS', 30)))
+
+# Optional persistent store of task embeddings. See enable_embedding_store().
+embedding_store = None
+
+def enable_embedding_store(path: str):
+    """Keep task embeddings in a persistent store in the directory at path, so they survive restarts."""
+    global embedding_store
+    embedding_store = EmbeddingStore(path, model=ai.EMBEDDING_MODEL, dims=ai.EMBEDDING_DIMS)
+    return embedding_store
+
+if os.environ.get('SECRETARY_EMBEDDING_STORE'):
+    enable_embedding_store(os.environ['SECRETARY_EMBEDDING_STORE'])
+
+def _get_cards():
+    """Get all cards on the BOARD_NAME board, from the local replica if there is one."""
+    if card_store is not None:
+        return card_store.get_cards()
+    board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
+    return utils_trello.get_cards_on_board(board_id)
+
+_due_index_cache = (None, None, None) # (card store, its version, index)
+
+def get_due_index() -> DueIndex:
+    """
+    Get a due-date index over the cards on the BOARD_NAME board.
+    With a local card store, the index is built once per version of the replica and reused until it changes.
+    """
+    global _due_index_cache
+    store = card_store
+    if store is None:
+        return DueIndex(_get_cards())
+    store.ensure_fresh()
+    cached_store, version, index = _due_index_cache
+    if index is None or cached_store is not store or version != store.version:
+        version = store.version
+        index = DueIndex(store.get_cards(max_staleness=float('inf')))
+        _due_index_cache = (store, version, index)
+    return index
+
+def _localize_due_dates(cards, timezone_str):
+    """Copy the cards with their due dates converted to the local time zone."""
+    local_cards = []
+    for card in cards:
+        card = dict(card)
+        card['due'] = convert_iso8601_to_local_string(card.get('due'), timezone_str)
+        local_cards.append(card)
+    return local_cards
+
+def _record_card(card):
+    """Write a card that was just created or updated through to the local replica, if there is one."""
+    if card_store is not None and 'id' in card:
+        card_store.upsert_card(card)
+    return card
+
+def _record_deleted_card(id):
+    if card_store is not None:
+        card_store.remove_card(id)
+    if embedding_store is not None:
+        embedding_store.remove_card(id)
+    with _similarity_lock:
+        similarity_index.remove([id])
+        _indexed_texts.pop(id, None)
 
 def convert_time_to_iso8601_string(datetime_str: Annotated[str, 'datetime in YYYY-MM-DD HH:MM:SS +UTC_offset format']):
     # Try to convert the input string into a datetime. Will fail if it is not formatted as "YYYY-MM-DD HH:MM:SS +UTC"
@@ -73,81 +169,68 @@ def get_tasks(timezone_str: Annotated[str, "A string giving the time zone to rep
     """
     Get all tasks on the BOARD_NAME board, with their due dates in local time zone.
     """
-    board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
-    cards = utils_trello.get_cards_on_board(board_id)
+    cards = _get_cards()
     for card in cards:
         card['due'] = convert_iso8601_to_local_string(card['due'], timezone_str)
     return cards
 
-def overdue(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC'):
+def overdue(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC',
+            index: Optional[DueIndex] = None):
     """
     Get all overdue tasks.
     """
-    board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
-    cards = utils_trello.get_cards_on_board(board_id)
-    
+    if index is None:
+        index = get_due_index()
     now = datetime.now(pytz.timezone(timezone_str))
+    return _localize_due_dates(index.before(now), timezone_str)
 
-    filtered_cards = []
-    for card in cards:
-        utc_time_str = card['due'][:-1] + '+00:00'
-        utc_time = datetime.fromisoformat(utc_time_str)
-        card['due'] = convert_iso8601_to_local_string(card['due'], timezone_str)
-        if now > utc_time:
-            filtered_cards.append(card)
-
-    return filtered_cards
+def get_tasks_between_dates(start_datetime: datetime, end_datetime: datetime, timezone_str: Annotated[str, "A string giving the time zone to represent the tasks' time in, eg. 'America/Los_Angeles'"] = 'UTC',
+                            index: Optional[DueIndex] = None):
+    if index is None:
+        index = get_due_index()
+    return _localize_due_dates(index.between(start_datetime, end_datetime), timezone_str)
 
-def get_tasks_between_dates(start_datetime: datetime, end_datetime: datetime, timezone_str: Annotated[str, "A string giving the time zone to represent the tasks' time in, eg. 'America/Los_Angeles'"] = 'UTC'):
-    board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
-    cards = utils_trello.get_cards_on_board(board_id)
-    
-    filtered_cards = []
-    for card in cards:
-        utc_time_str = card['due'][:-1] + '+00:00'
-        utc_time = datetime.fromisoformat(utc_time_str)
-        card['due'] = convert_iso8601_to_local_string(card['due'], timezone_str)
-        if start_datetime <= utc_time <= end_datetime:
-            filtered_cards.append(card)
-
-    return filtered_cards
-
-def due_today(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC'):
+def due_today(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC',
+              index: Optional[DueIndex] = None):
     """
     Get the tasks due today, midnight to midnight in the specified timezone.
     """
     now = datetime.now(pytz.timezone(timezone_str))
     lastnight_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
     tonight_midnight = lastnight_midnight + timedelta(days=1)
-    return get_tasks_between_dates(lastnight_midnight, tonight_midnight, timezone_str)
+    return get_tasks_between_dates(lastnight_midnight, tonight_midnight, timezone_str, index)
 
-def due_earlier_today(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC'):
+def due_earlier_today(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC',
+                      index: Optional[DueIndex] = None):
     """
     Get the tasks that were due earlier today, between midnight in the specified timezone and now.
     """
     now = datetime.now(pytz.timezone(timezone_str))
     lastnight_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    return get_tasks_between_dates(lastnight_midnight, now, timezone_str)
+    return get_tasks_between_dates(lastnight_midnight, now, timezone_str, index)
 
-def due_later_today(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC'):
+def due_later_today(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC',
+                    index: Optional[DueIndex] = None):
     """
     Get the tasks due later today, between now and midnight in the specified timezone.
     """
     now = datetime.now(pytz.timezone(timezone_str))
     lastnight_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
     tonight_midnight = lastnight_midnight + timedelta(days=1)
-    return get_tasks_between_dates(now, tonight_midnight, timezone_str)
+    return get_tasks_between_dates(now, tonight_midnight, timezone_str, index)
 
-def due_tomorrow(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC'):
+def due_tomorrow(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC',
+                 index: Optional[DueIndex] = None):
     """
     Get the tasks due tomorrow, midnight to midnight in the specified timezone.
     """
     now = datetime.now(pytz.timezone(timezone_str))
     tomorrow_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
     tomorrow_end = tomorrow_midnight + timedelta(days=1)
-    return get_tasks_between_dates(tomorrow_midnight, tomorrow_end, timezone_str)
+    return get_tasks_between_dates(tomorrow_midnight, tomorrow_end, timezone_str, index)
 
-def due_this_week(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC'):
+def due_this_week(timezone_str: Annotated[str, "A string giving the time zone to use as a reference for 'today', eg. 'America/Los_Angeles'"] = 'UTC',
+                  index: Optional[DueIndex] = None):
     """
     Get the tasks due this week, between midnight Monday morning and midnight Sunday night in the specified timezone.
     """
@@ -155,7 +238,7 @@ def due_this_week(timezone_str: Annotated[str, "A string giving the time zone to
     lastnight_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
     start_of_this_week = lastnight_midnight - timedelta(lastnight_midnight.weekday())
     end_of_this_week = start_of_this_week + timedelta(days=7)
-    return get_tasks_between_dates(start_of_this_week, end_of_this_week, timezone_str)
+    return get_tasks_between_dates(start_of_this_week, end_of_this_week, timezone_str, index)
 
 def get_labels():
     board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
@@ -164,31 +247,58 @@ def get_labels():
     return labels
 
 
+# Held while labels are looked up and created, so that tool calls running in parallel don't create the same label twice
+_labels_lock = threading.Lock()
+
+def eager_get_label_id_map(names: list[str]) -> dict[str, str]:
+    """
+    Given a list of label names, find the ids of those that exist already, or create new labels and get their ids.
+    Returns a dict of lowercased label name to id. Each missing label is created only once.
+    """
+    with _labels_lock:
+        board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
+        existing_labels = get_labels()
+        label_id_map = {}
+        for name in names:
+            name = name.lower()
+            if name in label_id_map:
+                continue
+            if name in existing_labels:
+                label_id_map[name] = existing_labels[name]
+            elif name not in ['nan', 'nan', 'none', 'null']:
+                label_id_map[name] = utils_trello.create_label(board_id, name)['id']
+                existing_labels[name] = label_id_map[name]
+        return label_id_map
+
+
 def eager_get_label_ids(names: list[str]):
     """
     Given a list of label names, find the ids of those that exist already, or create new labels and get their ids.
     """
-    label_ids = []
+    label_id_map = eager_get_label_id_map(names)
+    return [label_id_map[name.lower()] for name in names if name.lower() in label_id_map]
+
+
+def eager_get_list_id_map(list_names: list[str]) -> dict[str, str]:
+    """
+    Given a list of list names, find their ids if they exist on the board already, or create them on that board and get their ids.
+    Returns a dict of list name to id. Each missing list is created only once.
+    """
     board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
-    existing_labels = get_labels()
-    for name in names:
-        name = name.lower()
-        if name in existing_labels:
-            label_ids.append(existing_labels[name])
-        elif name not in ['nan', 'nan', 'none', 'null']:
-            label_ids.append(utils_trello.create_label(board_id, name)['id'])
-    return label_ids
+    existing_lists = {board_list['name']: board_list['id'] for board_list in utils_trello.get_lists_on_board(board_id)}
+    list_id_map = {}
+    for list_name in list_names:
+        if list_name not in existing_lists:
+            existing_lists[list_name] = utils_trello.create_list(board_id, list_name)['id']
+        list_id_map[list_name] = existing_lists[list_name]
+    return list_id_map
 
 
 def eager_get_list_id(list_name: str):
     """
     Given a list name, find its id if it exists on the board already, or create it on that board and get its id.
     """
-    board_id = utils_trello.get_board_id(board_name=BOARD_NAME)
-    list_id = utils_trello.get_list_id(board_id, list_name)
-    if not list_id:
-        list_id = utils_trello.create_list(board_id, list_name)['id']
-    return list_id
+    return eager_get_list_id_map([list_name])[list_name]
 
 
 def update_task_description(id: Annotated[str, 'The id of the task to update'],
@@ -196,7 +306,7 @@ def update_task_description(id: Annotated[str, 'The id of the task to update'],
     """
     Update the description of a task.
     """
-    return utils_trello.update_card(id=id, update_field='desc', updated_value=updated_description)
+    return _record_card(utils_trello.update_card(id=id, update_field='desc', updated_value=updated_description))
 
 
 def update_task_due_date(id: Annotated[str, 'The id of the task to update'],
@@ -205,7 +315,7 @@ def update_task_due_date(id: Annotated[str, 'The id of the task to update'],
     Set or update the due date of a task.
     """
     due_date_utc = convert_time_to_iso8601_string(updated_due_date)
-    return utils_trello.update_card(id=id, update_field='due', updated_value=due_date_utc)
+    return _record_card(utils_trello.update_card(id=id, update_field='due', updated_value=due_date_utc))
 
 
 def update_task_completion(id: Annotated[str, 'The id of the task to update'],
@@ -216,8 +326,9 @@ def update_task_completion(id: Annotated[str, 'The id of the task to update'],
     if is_complete == 'true':
         card = utils_trello.get_card(card_id=id)
         utils_trello.delete_card(id=id)
+        _record_deleted_card(id)
         return card
-    return utils_trello.update_card(id=id, update_field='closed', updated_value=is_complete)
+    return _record_card(utils_trello.update_card(id=id, update_field='closed', updated_value=is_complete))
 
 
 def mark_task_completed(id: Annotated[str, 'The id of the task that is completed']):
@@ -226,6 +337,7 @@ def mark_task_completed(id: Annotated[str, 'The id of the task that is completed
     """
     card = utils_trello.get_card(card_id=id)
     utils_trello.delete_card(id=id)
+    _record_deleted_card(id)
     return card
 
 def add_label_to_task(id: Annotated[str, 'The id of the task to update'],
@@ -238,53 +350,336 @@ def add_label_to_task(id: Annotated[str, 'The id of the task to update'],
     card = utils_trello.get_card(id)
     label_ids_on_card = card['idLabels']
     label_ids = list(set(label_ids_to_add + label_ids_on_card))
-    return utils_trello.update_card(id=id, update_field='idLabels', updated_value=label_ids)
+    return _record_card(utils_trello.update_card(id=id, update_field='idLabels', updated_value=label_ids))
+
+
+def _task_text(task) -> str:
+    """The text of a task that gets embedded for similarity search."""
+    return f"{task.get('name', '')}\n{task.get('desc', '')}".strip()
+
+
+def _conversation_text(messages, n_recent: int = RELEVANT_TASKS_RECENT_MESSAGES) -> str:
+    """The text of the recent conversation, which tasks are compared to."""
+    if isinstance(messages, str):
+        return messages
+    return '\n'.join(str(message.get('content') or '') for message in messages[-n_recent:])
+
+
+def get_referenced_task_ids(tasks, messages, n_recent: int = RELEVANT_TASKS_RECENT_MESSAGES) -> set[str]:
+    """Get the ids of the tasks that are referenced in the recent conversation, by id, url or exact name."""
+    conversation = _conversation_text(messages, n_recent).lower()
+
+    def mentioned(text):
+        return text and re.search(rf'(?<!\w){re.escape(text.lower())}(?!\w)', conversation) is not None
+
+    return {task['id'] for task in tasks if mentioned(task['id']) or mentioned(task.get('url')) or mentioned(task.get('name'))}
+
+
+_task_embeddings = OrderedDict() # task text -> embedding, least recently used first. Used when there is no embedding store
+_task_embeddings_lock = threading.Lock()
+
+def get_task_embeddings(tasks) -> list[np.ndarray]:
+    """
+    Get the embedding of each task's text. Only the texts that haven't been embedded before are sent to the API,
+    in one batched call.
+    """
+    texts = [_task_text(task) for task in tasks]
+    known = {}
+    if embedding_store is None:
+        with _task_embeddings_lock:
+            for text in texts:
+                if text in _task_embeddings:
+                    _task_embeddings.move_to_end(text)
+                    known[text] = _task_embeddings[text]
+    else:
+        for text in texts:
+            if text not in known and (embedding := embedding_store.get(text)) is not None:
+                known[text] = embedding
+
+    missing = list(dict.fromkeys(text for text in texts if text not in known))
+    if missing:
+        for text, embedding in zip(missing, ai.get_embeddings(missing)):
+            known[text] = embedding.copy() # a row of the batch's matrix would keep the whole matrix alive
+            if embedding_store is not None:
+                embedding_store.put(text, embedding)
+        if embedding_store is None:
+            with _task_embeddings_lock:
+                for text in missing:
+                    _task_embeddings[text] = known[text]
+                while len(_task_embeddings) > TASK_EMBEDDING_CACHE_SIZE:
+                    _task_embeddings.popitem(last=False)
+
+    if embedding_store is not None:
+        for task, text in zip(tasks, texts):
+            if 'id' in task:
+                embedding_store.assign_card(task['id'], text)
+    return [known[text] for text in texts]
+
+
+# Similarity index over the embeddings of the tasks on the board, kept in step with the board by _sync_similarity_index()
+similarity_index = SimilarityIndex(dims=ai.EMBEDDING_DIMS)
+_indexed_texts = {} # task id -> the task text its row in the index was embedded from
+_similarity_lock = threading.Lock()
+
+def _sync_similarity_index(tasks):
+    """Add new and edited tasks to the similarity index, and remove the tasks that are no longer on the board."""
+    task_ids = {task['id'] for task in tasks}
+    removed = [id for id in _indexed_texts if id not in task_ids]
+    similarity_index.remove(removed)
+    for id in removed:
+        del _indexed_texts[id]
+
+    stale = [task for task in tasks if _indexed_texts.get(task['id']) != _task_text(task)]
+    if stale:
+        similarity_index.add([task['id'] for task in stale], np.array(get_task_embeddings(stale)))
+        for task in stale:
+            _indexed_texts[task['id']] = _task_text(task)
+
+
+def select_relevant_tasks(tasks,
+                          messages,
+                          top_k: int = RELEVANT_TASKS_TOP_K,
+                          threshold: float = SIMILAR_TASK_THRESHOLD):
+    """
+    Given cleaned tasks and the conversation, pick the tasks most relevant to the conversation:
+    tasks referenced in the recent conversation, plus the top_k tasks most similar to it whose similarity is above threshold.
+    Boards with no more than top_k tasks are returned whole.
+    """
+    if len(tasks) <= top_k:
+        return tasks
+
+    referenced = get_referenced_task_ids(tasks, messages)
+    # The newest messages matter most, so a conversation too long to embed loses its oldest text
+    conversation = ai.truncate_to_tokens(_conversation_text(messages), ai.EMBEDDING_MAX_INPUT_TOKENS, keep_end=True)
+    try:
+        content_embedding = ai.get_embedding(conversation)
+    except Exception:
+        logger.warning("Failed to embed the conversation, using only the tasks it references", exc_info=True)
+        return [task for task in tasks if task['id'] in referenced]
+    with _similarity_lock:
+        _sync_similarity_index(tasks)
+        most_similar = similarity_index.top_k(content_embedding, top_k, threshold)
+    tasks_by_id = {task['id']: task for task in tasks}
+    relevant = [task for task in tasks if task['id'] in referenced]
+    relevant += [tasks_by_id[id] for id, _ in most_similar if id not in referenced]
+    return relevant
 
 
 def get_relevant_tasks(content,
                        timezone_str: Annotated[str, "A string giving the time zone to represent the tasks' time in."]):
+    """
+    Get the tasks relevant to the conversation content (a list of messages), with their due dates in local time zone.
+    """
     tasks = get_tasks(timezone_str)
     tasks = clean_tasks(tasks)
-    # similar_task_threshold = 0.3 # a bit of ad-hoc testing showed about 0.2 is a good threshold
-    # similarity = get_task_similarity(tasks, content) #TODO
-    return tasks 
+    return select_relevant_tasks(tasks, content)
 
 
-def get_task_similarity(tasks, content):
-    content_embedding = ai.get_embedding(content)
+def _new_card_fields(task, list_id_map: dict[str, str], label_id_map: dict[str, str]) -> dict[str, Any]:
+    """Build the create_card() arguments for a new task, given the ids of the lists and labels on the board."""
+    if isinstance(task['requestor'], str):
+        description = f"Requestor: {task['requestor']}\nActor: {task['actor']}\n\n{task['notes']}"
+    else:
+        description = task['notes']
+    label_ids = list(dict.fromkeys(label_id_map[topic.lower()] for topic in task['topics'] if topic.lower() in label_id_map))
+    return {'list_id': list_id_map[task['type']],
+            'name': task['summary'].rstrip('.'), # no periods on the end of card names just because it looks nicer w/o them
+            'description': description,
+            'due': convert_time_to_iso8601_string(task['due_date']),
+            'label_ids': label_ids}
 
-    def dist(embedding):
-        dot_product = np.dot(embedding, content_embedding)
-        norm_vec1 = np.linalg.norm(embedding)
-        norm_vec2 = np.linalg.norm(content_embedding)
-        similarity = dot_product / (norm_vec1 * norm_vec2)
-        return similarity
-    
-    similarity = 0 #TODO 
 
-    return similarity
+def _record_created_card(response):
+    if 'id' not in response:
+        raise RuntimeError(f"Trello did not create the card: {response}")
+    return _record_card(response)
+
+
+def create_cards_for_tasks(tasks, max_workers: int = MAX_CARD_CREATION_WORKERS) -> list[tuple[Optional[dict[str, Any]], Optional[Exception]]]:
+    """
+    Given a list of new tasks, create trello cards for them.
+
+    All the lists and labels the tasks need are resolved (and created if missing) in one pass first, then the cards
+    are created concurrently on at most max_workers threads.
+    Returns one (card, error) pair per task, in the same order as the tasks. Exactly one of the pair is None.
+    """
+    list_id_map = eager_get_list_id_map(list(dict.fromkeys(task['type'] for task in tasks)))
+    label_id_map = eager_get_label_id_map([topic for task in tasks for topic in task['topics']])
+
+    def create_card(task):
+        response = utils_trello.create_card(**_new_card_fields(task, list_id_map, label_id_map))
+        return _record_created_card(response)
+
+    def try_create_card(task):
+        try:
+            return create_card(task), None
+        except Exception as e:
+            return None, e
+
+    if len(tasks) <= 1:
+        return [try_create_card(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(try_create_card, tasks))
+
+
+def add_new_tasks(tasks) -> tuple[list[dict[str, Any]], list[tuple[dict[str, Any], Exception]]]:
+    """
+    Given a list of new tasks, create trello cards for them.
+    Returns the cards that were created, as dicts, and a (task, error) pair for each task whose card could not be created.
+    """
+    cards = []
+    failures = []
+    for task, (card, error) in zip(tasks, create_cards_for_tasks(tasks)):
+        if error is not None:
+            logger.warning("Failed to create a card for task '%s': %r", task.get('summary'), error)
+            failures.append((task, error))
+        else:
+            cards.append(card)
+
+    _embed_new_cards(cards)
+    return cards, failures
+
+
+def _embed_new_cards(cards):
+    """Embed the new cards now, so they are ready for the next turn's retrieval."""
+    if embedding_store is not None and cards:
+        try:
+            get_task_embeddings(cards)
+        except Exception as e:
+            logger.warning('Failed to embed the new tasks: %r', e)
+
+
+### Async versions, so independent I/O in a turn can run concurrently with asyncio.gather ###
+# Trello requests are awaited, and the blocking work (the local replica's SQLite, the embedding store's memmap, and
+# embedding new cards) runs in threads with asyncio.to_thread, so it doesn't hold up the event loop
+
+async def _aget_cards():
+    if card_store is not None:
+        return await asyncio.to_thread(card_store.get_cards)
+    board_id = await utils_trello.aget_board_id(board_name=BOARD_NAME)
+    return await utils_trello.aget_cards_on_board(board_id)
+
+
+async def aget_tasks(timezone_str: Annotated[str, "A string giving the time zone to represent the tasks' time in, eg. 'America/Los_Angeles'"] = 'UTC'):
+    """
+    Get all tasks on the BOARD_NAME board, with their due dates in local time zone.
+    """
+    return _localize_due_dates(await _aget_cards(), timezone_str)
+
+
+async def aget_due_index() -> DueIndex:
+    """
+    Get a due-date index over the cards on the BOARD_NAME board. Pass it to overdue() and the due_*() functions.
+    """
+    if card_store is not None:
+        return await asyncio.to_thread(get_due_index)
+    return DueIndex(await _aget_cards())
+
+
+async def aget_labels():
+    board_id = await utils_trello.aget_board_id(board_name=BOARD_NAME)
+    labels = await utils_trello.aget_labels_on_board(board_id)
+    return {label['name']: label['id'] for label in labels if label['name']!=''}
+
+
+async def aeager_get_label_id_map(names: list[str]) -> dict[str, str]:
+    existing_labels = await aget_labels()
+    names = [name.lower() for name in names]
+    if any(name not in existing_labels and name not in ['nan', 'none', 'null'] for name in names):
+        # Creating labels goes through eager_get_label_id_map(), under the same lock as the sync path
+        return await asyncio.to_thread(eager_get_label_id_map, names)
+    return {name: existing_labels[name] for name in names if name in existing_labels}
+
+
+async def aeager_get_list_id_map(list_names: list[str]) -> dict[str, str]:
+    board_id = await utils_trello.aget_board_id(board_name=BOARD_NAME)
+    existing_lists = {board_list['name']: board_list['id'] for board_list in await utils_trello.aget_lists_on_board(board_id)}
+    list_id_map = {}
+    for list_name in list_names:
+        if list_name not in existing_lists:
+            existing_lists[list_name] = (await utils_trello.acreate_list(board_id, list_name))['id']
+        list_id_map[list_name] = existing_lists[list_name]
+    return list_id_map
+
+
+async def aupdate_task_description(id: Annotated[str, 'The id of the task to update'],
+                                   updated_description: Annotated[str, 'A new description to replace the old one with.']):
+    """
+    Update the description of a task.
+    """
+    card = await utils_trello.aupdate_card(id=id, update_field='desc', updated_value=updated_description)
+    return await asyncio.to_thread(_record_card, card)
+
+
+async def aupdate_task_due_date(id: Annotated[str, 'The id of the task to update'],
+                                updated_due_date: Annotated[str, 'The new due date, formatted as "YYYY-MM-DD HH:MM:SS +<UTC offset>"']):
+    """
+    Set or update the due date of a task.
+    """
+    due_date_utc = convert_time_to_iso8601_string(updated_due_date)
+    card = await utils_trello.aupdate_card(id=id, update_field='due', updated_value=due_date_utc)
+    return await asyncio.to_thread(_record_card, card)
+
+
+async def amark_task_completed(id: Annotated[str, 'The id of the task that is completed']):
+    """
+    Mark a task as completed.
+    """
+    card = await utils_trello.aget_card(card_id=id)
+    await utils_trello.adelete_card(id=id)
+    await asyncio.to_thread(_record_deleted_card, id)
+    return card
+
+
+async def aadd_label_to_task(id: Annotated[str, 'The id of the task to update'],
+                             label_names: Annotated[list[str], 'The names of the label(s) to add to the task']):
+    """
+    Add one or more label(s) to a task.
+    """
+    label_names = [label_name.lower() for label_name in label_names]
+    label_id_map, card = await asyncio.gather(aeager_get_label_id_map(label_names), utils_trello.aget_card(id))
+    label_ids = list(set(list(label_id_map.values()) + card['idLabels']))
+    card = await utils_trello.aupdate_card(id=id, update_field='idLabels', updated_value=label_ids)
+    return await asyncio.to_thread(_record_card, card)
+
+
+async def aget_relevant_tasks(content,
+                              timezone_str: Annotated[str, "A string giving the time zone to represent the tasks' time in."]):
+    tasks = clean_tasks(await aget_tasks(timezone_str))
+    return await asyncio.to_thread(select_relevant_tasks, tasks, content)
+
+
+async def acreate_cards_for_tasks(tasks, max_workers: int = MAX_CARD_CREATION_WORKERS) -> list[tuple[Optional[dict[str, Any]], Optional[Exception]]]:
+    """
+    The async version of create_cards_for_tasks(), with at most max_workers cards being created at once.
+    """
+    list_id_map, label_id_map = await asyncio.gather(
+        aeager_get_list_id_map(list(dict.fromkeys(task['type'] for task in tasks))),
+        aeager_get_label_id_map([topic for task in tasks for topic in task['topics']]))
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def try_create_card(task):
+        try:
+            async with semaphore:
+                response = await utils_trello.acreate_card(**_new_card_fields(task, list_id_map, label_id_map))
+            return await asyncio.to_thread(_record_created_card, response), None
+        except Exception as e:
+            return None, e
+
+    return list(await asyncio.gather(*[try_create_card(task) for task in tasks]))
 
 
-def add_new_tasks(tasks) -> list[dict[str, Any]]:
+async def aadd_new_tasks(tasks) -> tuple[list[dict[str, Any]], list[tuple[dict[str, Any], Exception]]]:
     """
-    Given a list of new tasks, create trello cards for them and return the cards as dicts.
+    The async version of add_new_tasks(): returns the cards that were created, and a (task, error) pair per failure.
     """
-    # make a new trello card for each task
     cards = []
-    for task in tasks:
-        list_id = eager_get_list_id(list_name=task['type'])
-        if isinstance(task['requestor'], str):
-            description = f"Requestor: {task['requestor']}\nActor: {task['actor']}\n\n{task['notes']}"
+    failures = []
+    for task, (card, error) in zip(tasks, await acreate_cards_for_tasks(tasks)):
+        if error is not None:
+            logger.warning("Failed to create a card for task '%s': %r", task.get('summary'), error)
+            failures.append((task, error))
         else:
-            description = task['notes']
-        label_ids = eager_get_label_ids(task['topics'])
-        due_date_utc = convert_time_to_iso8601_string(task['due_date'])
-        response = utils_trello.create_card(list_id,
-                                        name=task['summary'].rstrip('.'), # no periods on the end of card names just because it looks nicer w/o them
-                                        description=description,
-                                        due=due_date_utc,
-                                        label_ids=label_ids)
-        cards.append(response)
-
-    # TODO: embed the new tasks and record the embeddings
-    return cards
\ No newline at end of file
+            cards.append(card)
+    await asyncio.to_thread(_embed_new_cards, cards)
+    return cards, failures
@@ -0,0 +1,264 @@
+"""
+Per-turn latency tracing: where the time of a slow reply went.
+
+Each turn is a trace, and the work it does is a tree of spans: one around the turn, with nested spans around every
+Slack, Trello and OpenAI call, and around the steps in between (finding the relevant tasks, each tool call, the
+follow-up). Spans carry attributes, eg. the number of cards, the prompt's estimated tokens, or the tools called.
+The current span is kept in a context variable, so spans nest by themselves, also on threads that run in a copy of
+the context (eg. the ToolExecutor's pool).
+
+Finished spans are passed to the exporters set with set_exporters(): JsonlExporter writes one JSON object per span to
+a local file, and OtlpJsonExporter writes OpenTelemetry's OTLP/JSON to a local file, without any network or
+OpenTelemetry packages, for an OpenTelemetry Collector (its otlpjsonfile receiver) to pick up. With no exporters,
+spans are still timed, but go nowhere.
+
+Usage example:
+set_exporters([JsonlExporter('traces.jsonl')])
+with span('turn', user_id=user_id):
+    with span('trello.get_cards') as s:
+        cards = get_cards()
+        s.set(cards=len(cards))
+
+Summarize the p50/p95/p99 latency of each span from the JSONL file:
+python -m secretary.tracing traces.jsonl
+"""
+
+import argparse
+from contextlib import contextmanager
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_exporters = []
+
+
+class Span():
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f'{random.getrandbits(128):032x}'
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.duration = None # seconds, once the span has ended
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        """Add attributes to the span, eg. results that are only known once the work is done."""
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        """End the span, and export it. Ending it again does nothing."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = repr(error)
+        for exporter in _exporters:
+            try:
+                exporter.export(self)
+            except Exception as e:
+                logger.warning('Could not export span %s: %r', self.name, e)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'name': self.name,
+                'start_time': self.start_time,
+                'duration_ms': self.duration * 1000 if self.duration is not None else None,
+                'attributes': self.attributes,
+                'error': self.error}
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    Start a span as a child of the current span, without making it the current span. End it with span.end().
+    For work that the context manager can't wrap, eg. a generator, which runs in its caller's context.
+    """
+    return Span(name, _current_span.get(), **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the block as a span, nested in the current span (or as a new trace, if there is none)."""
+    s = start_span(name, **attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        s.end()
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Time the block as the root span of a new trace, even if there is a current span."""
+    token = _current_span.set(None)
+    try:
+        with span(name, **attributes) as s:
+            yield s
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator that times each call of the function as a span, named name (default: the function's name)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+### Exporters ###
+
+def set_exporters(exporters: list):
+    """Export every finished span to each of the exporters (objects with an export(span) method)."""
+    global _exporters
+    _exporters = list(exporters)
+
+
+class JsonlExporter():
+    """Appends each span to a file, as one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _otlp_value(value) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)} # 64-bit integers are strings in OTLP/JSON
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_otlp_value(item) for item in value]}}
+    return {'stringValue': str(value)}
+
+
+def otlp_span(span: Span) -> dict[str, Any]:
+    """A span in OTLP/JSON, OpenTelemetry's JSON encoding of its protocol."""
+    start_ns = int(span.start_time * 1e9)
+    otlp = {'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1, # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(start_ns),
+            'endTimeUnixNano': str(start_ns + int(span.duration * 1e9)),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {}} # STATUS_CODE_ERROR
+    if span.parent_id is not None:
+        otlp['parentSpanId'] = span.parent_id
+    return otlp
+
+
+class OtlpJsonExporter():
+    """
+    Appends each span to a file as an OTLP/JSON ExportTraceServiceRequest, one per line: the format the
+    OpenTelemetry Collector's otlpjsonfile receiver reads, so traces can be shipped to any tracing backend later.
+    """
+
+    def __init__(self, path: str, service_name: str = 'secretary'):
+        self.path = path
+        self.resource = {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]}
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        request = {'resourceSpans': [{'resource': self.resource,
+                                      'scopeSpans': [{'scope': {'name': 'secretary.tracing'},
+                                                      'spans': [otlp_span(span)]}]}]}
+        line = json.dumps(request, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+### Summaries ###
+
+def load_spans(path: str) -> list[dict[str, Any]]:
+    """Read the spans written by a JsonlExporter."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(spans: list[dict[str, Any]]) -> dict[str, dict[str, float]]:
+    """The count, errors, p50, p95, p99 and max duration (in ms) of the spans with each name."""
+    durations = {}
+    errors = {}
+    for s in spans:
+        if s.get('duration_ms') is None:
+            continue
+        durations.setdefault(s['name'], []).append(s['duration_ms'])
+        errors[s['name']] = errors.get(s['name'], 0) + bool(s.get('error'))
+    summary = {}
+    for name, values in durations.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary[name] = {'count': len(values), 'errors': errors[name],
+                         'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': max(values)}
+    return summary
+
+
+def format_summary(summary: dict[str, dict[str, float]]) -> str:
+    """A table of the summary, the spans with the most time at the 95th percentile first."""
+    width = max([len('span')] + [len(name) for name in summary])
+    lines = [f"{'span':<{width}}  {'count':>7}  {'errors':>6}  {'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}  {'max ms':>9}"]
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['p95']):
+        lines.append(f"{name:<{width}}  {stats['count']:>7}  {stats['errors']:>6}  {stats['p50']:>9.1f}  "
+                     f"{stats['p95']:>9.1f}  {stats['p99']:>9.1f}  {stats['max']:>9.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m secretary.tracing',
+                                     description='Summarize the latency of each span in a JSONL trace file.')
+    parser.add_argument('path', help='A trace file written by JsonlExporter (SECRETARY_TRACE_FILE)')
+    parser.add_argument('--span', action='append', help='Only summarize spans with this name (can be repeated)')
+    args = parser.parse_args(argv)
+    spans = load_spans(args.path)
+    if args.span:
+        spans = [s for s in spans if s['name'] in args.span]
+    print(format_summary(summarize(spans)))
+
+
+if __name__ == '__main__':
+    main()
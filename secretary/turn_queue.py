@@ -0,0 +1,139 @@
+"""
+A bounded queue of conversation turns, processed by a pool of worker threads.
+
+The Slack listener only enqueues a turn and returns, so the event is acknowledged right away, however long the turn
+takes. Turns for the same key (user) run one at a time, in order, while turns for different keys run in parallel.
+
+When a user sends messages faster than they are handled, the backpressure policy decides what happens to a new
+message while the user has turns waiting:
+- 'queue': it becomes another turn, up to max_pending_per_key waiting turns per user.
+- 'merge': it is merged into the user's waiting turn, so a burst of messages is answered in one turn.
+- 'reject': it is rejected while the user has a turn waiting or running.
+Whatever the policy, messages are rejected when max_pending turns are already waiting in total.
+
+Usage example:
+turns = TurnQueue(run_turn, workers=8, max_pending=100, policy='merge')
+if turns.submit(user_id, text, say=say) == 'rejected':
+    say("I'm still working on your last message")
+"""
+
+from collections import deque
+import logging
+import threading
+from typing import Any, Callable, Literal
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ['queue', 'merge', 'reject']
+
+
+class Turn():
+
+    def __init__(self, key: str, text: str, **context):
+        self.key = key
+        self.texts = [text]
+        self.contexts = [context] # one per message, eg. with the Slack say() for replies
+
+    @property
+    def context(self) -> dict[str, Any]:
+        """The context of the first message."""
+        return self.contexts[0]
+
+    @property
+    def text(self) -> str:
+        return '\n\n'.join(self.texts)
+
+
+class TurnQueue():
+
+    def __init__(self, handle: Callable[[Turn], Any], workers: int = 8, max_pending: int = 100,
+                 policy: Literal['queue', 'merge', 'reject'] = 'merge', max_pending_per_key: int = 5):
+        """
+        handle: Processes one turn. Runs on a worker thread.
+        workers: Number of turns processed at once.
+        max_pending: Most turns waiting to be processed, in total.
+        policy: What to do with a message from a user who already has turns waiting. See the module docstring.
+        max_pending_per_key: With the 'queue' policy, the most turns waiting per user.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown backpressure policy {policy!r}, must be one of {POLICIES}')
+        self.handle = handle
+        self.workers = workers
+        self.max_pending = max_pending
+        self.policy = policy
+        self.max_pending_per_key = max_pending_per_key
+        self._pending = {} # key -> deque of waiting Turns
+        self._ready = deque() # keys with waiting turns and no running turn, in the order they became ready
+        self._running = set() # keys with a running turn
+        self._n_pending = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self.stats = {'queued': 0, 'merged': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    def start(self):
+        with self._condition:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'turn-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def pending(self, key: str = None) -> int:
+        """Number of turns waiting, for key or in total."""
+        with self._condition:
+            return self._n_pending if key is None else len(self._pending.get(key, ()))
+
+    def submit(self, key: str, text: str, **context) -> Literal['queued', 'merged', 'rejected']:
+        """Add a message from key to the queue. context is passed on to handle() with the turn."""
+        self.start()
+        with self._condition:
+            waiting = self._pending.get(key)
+            busy = bool(waiting) or key in self._running
+            if self.policy == 'merge' and waiting:
+                waiting[-1].texts.append(text)
+                waiting[-1].contexts.append(context)
+                result = 'merged'
+            elif (self._n_pending >= self.max_pending
+                  or (self.policy == 'reject' and busy)
+                  or (self.policy == 'queue' and waiting and len(waiting) >= self.max_pending_per_key)):
+                result = 'rejected'
+            else:
+                self._pending.setdefault(key, deque()).append(Turn(key, text, **context))
+                self._n_pending += 1
+                if key not in self._running and len(self._pending[key]) == 1:
+                    self._ready.append(key)
+                    self._condition.notify_all()
+                result = 'queued'
+            self.stats[result] += 1
+            return result
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait until no turns are waiting or running. Returns False if the timeout ran out first."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._n_pending == 0 and not self._running, timeout)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._ready)
+                key = self._ready.popleft()
+                turn = self._pending[key].popleft()
+                if not self._pending[key]:
+                    del self._pending[key]
+                self._n_pending -= 1
+                self._running.add(key)
+
+            try:
+                self.handle(turn)
+                outcome = 'completed'
+            except Exception:
+                logger.exception('Turn for %s failed', key)
+                outcome = 'failed'
+
+            with self._condition:
+                self.stats[outcome] += 1
+                self._running.discard(key)
+                if key in self._pending:
+                    self._ready.append(key)
+                self._condition.notify_all()
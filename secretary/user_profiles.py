@@ -0,0 +1,84 @@
+"""
+A cache of Slack user profiles (name and timezone), so handling a message doesn't cost Slack API calls every time.
+
+Profiles are fetched with one users_info call, kept for ttl seconds, and updated directly from user_change events.
+Concurrent lookups of the same user share one fetch. If a refresh fails, the stale profile is used.
+
+Usage example:
+profiles = UserProfileCache(lambda user_id: profile_from_user(app.client.users_info(user=user_id)['user']))
+profile = profiles.get(user_id)
+profile['name'], profile['tz']
+"""
+
+from concurrent.futures import Future
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def profile_from_user(user: dict[str, Any]) -> dict[str, str]:
+    """Get the profile Secretary uses from a Slack user object (from users_info, or a user_change event)."""
+    profile = user.get('profile', {})
+    return {'name': profile.get('real_name_normalized') or user.get('real_name') or user.get('name') or user.get('id'),
+            'tz': user.get('tz') or 'UTC'}
+
+
+class UserProfileCache():
+
+    def __init__(self, fetch: Callable[[str], dict[str, str]], ttl: float = 3600):
+        """
+        fetch: Gets the profile of a user id, eg. with users_info and profile_from_user().
+        ttl: Seconds to keep a profile before fetching it again.
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self._profiles = {} # user id -> (fetched at, profile)
+        self._in_flight = {} # user id -> Future of the fetch in progress
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def get(self, user_id: str) -> dict[str, str]:
+        with self._lock:
+            cached = self._profiles.get(user_id)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+            future = self._in_flight.get(user_id)
+            fetching = future is None
+            if fetching:
+                future = Future()
+                self._in_flight[user_id] = future
+                self.fetches += 1
+        if not fetching:
+            return future.result()
+
+        try:
+            profile = self.fetch(user_id)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[user_id]
+            if cached is not None:
+                logger.warning('Could not refresh the profile of %s, using the cached one: %r', user_id, e)
+                future.set_result(cached[1])
+                return cached[1]
+            future.set_exception(e)
+            raise
+        self.put(user_id, profile)
+        with self._lock:
+            del self._in_flight[user_id]
+        future.set_result(profile)
+        return profile
+
+    def put(self, user_id: str, profile: dict[str, str]):
+        with self._lock:
+            self._profiles[user_id] = (time.monotonic(), profile)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Forget the profile of user_id, or of every user."""
+        with self._lock:
+            if user_id is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(user_id, None)
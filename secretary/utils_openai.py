@@ -3,67 +3,603 @@ Utilities for using OpenAI Chat API.
 - Includes tools for creating conversation histories, getting chat completions, and tool calling.
 """
 
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import contextvars
 from dotenv import load_dotenv
+import hashlib
+import httpx
+import inspect
+import json
+import logging
 import numpy as np
-from openai import OpenAI
-from typing import Literal, Optional
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+import os
+import re
+import sqlite3
+import threading
+import time
+import types
+import typing
+from typing import Any, Literal, Optional
+import weakref
+
+import secretary.tracing as tracing
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+### Clients ###
+
+# Model classes used throughout Secretary, and the models they map to
+MODELS = {'fast': 'gpt-4o-mini',
+          'best': 'gpt-4o'}
+
+_client_settings = {
+    'base_url': os.environ.get('OPENAI_BASE_URL'), # eg. a local OpenAI-compatible stub for load tests
+    'timeout': 60.0,
+    'max_retries': 2,
+    'max_connections': 20,
+    'max_keepalive_connections': 10,
+}
+_client = None
+_async_clients = weakref.WeakKeyDictionary() # event loop -> its AsyncOpenAI client, as an async client can't be shared across loops
+_client_lock = threading.Lock()
+
+def configure(models: Optional[dict[str, str]] = None, **client_settings):
+    """
+    Change the models used for each model class, and/or the settings of the shared OpenAI clients:
+    base_url, timeout (seconds), max_retries, max_connections and max_keepalive_connections.
+    The old clients are closed, and the shared clients are rebuilt with the new settings the next time they are used.
+    Call it at startup, as requests still in flight on the old clients will fail.
+
+    Usage example:
+    configure(base_url='http://localhost:8000/v1', timeout=10, max_connections=100)
+    """
+    global _client
+    unknown = set(client_settings) - set(_client_settings)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {sorted(unknown)}")
+    with _client_lock:
+        if models:
+            MODELS.update(models)
+        _client_settings.update(client_settings)
+        old_client, _client = _client, None
+        old_async_clients = list(_async_clients.items())
+        _async_clients.clear()
+    if old_client is not None:
+        old_client.close() # releases its pooled connections
+    for loop, async_client in old_async_clients:
+        # An async client is closed on its own loop. A closed loop's connections are already gone
+        try:
+            loop.call_soon_threadsafe(lambda loop=loop, client=async_client: loop.create_task(client.close()))
+        except RuntimeError:
+            pass
+
+def _client_kwargs() -> dict:
+    return {'base_url': _client_settings['base_url'],
+            'timeout': _client_settings['timeout'],
+            'max_retries': _client_settings['max_retries']}
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=_client_settings['max_connections'],
+                        max_keepalive_connections=_client_settings['max_keepalive_connections'])
+
+def get_client() -> OpenAI:
+    """Get the shared OpenAI client, creating it on first use. It is safe to use from many threads at once."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(**_client_kwargs(),
+                                 http_client=httpx.Client(limits=_http_limits(), timeout=_client_settings['timeout']))
+    return _client
+
+def get_async_client() -> AsyncOpenAI:
+    """Get the running event loop's shared AsyncOpenAI client, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = AsyncOpenAI(**_client_kwargs(),
+                                                        http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_client_settings['timeout']))
+    return client
+
 ### Embeddings ###
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMS = 1536
+# Limits on one embeddings request: https://platform.openai.com/docs/api-reference/embeddings/create
+EMBEDDING_BATCH_MAX_INPUTS = 2048
+EMBEDDING_BATCH_MAX_TOKENS = 250_000 # the API allows 300k, but our token counts are only estimates
+EMBEDDING_MAX_CONCURRENT_REQUESTS = 4
+EMBEDDING_MAX_INPUT_TOKENS = 8191 # the most tokens the embedding model accepts in one input
+
+def estimate_tokens(text: str) -> int:
+    """A cheap, deliberately high estimate of the number of tokens in the text (real tokens average ~4 bytes of English)."""
+    return len(text.encode('utf-8')) // 3 + 1
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut the text down so that estimate_tokens() of it is at most max_tokens, keeping its start (or its end if keep_end)."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    encoded = text.encode('utf-8')
+    max_bytes = 3 * (max_tokens - 1)
+    encoded = encoded[len(encoded) - max_bytes:] if keep_end else encoded[:max_bytes]
+    return encoded.decode('utf-8', errors='ignore')
+
+def _batch_embedding_inputs(texts: list[str]) -> list[list[str]]:
+    """Pack texts into batches that fit within the limits of one embeddings request."""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) == EMBEDDING_BATCH_MAX_INPUTS or batch_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _embedding_matrix(texts: list[str], unique_texts: list[str], batch_results: list[list[list[float]]]) -> np.ndarray:
+    unique_embeddings = np.array([embedding for batch in batch_results for embedding in batch], dtype=np.float32)
+    row_of_text = {text: row for row, text in enumerate(unique_texts)}
+    return unique_embeddings[[row_of_text[text] for text in texts]]
+
 def get_embedding(content):
-    response = OpenAI().embeddings.create(input=content,
-                                          model="text-embedding-3-small")
+    with tracing.span('openai.embeddings', inputs=1, tokens=estimate_tokens(str(content))):
+        response = get_client().embeddings.create(input=content,
+                                              model=EMBEDDING_MODEL)
     embedding = np.array(response.data[0].embedding)
     return embedding
 
+def get_embeddings(texts: list[str], max_concurrent_requests: int = EMBEDDING_MAX_CONCURRENT_REQUESTS) -> np.ndarray:
+    """
+    Embed many texts at once. Identical texts are embedded once, and the rest are packed into as few requests as
+    the API's limits allow, with up to max_concurrent_requests requests in flight at a time.
+    Returns a float32 matrix with one row per text, in the same order as the texts.
+    """
+    texts = [text or ' ' for text in texts] # the API rejects empty inputs
+    unique_texts = list(dict.fromkeys(texts))
+    if not unique_texts:
+        return np.empty((0, EMBEDDING_DIMS), dtype=np.float32)
+
+    client = get_client()
+    def embed_batch(batch):
+        response = client.embeddings.create(input=batch, model=EMBEDDING_MODEL)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    batches = _batch_embedding_inputs(unique_texts)
+    with tracing.span('openai.embeddings', inputs=len(unique_texts), batches=len(batches)):
+        if len(batches) == 1:
+            batch_results = [embed_batch(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+                batch_results = list(executor.map(embed_batch, batches))
+    return _embedding_matrix(texts, unique_texts, batch_results)
+
+async def aget_embedding(content):
+    with tracing.span('openai.embeddings', inputs=1, tokens=estimate_tokens(str(content))):
+        response = await get_async_client().embeddings.create(input=content,
+                                                         model=EMBEDDING_MODEL)
+    embedding = np.array(response.data[0].embedding)
+    return embedding
+
+async def aget_embeddings(texts: list[str], max_concurrent_requests: int = EMBEDDING_MAX_CONCURRENT_REQUESTS) -> np.ndarray:
+    """The async version of get_embeddings()."""
+    texts = [text or ' ' for text in texts]
+    unique_texts = list(dict.fromkeys(texts))
+    if not unique_texts:
+        return np.empty((0, EMBEDDING_DIMS), dtype=np.float32)
+
+    client = get_async_client()
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    async def embed_batch(batch):
+        async with semaphore:
+            response = await client.embeddings.create(input=batch, model=EMBEDDING_MODEL)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    batches = _batch_embedding_inputs(unique_texts)
+    with tracing.span('openai.embeddings', inputs=len(unique_texts), batches=len(batches)):
+        batch_results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+    return _embedding_matrix(texts, unique_texts, batch_results)
+
 ### Chats ###
 
+# Rough number of tokens the Chat API adds to each message, on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARIZE_CONVERSATION = '''You maintain a running summary of a conversation between a user and their secretary, who manages their tasks.
+You will be given the current summary (which may be empty) and some older messages that are about to be forgotten.
+Write a new summary that merges the two. Keep the facts, requests, decisions and open questions that could matter later,
+and drop small talk. Write at most {max_words} words of plain text.'''
+
+_summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarize')
+
+def count_message_tokens(message: dict) -> int:
+    return estimate_tokens(str(message.get('content') or '')) + MESSAGE_OVERHEAD_TOKENS
+
 class Messages():
+    """
+    A conversation history.
 
-    def __init__(self):
+    With a token_budget, trim() drops the oldest messages until the rest fit in the budget. If summarize is set,
+    the dropped messages are folded into a short rolling summary by the 'fast' model, in the background,
+    and window() returns the summary followed by the messages, so the prompt size per turn stays bounded.
+    """
+
+    def __init__(self, token_budget: Optional[int] = None, summarize: bool = False, summary_tokens: int = 250):
+        """
+        token_budget: Maximum estimated tokens of the messages kept after trim().
+        summarize: Fold trimmed messages into a rolling summary, instead of just dropping them.
+        summary_tokens: Approximate maximum size of the summary.
+        """
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
         self.messages = []
+        self.token_counts = []
+        self.summary = ''
+        self._generation = 0 # bumped by clear(), so summaries that are in progress are discarded
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens of the messages (not counting the summary)."""
+        return sum(self.token_counts)
 
     def clear(self):
-        self.messages = []
+        with self._lock:
+            self.messages = []
+            self.token_counts = []
+            self.summary = ''
+            self._generation += 1
 
     def keep_last(self, n: int):
         """Drop all but the last n messages."""
-        self.messages = self.messages[-n:]
+        self._drop(max(len(self.messages) - n, 0))
+
+    def trim(self, token_budget: Optional[int] = None):
+        """
+        Drop the oldest messages until the rest fit in token_budget (default: self.token_budget).
+        The newest message is always kept whole, even if it doesn't fit on its own, so callers should
+        reject messages that are too long before adding them.
+        """
+        token_budget = token_budget or self.token_budget
+        if token_budget is None:
+            return
+        n_drop = 0
+        tokens = self.tokens
+        while n_drop < len(self.messages) - 1 and tokens > token_budget:
+            tokens -= self.token_counts[n_drop]
+            n_drop += 1
+        self._drop(n_drop)
+
+    def _drop(self, n: int):
+        """Drop the n oldest messages, summarizing them if enabled."""
+        if n <= 0:
+            return
+        with self._lock:
+            dropped = self.messages[:n]
+            self.messages = self.messages[n:]
+            self.token_counts = self.token_counts[n:]
+            generation = self._generation
+        if self.summarize:
+            _summary_pool.submit(self._fold_into_summary, dropped, generation)
+
+    def _fold_into_summary(self, dropped: list[dict], generation: int):
+        transcript = '\n\n'.join(f"{message['role']}: {message['content']}" for message in dropped)
+        comment = f'Current summary:\n{self.summary}\n\nOlder messages:\n{transcript}'
+        system_message = SUMMARIZE_CONVERSATION.format(max_words=self.summary_tokens * 3 // 4)
+        try:
+            summary, _ = get_completion(comment=comment, system_message=system_message, model_class='fast')
+        except Exception as e:
+            logger.warning('Could not summarize the conversation: %r', e)
+            return
+        summary = (summary or '').strip()
+        max_bytes = 3 * self.summary_tokens
+        summary = summary.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+        with self._lock:
+            if generation == self._generation:
+                self.summary = summary
 
     def add_message(self, role: Literal['user', 'assistant'], message: str):
         message = {"role": role, "content": message}
-        self.messages.append(message)
+        with self._lock:
+            self.messages.append(message)
+            self.token_counts.append(count_message_tokens(message))
 
-def get_completion(comment, system_message, model_class='best', tools=None, temperature=0):
+    def window(self) -> list[dict]:
+        """The messages to send to the Chat API: the summary of older messages, if there is one, then the messages."""
+        with self._lock:
+            messages = list(self.messages)
+            summary = self.summary
+        if summary:
+            messages.insert(0, {"role": "system", "content": f'Summary of the earlier conversation:\n{summary}'})
+        return messages
 
-    models = {'fast': 'gpt-4o-mini',
-              'best': 'gpt-4o'}
+### Completion cache ###
+
+# System messages end with the current time, which would change the cache key every minute
+CURRENT_TIME_PATTERN = re.compile(r'(The current date and time is \d{4}-\d{2}-\d{2}) \d{2}:\d{2}:\d{2}( [+-]\d{4})?')
+# Content that is relative to the current time of day, not just the current date, so the full time stays in the key
+TIME_OF_DAY_PATTERN = re.compile(r'\b(now|right away|asap|soon|tonight|this (morning|afternoon|evening)|(earlier|later) today|'
+                                 r'in (an?|half an|a few|\d+) (min|mins|minutes?|hours?|hrs?)|\d+ (min|mins|minutes?|hours?|hrs?) from now)\b',
+                                 re.IGNORECASE)
+
+def _cache_key(model: str, messages: list[dict], tools, temperature: float) -> str:
+    """
+    Hash a completion request into a cache key. The current time in system messages is truncated to the date,
+    unless the user content refers to the time of day (eg. 'in 2 hours'), in which case the full time is kept.
+    The full time is also kept when tools are offered, as tool-calling turns answer questions about the board.
+    """
+    user_content = ' '.join(str(message.get('content') or '') for message in messages if message.get('role') != 'system')
+    if not tools and not TIME_OF_DAY_PATTERN.search(user_content):
+        messages = [{**message, 'content': CURRENT_TIME_PATTERN.sub(r'\1\2', message['content'])}
+                    if message.get('role') == 'system' and isinstance(message.get('content'), str) else message
+                    for message in messages]
+    request = {'model': model, 'messages': messages, 'tools': tools, 'temperature': temperature}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class CompletionCache():
+    """
+    A cache of deterministic (temperature 0) chat completions: an in-memory LRU tier, plus an optional on-disk
+    SQLite tier whose entries expire after ttl seconds and which evicts its least recently used entries to stay
+    under max_disk_bytes. Only completions requested with use_cache=True are cached.
+    """
+
+    def __init__(self, max_entries: int = 256, path: Optional[str] = None, ttl: float = 7*24*3600, max_disk_bytes: int = 50_000_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS completions
+                                (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,
+                                 created_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+            self._db.commit()
+
+    def _remember(self, key: str, value: str):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return self._memory[key]
+            if self._db is not None:
+                now = time.time()
+                row = self._db.execute("SELECT value FROM completions WHERE key = ? AND created_at > ?", (key, now - self.ttl)).fetchone()
+                if row:
+                    self._db.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0])
+                    self.hits['disk'] += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+            now = time.time()
+            self._db.execute("INSERT OR REPLACE INTO completions (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                             (key, value, len(value), now, now))
+            self._db.execute("DELETE FROM completions WHERE created_at <= ?", (now - self.ttl,))
+            total_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if total_size > self.max_disk_bytes:
+                evict = []
+                for evict_key, size in self._db.execute("SELECT key, size FROM completions ORDER BY accessed_at"):
+                    if total_size <= self.max_disk_bytes:
+                        break
+                    evict.append((evict_key,))
+                    total_size -= size
+                self._db.executemany("DELETE FROM completions WHERE key = ?", evict)
+            self._db.commit()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = sum(self.hits.values()) + self.misses
+            return {'hits': dict(self.hits),
+                    'misses': self.misses,
+                    'hit_rate': sum(self.hits.values()) / lookups if lookups else 0.0,
+                    'memory_entries': len(self._memory)}
 
-    completion = OpenAI().chat.completions.create(
-                                                model=models[model_class],
-                                                temperature=temperature,
-                                                tools=tools,
-                                                messages=[
-                                                    {"role": "system", "content": system_message},
-                                                    {"role": "user", "content": comment}
-                                                ],
-                                                )
-    return completion.choices[0].message.content, completion.choices[0].message.tool_calls
 
-def get_conversation_completion(messages, model_class='best', tools=None, temperature=0):
+completion_cache = None
 
-    models = {'fast': 'gpt-4o-mini',
-              'best': 'gpt-4o'}
+def enable_completion_cache(max_entries: int = 256, path: Optional[str] = None, ttl: float = 7*24*3600, max_disk_bytes: int = 50_000_000):
+    """Cache temperature-0 completions in memory, and on disk in a SQLite file at path if one is given."""
+    global completion_cache
+    completion_cache = CompletionCache(max_entries, path, ttl, max_disk_bytes)
+    return completion_cache
 
-    completion = OpenAI().chat.completions.create(
-                                                model=models[model_class],
+if os.environ.get('SECRETARY_COMPLETION_CACHE'):
+    # 'memory' for an in-memory cache only, or else the path of the on-disk cache file
+    enable_completion_cache(path=None if os.environ['SECRETARY_COMPLETION_CACHE'] == 'memory' else os.environ['SECRETARY_COMPLETION_CACHE'])
+
+def _serialize_completion(content, tool_calls) -> str:
+    return json.dumps({'content': content,
+                       'tool_calls': [tool_call.model_dump() for tool_call in tool_calls] if tool_calls is not None else None})
+
+def _deserialize_completion(value: str):
+    completion = json.loads(value)
+    tool_calls = completion['tool_calls']
+    if tool_calls is not None:
+        tool_calls = [ChatCompletionMessageToolCall.model_validate(tool_call) for tool_call in tool_calls]
+    return completion['content'], tool_calls
+
+def _completion_cache_key(messages, model_class, tools, temperature, use_cache) -> Optional[str]:
+    """The cache key for a completion request, or None if it should not be cached."""
+    if completion_cache is None or not use_cache or temperature != 0:
+        return None
+    return _cache_key(MODELS[model_class], messages, tools, temperature)
+
+### Completions ###
+
+def _completion_attributes(messages, model_class, tools) -> dict[str, Any]:
+    """The attributes of a completion's span: the model, and the size of the prompt."""
+    return {'model': MODELS[model_class],
+            'messages': len(messages),
+            'prompt_tokens': sum(count_message_tokens(message) for message in messages),
+            'tools': len(tools or [])}
+
+def _set_completion_results(span, content, tool_calls, usage=None):
+    span.set(response_chars=len(content or ''),
+             tool_calls=[tool_call.function.name for tool_call in tool_calls or []])
+    if usage is not None:
+        span.set(usage_prompt_tokens=usage.prompt_tokens, usage_completion_tokens=usage.completion_tokens)
+
+def get_completion(comment, system_message, model_class='best', tools=None, temperature=0, use_cache=False):
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": comment}
+    ]
+    return get_conversation_completion(messages, model_class, tools, temperature, use_cache)
+
+def get_conversation_completion(messages, model_class='best', tools=None, temperature=0, use_cache=False):
+    with tracing.span('openai.chat_completion', **_completion_attributes(messages, model_class, tools)) as span:
+        key = _completion_cache_key(messages, model_class, tools, temperature, use_cache)
+        if key is not None and (cached := completion_cache.get(key)) is not None:
+            span.set(cached=True)
+            return _deserialize_completion(cached)
+
+        completion = get_client().chat.completions.create(
+                                                    model=MODELS[model_class],
+                                                    temperature=temperature,
+                                                    tools=tools,
+                                                    messages=messages,
+                                                    )
+        content, tool_calls = completion.choices[0].message.content, completion.choices[0].message.tool_calls
+        _set_completion_results(span, content, tool_calls, completion.usage)
+        if key is not None:
+            completion_cache.put(key, _serialize_completion(content, tool_calls))
+        return content, tool_calls
+
+def stream_conversation_completion(messages, model_class='best', tools=None, temperature=0, use_cache=False):
+    """
+    Stream a conversation completion. Yields ('text', delta) for each piece of the response text as it arrives, and
+    ('tool_call', tool_call) for each tool call as soon as its arguments are complete, so it can be run right away.
+
+    Usage example:
+    for kind, value in stream_conversation_completion(messages, tools=tool_schemas):
+        if kind == 'text':
+            print(value, end='')
+        else:
+            run_tool(value)
+    """
+    # A generator runs in its caller's context, so its span is started without becoming the current span
+    span = tracing.start_span('openai.chat_completion', stream=True, **_completion_attributes(messages, model_class, tools))
+    try:
+        yield from _stream_conversation_completion(span, messages, model_class, tools, temperature, use_cache)
+    except Exception as e:
+        span.end(e)
+        raise
+    finally:
+        span.end()
+
+def _stream_conversation_completion(span, messages, model_class, tools, temperature, use_cache):
+    key = _completion_cache_key(messages, model_class, tools, temperature, use_cache)
+    if key is not None and (cached := completion_cache.get(key)) is not None:
+        span.set(cached=True)
+        content, tool_calls = _deserialize_completion(cached)
+        if content:
+            yield 'text', content
+        for tool_call in tool_calls or []:
+            yield 'tool_call', tool_call
+        return
+
+    started = time.perf_counter()
+    stream = get_client().chat.completions.create(
+                                                model=MODELS[model_class],
                                                 temperature=temperature,
                                                 tools=tools,
                                                 messages=messages,
+                                                stream=True,
                                                 )
-    return completion.choices[0].message.content, completion.choices[0].message.tool_calls
+    content = ''
+    tool_calls = []
+    pending = {} # index -> partial tool call, for the tool call whose arguments are still streaming
+
+    def finish(index):
+        partial = pending.pop(index)
+        tool_call = ChatCompletionMessageToolCall(id=partial['id'], type='function',
+                                                  function=Function(name=partial['name'], arguments=partial['arguments']))
+        tool_calls.append(tool_call)
+        return tool_call
+
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if not content:
+                span.set(time_to_first_token_ms=(time.perf_counter() - started) * 1000)
+            content += delta.content
+            yield 'text', delta.content
+        for tool_call_delta in delta.tool_calls or []:
+            index = tool_call_delta.index
+            # Tool calls stream one after another, so a new one starting means the earlier ones are complete
+            for earlier in sorted(i for i in pending if i < index):
+                yield 'tool_call', finish(earlier)
+            partial = pending.setdefault(index, {'id': None, 'name': '', 'arguments': ''})
+            if tool_call_delta.id:
+                partial['id'] = tool_call_delta.id
+            if tool_call_delta.function is not None:
+                partial['name'] += tool_call_delta.function.name or ''
+                partial['arguments'] += tool_call_delta.function.arguments or ''
+    for index in sorted(pending):
+        yield 'tool_call', finish(index)
+
+    _set_completion_results(span, content, tool_calls)
+    if key is not None:
+        completion_cache.put(key, _serialize_completion(content or None, tool_calls or None))
+
+async def aget_completion(comment, system_message, model_class='best', tools=None, temperature=0, use_cache=False):
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": comment}
+    ]
+    return await aget_conversation_completion(messages, model_class, tools, temperature, use_cache)
+
+async def aget_conversation_completion(messages, model_class='best', tools=None, temperature=0, use_cache=False):
+    with tracing.span('openai.chat_completion', **_completion_attributes(messages, model_class, tools)) as span:
+        key = _completion_cache_key(messages, model_class, tools, temperature, use_cache)
+        if key is not None and (cached := await asyncio.to_thread(completion_cache.get, key)) is not None:
+            span.set(cached=True)
+            return _deserialize_completion(cached)
+
+        completion = await get_async_client().chat.completions.create(
+                                                    model=MODELS[model_class],
+                                                    temperature=temperature,
+                                                    tools=tools,
+                                                    messages=messages,
+                                                    )
+        content, tool_calls = completion.choices[0].message.content, completion.choices[0].message.tool_calls
+        _set_completion_results(span, content, tool_calls, completion.usage)
+        if key is not None:
+            await asyncio.to_thread(completion_cache.put, key, _serialize_completion(content, tool_calls))
+        return content, tool_calls
 
 def _strip_special(s:str, prefixes:Optional[list[str]]=[], suffixes:Optional[list[str]]=[]) -> str:
     for prefix in prefixes:
@@ -94,7 +630,16 @@ FUNCTIONS_TYPE_MAP = {
     'None': 'null',
 }
 
+def _json_type(annotation) -> str:
+    name = getattr(typing.get_origin(annotation) or annotation, '__name__', str(annotation))
+    return FUNCTIONS_TYPE_MAP.get(name, name)
+
 def schematize_function(func):
+    """
+    Build a tool schema for func from its docstring and its arguments, which must be annotated as
+    Annotated[type, "description"]. Arguments with default values are not required,
+    and Optional[type] or type | None arguments can also be null.
+    """
     function = {}
     function['name'] = func.__name__
     function['description'] = func.__doc__.strip()
@@ -103,30 +648,29 @@ def schematize_function(func):
     function['parameters']['properties'] = {}
     function['parameters']['required'] = []
 
-    input_arg_names = [arg_name for arg_name in func.__code__.co_varnames[:func.__code__.co_argcount]]
-    for input_arg_name in input_arg_names:
-        function['parameters']['required'].append(input_arg_name) # all arguments are required. could change this
-        function['parameters']['properties'][input_arg_name] = {}
-        raw_annotation = func.__annotations__[input_arg_name]
-
-        if raw_annotation.__origin__.__name__ in FUNCTIONS_TYPE_MAP:
-            ip_type = FUNCTIONS_TYPE_MAP[raw_annotation.__origin__.__name__]
-            function['parameters']['properties'][input_arg_name]['type'] = ip_type
-
-            if ip_type == 'array':
-                function['parameters']['properties'][input_arg_name]['items'] = {}
-                ip_item_type = raw_annotation.__origin__.__args__[0].__name__
-                if ip_item_type in FUNCTIONS_TYPE_MAP:
-                    function['parameters']['properties'][input_arg_name]['items']['type'] = FUNCTIONS_TYPE_MAP[ip_item_type]
-                else:
-                    function['parameters']['properties'][input_arg_name]['items']['type'] = ip_item_type
-
-        else:
-            ip_type =  raw_annotation.__origin__.__name__
-            function['parameters']['properties'][input_arg_name]['type'] = ip_type
+    hints = typing.get_type_hints(func, include_extras=True)
+    for input_arg_name, parameter in inspect.signature(func).parameters.items():
+        raw_annotation = hints.get(input_arg_name)
+        if typing.get_origin(raw_annotation) is not typing.Annotated:
+            raise TypeError(f'Argument {input_arg_name} of {func.__name__} must be annotated as Annotated[type, "description"]')
+        arg_type = raw_annotation.__origin__
 
+        nullable = False
+        # Optional[X] is a typing.Union, and X | None a types.UnionType
+        if typing.get_origin(arg_type) in (typing.Union, types.UnionType) and type(None) in typing.get_args(arg_type):
+            nullable = True
+            arg_type = typing.Union[tuple(arg for arg in typing.get_args(arg_type) if arg is not type(None))]
 
-        function['parameters']['properties'][input_arg_name]['type'] = ip_type
+        if parameter.default is inspect.Parameter.empty:
+            function['parameters']['required'].append(input_arg_name)
+        function['parameters']['properties'][input_arg_name] = {}
+        ip_type = _json_type(arg_type)
+        function['parameters']['properties'][input_arg_name]['type'] = [ip_type, 'null'] if nullable else ip_type
+        if ip_type == 'array':
+            function['parameters']['properties'][input_arg_name]['items'] = {}
+            item_args = typing.get_args(arg_type)
+            if item_args:
+                function['parameters']['properties'][input_arg_name]['items']['type'] = _json_type(item_args[0])
         function['parameters']['properties'][input_arg_name]['description'] = raw_annotation.__metadata__[0]
 
     tool = {}
@@ -146,4 +690,158 @@ def add_function_to_tools(tools, func):
         'callable': func
     }
     tools[func.__name__] = tool
-    return tools
\ No newline at end of file
+    return tools
+
+
+class ToolRegistry():
+    """
+    A set of tools that is schematized once, when each tool is registered, instead of on every request.
+    The list of schemas is built once and reused, so the tools sent to the Chat API are identical every turn.
+
+    Usage example:
+    tools = ToolRegistry()
+
+    @tools.register
+    def add_task(name: Annotated[str, 'The name of the task']):
+        '''Add a task.'''
+        ...
+
+    response, tool_calls = get_conversation_completion(messages, tools=tools.schemas)
+    result = tools.call(tool_call.function.name, json.loads(tool_call.function.arguments))
+    """
+
+    def __init__(self):
+        self._tools = {}
+        self._schemas = None
+        self._lock = threading.Lock()
+
+    def register(self, func):
+        """Register func as a tool, under its own name. Returns func, so this can be used as a decorator."""
+        tool = {
+            'schema': schematize_function(func),
+            'callable': func
+        }
+        with self._lock:
+            self._tools[func.__name__] = tool
+            self._schemas = None
+        return func
+
+    @property
+    def schemas(self) -> list[dict]:
+        """The tool schemas to send to the Chat API. Don't modify this: the same list is returned every time."""
+        with self._lock:
+            if self._schemas is None:
+                self._schemas = [tool['schema'] for tool in self._tools.values()]
+            return self._schemas
+
+    def call(self, name: str, arguments: dict[str, Any]):
+        return self._tools[name]['callable'](**arguments)
+
+    def __contains__(self, name: str):
+        return name in self._tools
+
+    def __getitem__(self, name: str) -> dict:
+        return self._tools[name]
+
+    def __iter__(self):
+        return iter(self._tools)
+
+    def __len__(self):
+        return len(self._tools)
+
+# Default number of tool calls to run at once
+MAX_CONCURRENT_TOOL_CALLS = 4
+_tool_pool = None
+_tool_pool_lock = threading.Lock()
+
+def _get_tool_pool() -> ThreadPoolExecutor:
+    global _tool_pool
+    with _tool_pool_lock:
+        if _tool_pool is None:
+            _tool_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TOOL_CALLS, thread_name_prefix='tool-call')
+        return _tool_pool
+
+def tool_call_resource(arguments: dict[str, Any]) -> Optional[str]:
+    """The default resource key of a tool call: the id of the task (card) it touches, if any."""
+    resource = arguments.get('id')
+    return resource if isinstance(resource, str) else None
+
+class ToolExecutor():
+    """
+    Runs the tool calls of one turn concurrently, on a shared bounded pool.
+
+    Calls that touch the same resource (by default, the same card id) are run one at a time, in the order they
+    were submitted. A call that raises doesn't stop the others: its error is captured in its result instead.
+
+    Usage example:
+    executor = ToolExecutor(tools)
+    for tool_call in tool_calls:
+        executor.submit(tool_call)
+    for result in executor.results():
+        if result['error'] is None:
+            ...
+    """
+
+    def __init__(self, tools: dict[str, dict], pool: Optional[ThreadPoolExecutor] = None, resource=tool_call_resource,
+                 prepare_arguments=None):
+        """
+        tools: A ToolRegistry, or a tools dict built with add_function_to_tools().
+        pool: The pool to run the calls on. Defaults to a shared pool of MAX_CONCURRENT_TOOL_CALLS threads.
+        resource: Gets the resource key of a call from its arguments. Calls with the same key don't overlap.
+        prepare_arguments: Optionally rewrites the arguments of each call before it runs (eg. resolving aliases to ids).
+        """
+        self.tools = tools
+        self.pool = pool or _get_tool_pool()
+        self.resource = resource
+        self.prepare_arguments = prepare_arguments
+        self._results = []
+        self._futures = []
+        self._last_future = {} # resource -> future of the last call submitted on it
+
+    def _run(self, result: dict, previous: Optional[Future]):
+        with tracing.span(f"tool.{result['name']}") as span:
+            if previous is not None:
+                # The pool starts calls in submission order, so the previous call on this resource is already
+                # running (or done), and waiting for it can't deadlock the pool
+                started = time.perf_counter()
+                wait([previous])
+                span.set(waited_ms=(time.perf_counter() - started) * 1000)
+            result['result'] = self.tools[result['name']]['callable'](**result['arguments'])
+
+    def submit(self, tool_call: ChatCompletionMessageToolCall):
+        """Start running the tool call. Returns immediately."""
+        result = {'tool_call_id': tool_call.id,
+                  'name': tool_call.function.name,
+                  'arguments': None,
+                  'result': None,
+                  'error': None}
+        self._results.append(result)
+        try:
+            result['arguments'] = json.loads(tool_call.function.arguments or '{}')
+            if self.prepare_arguments is not None:
+                result['arguments'] = self.prepare_arguments(result['arguments'])
+            if result['name'] not in self.tools:
+                raise KeyError(f"Unknown tool {result['name']!r}")
+        except Exception as e:
+            result['error'] = e
+            return
+
+        resource = self.resource(result['arguments'])
+        previous = self._last_future.get(resource) if resource is not None else None
+        context = contextvars.copy_context() # eg. the request priority, which pool threads don't inherit
+        future = self.pool.submit(context.run, self._run, result, previous)
+        if resource is not None:
+            self._last_future[resource] = future
+        self._futures.append((result, future))
+
+    def results(self) -> list[dict[str, Any]]:
+        """
+        Wait for every submitted call to finish, and get their results in submission order.
+        Each result is a dict with tool_call_id, name, arguments, result and error (None if the call succeeded).
+        """
+        for result, future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                result['error'] = e
+        return self._results
@@ -1,22 +1,465 @@
+import asyncio
 from contextlib import contextmanager
+import contextvars
 from dotenv import load_dotenv 
+import httpx
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import re
+import threading
+import time
 from typing import Any, Optional
+import weakref
 from datetime import datetime
 
+import secretary.tracing as tracing
+from secretary.rate_limit import PRIORITIES, RequestScheduler
+
 load_dotenv()
 
-TRELLO_API_KEY = os.environ['TRELLO_API_KEY']
-TRELLO_OAUTH_TOKEN = os.environ['TRELLO_OAUTH_TOKEN']
+# Read when a client is created, so the module can be imported (eg. by tests) without credentials
+TRELLO_API_KEY = os.environ.get('TRELLO_API_KEY')
+TRELLO_OAUTH_TOKEN = os.environ.get('TRELLO_OAUTH_TOKEN')
+TRELLO_BASE_URL = os.environ.get('TRELLO_BASE_URL', 'https://api.trello.com/1')
+TRELLO_METADATA_TTL = float(os.environ.get('TRELLO_METADATA_TTL', 300))
+
+# Trello allows 300 requests per 10 seconds per API key, and 100 requests per 10 seconds per token.
+# We use one key with one token, so the token limit is the one that binds.
+# https://developer.atlassian.com/cloud/trello/guides/rest-api/rate-limits/
+TRELLO_RATE_LIMIT_REQUESTS = 100
+TRELLO_RATE_LIMIT_WINDOW = 10.0
+
+# Trello ids are 24 hex digits. They are left out of span names, so requests to the same route are summarized together
+TRELLO_ID_PATTERN = re.compile(r'\b[0-9a-f]{24}\b')
+
+def _span_name(method: str, path: str) -> str:
+    return f"trello.{method} {TRELLO_ID_PATTERN.sub(':id', path.strip('/'))}"
+
+def _credentials(api_key: Optional[str], token: Optional[str]) -> tuple[str, str]:
+    api_key, token = api_key or TRELLO_API_KEY, token or TRELLO_OAUTH_TOKEN
+    if not api_key or not token:
+        raise ValueError('Trello credentials are missing: set TRELLO_API_KEY and TRELLO_OAUTH_TOKEN')
+    return api_key, token
 
 def _find_dict_by_name(dict_list, target_name):
     for d in dict_list:
         if d.get('name') == target_name:
             return d
     return None
-    
+
+
+class TrelloError(Exception):
+    """Raised when the Trello API responds with an error status."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.text = response.text
+        super().__init__(f"Trello API error {self.status_code}: {self.text[:200]}")
+
+
+### Request scheduling ###
+
+_request_priority = contextvars.ContextVar('trello_request_priority', default='interactive')
+
+@contextmanager
+def request_priority(priority: str):
+    """
+    Make the Trello requests in this block with the given priority. Requests default to 'interactive'.
+
+    Usage example:
+    with request_priority('background'):
+        send_morning_digest()
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+default_scheduler = RequestScheduler(TRELLO_RATE_LIMIT_REQUESTS, TRELLO_RATE_LIMIT_WINDOW)
+
+
+class TrelloClient():
+    """
+    A Trello REST API client that holds a pooled, keep-alive HTTP session.
+
+    All requests made through one client reuse its open connections to the API host, instead of
+    paying for a fresh TCP+TLS handshake on every call.
+
+    Usage example:
+    client = TrelloClient(base_url='http://localhost:8080/1', timeout=5)
+    cards = client.get_cards_on_board(board_id)
+    """
+
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 token: Optional[str] = None,
+                 base_url: str = TRELLO_BASE_URL,
+                 timeout: float | tuple[float, float] = (3.05, 30),
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 16,
+                 scheduler: Optional[RequestScheduler] = None):
+        """
+        api_key, token: Trello credentials. Default to TRELLO_API_KEY and TRELLO_OAUTH_TOKEN.
+        base_url: Root of the REST API. Override to point at a local stand-in server.
+        timeout: Seconds to wait, either one value or a (connect, read) pair.
+        pool_connections: Number of per-host connection pools to keep.
+        pool_maxsize: Maximum number of open connections kept per host. Callers beyond this wait for a free connection.
+        scheduler: Paces the client's requests. Defaults to the shared default_scheduler.
+        """
+        self.api_key, self.token = _credentials(api_key, token)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.scheduler = scheduler or default_scheduler
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"Accept": "application/json"})
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, method: str, path: str, params: Optional[dict[str, Any]] = None) -> requests.Response:
+        query = {
+            'key': self.api_key,
+            'token': self.token,
+        }
+        if params: query.update(params)
+
+        priority = _request_priority.get()
+        with tracing.span(_span_name(method, path), priority=priority) as span:
+            for attempt in range(self.scheduler.max_retries + 1):
+                self.scheduler.acquire(priority)
+                response = self.session.request(method,
+                                                f"{self.base_url}/{path.lstrip('/')}",
+                                                params=query,
+                                                timeout=self.timeout)
+                if response.status_code != 429:
+                    break
+                self.scheduler.rate_limited(attempt, response.headers.get('Retry-After'))
+            span.set(status_code=response.status_code, attempts=attempt + 1)
+        return response
+
+    def request_json(self, method: str, path: str, params: Optional[dict[str, Any]] = None):
+        response = self.request(method, path, params)
+        if response.status_code >= 400:
+            raise TrelloError(response)
+        return json.loads(response.text)
+
+    ### Boards ###
+
+    def create_board(self, name: str):
+        return self.request_json("POST", "boards/", {'name': name})['id']
+
+    def delete_board(self, board_id: str):
+        self.request("DELETE", f"boards/{board_id}")
+
+    def get_boards(self):
+        return self.request_json("GET", "members/me/boards")
+
+    def get_board_actions(self, board_id: str, since: Optional[str] = None, limit: int = 1000):
+        """Get the actions on a board, newest first. If since is an action id, only actions after it are returned."""
+        # https://developer.atlassian.com/cloud/trello/rest/api-group-boards/#api-boards-boardid-actions-get
+        query = {'limit': limit}
+        if since: query['since'] = since
+        return self.request_json("GET", f"boards/{board_id}/actions", query)
+
+    ### Lists ###
+
+    def get_lists_on_board(self, board_id: str):
+        return self.request_json("GET", f"boards/{board_id}/lists")
+
+    def create_list(self, board_id: str, name: str):
+        # https://developer.atlassian.com/cloud/trello/rest/api-group-lists/#api-lists-post
+        return self.request_json("POST", "lists", {'name': name, 'idBoard': board_id})
+
+    ### Labels ###
+
+    def get_labels_on_board(self, board_id: str):
+        return self.request_json("GET", f"boards/{board_id}/labels", {'limit': 1000})
+
+    def create_label(self, board_id: str, name: str, color: str = 'sky'):
+        return self.request_json("POST",
+                                 f"boards/{board_id}/labels",
+                                 {'name': name, 'color': color, 'idBoard': board_id})
+
+    ### Cards ###
+
+    def get_cards_on_board(self, board_id: str):
+        return self.request_json("GET", f"boards/{board_id}/cards")
+
+    def get_card(self, card_id: str):
+        return self.request_json("GET", f"cards/{card_id}")
+
+    def create_card(self,
+                    list_id: str,
+                    name: str,
+                    description: str = '',
+                    label_ids: list[str] = [],
+                    due: Optional[str] = None) -> dict[str, Any]:
+        # https://developer.atlassian.com/cloud/trello/rest/api-group-cards/#api-cards-post
+        query = {
+            'name': name,
+            'desc': description,
+            'idList': list_id,
+            'idLabels': label_ids,
+        }
+        if due: query['due'] = due
+        return self.request_json("POST", "cards", query)
+
+    def delete_card(self, id: str):
+        return self.request_json("DELETE", f"cards/{id}")
+
+    def update_card(self, id: str, update_field: str, updated_value: Any):
+        # https://developer.atlassian.com/cloud/trello/rest/api-group-cards/#api-cards-id-put
+        return self.request_json("PUT", f"cards/{id}", {update_field: updated_value})
+
+
+class AsyncTrelloClient():
+    """
+    The asyncio counterpart of TrelloClient, holding a pooled, keep-alive httpx.AsyncClient.
+
+    The client's connections belong to the event loop it is first used on, so use one client per event loop.
+
+    Usage example:
+    async with AsyncTrelloClient() as client:
+        cards, labels = await asyncio.gather(client.get_cards_on_board(board_id), client.get_labels_on_board(board_id))
+    """
+
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 token: Optional[str] = None,
+                 base_url: str = TRELLO_BASE_URL,
+                 timeout: float | tuple[float, float] = (3.05, 30),
+                 max_connections: int = 16,
+                 max_keepalive_connections: int = 16,
+                 scheduler: Optional[RequestScheduler] = None):
+        """
+        api_key, token: Trello credentials. Default to TRELLO_API_KEY and TRELLO_OAUTH_TOKEN.
+        base_url: Root of the REST API. Override to point at a local stand-in server.
+        timeout: Seconds to wait, either one value or a (connect, read) pair.
+        max_connections: Maximum number of open connections. Callers beyond this wait for a free connection.
+        max_keepalive_connections: Maximum number of idle connections kept open for reuse.
+        scheduler: Paces the client's requests. Defaults to the shared default_scheduler.
+        """
+        self.api_key, self.token = _credentials(api_key, token)
+        self.base_url = base_url.rstrip('/')
+        self.scheduler = scheduler or default_scheduler
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.session = httpx.AsyncClient(timeout=timeout,
+                                         limits=httpx.Limits(max_connections=max_connections,
+                                                             max_keepalive_connections=max_keepalive_connections),
+                                         headers={"Accept": "application/json"})
+
+    async def aclose(self):
+        await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def request(self, method: str, path: str, params: Optional[dict[str, Any]] = None) -> httpx.Response:
+        query = {
+            'key': self.api_key,
+            'token': self.token,
+        }
+        if params: query.update(params)
+
+        priority = _request_priority.get()
+        with tracing.span(_span_name(method, path), priority=priority) as span:
+            for attempt in range(self.scheduler.max_retries + 1):
+                await self.scheduler.acquire_async(priority)
+                response = await self.session.request(method,
+                                                      f"{self.base_url}/{path.lstrip('/')}",
+                                                      params=query)
+                if response.status_code != 429:
+                    break
+                self.scheduler.rate_limited(attempt, response.headers.get('Retry-After'))
+            span.set(status_code=response.status_code, attempts=attempt + 1)
+        return response
+
+    async def request_json(self, method: str, path: str, params: Optional[dict[str, Any]] = None):
+        response = await self.request(method, path, params)
+        if response.status_code >= 400:
+            raise TrelloError(response)
+        return json.loads(response.text)
+
+    ### Boards ###
+
+    async def create_board(self, name: str):
+        return (await self.request_json("POST", "boards/", {'name': name}))['id']
+
+    async def delete_board(self, board_id: str):
+        await self.request("DELETE", f"boards/{board_id}")
+
+    async def get_boards(self):
+        return await self.request_json("GET", "members/me/boards")
+
+    async def get_board_actions(self, board_id: str, since: Optional[str] = None, limit: int = 1000):
+        query = {'limit': limit}
+        if since: query['since'] = since
+        return await self.request_json("GET", f"boards/{board_id}/actions", query)
+
+    ### Lists ###
+
+    async def get_lists_on_board(self, board_id: str):
+        return await self.request_json("GET", f"boards/{board_id}/lists")
+
+    async def create_list(self, board_id: str, name: str):
+        return await self.request_json("POST", "lists", {'name': name, 'idBoard': board_id})
+
+    ### Labels ###
+
+    async def get_labels_on_board(self, board_id: str):
+        return await self.request_json("GET", f"boards/{board_id}/labels", {'limit': 1000})
+
+    async def create_label(self, board_id: str, name: str, color: str = 'sky'):
+        return await self.request_json("POST",
+                                       f"boards/{board_id}/labels",
+                                       {'name': name, 'color': color, 'idBoard': board_id})
+
+    ### Cards ###
+
+    async def get_cards_on_board(self, board_id: str):
+        return await self.request_json("GET", f"boards/{board_id}/cards")
+
+    async def get_card(self, card_id: str):
+        return await self.request_json("GET", f"cards/{card_id}")
+
+    async def create_card(self,
+                          list_id: str,
+                          name: str,
+                          description: str = '',
+                          label_ids: list[str] = [],
+                          due: Optional[str] = None) -> dict[str, Any]:
+        query = {
+            'name': name,
+            'desc': description,
+            'idList': list_id,
+            'idLabels': label_ids,
+        }
+        if due: query['due'] = due
+        return await self.request_json("POST", "cards", query)
+
+    async def delete_card(self, id: str):
+        return await self.request_json("DELETE", f"cards/{id}")
+
+    async def update_card(self, id: str, update_field: str, updated_value: Any):
+        return await self.request_json("PUT", f"cards/{id}", {update_field: updated_value})
+
+
+class BoardMetadataCache():
+    """
+    A time-limited cache of board metadata: board ids by name, and the lists and labels on each board.
+
+    These rarely change, but used to be re-downloaded several times per task. Entries expire after ttl seconds.
+    Creating lists and labels through this module writes the new entry through to the cache, and invalidate()
+    drops entries explicitly, eg. after the board was edited elsewhere.
+    """
+
+    def __init__(self, ttl: float = TRELLO_METADATA_TTL):
+        self.ttl = ttl
+        self._entries = {} # (kind, key) -> (expires_at, value)
+        self._lock = threading.RLock()
+
+    def get(self, kind: str, key: str):
+        """Get a cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[(kind, key)]
+                return None
+            return value
+
+    def put(self, kind: str, key: str, value):
+        with self._lock:
+            self._entries[(kind, key)] = (time.monotonic() + self.ttl, value)
+
+    def append(self, kind: str, key: str, item: dict):
+        """Write an item through to a cached list of items, if that list is cached."""
+        with self._lock:
+            items = self.get(kind, key)
+            if items is not None:
+                items.append(item)
+
+    def invalidate(self, board_id: Optional[str] = None):
+        """Drop everything cached about one board, or the whole cache if no board is given."""
+        with self._lock:
+            if board_id is None:
+                self._entries.clear()
+                return
+            stale = [k for k, (_, v) in self._entries.items() if k[1] == board_id or (k[0] == 'board_id' and v == board_id)]
+            for k in stale:
+                del self._entries[k]
+
+
+metadata_cache = BoardMetadataCache()
+
+def invalidate(board_id: Optional[str] = None):
+    """Drop cached board metadata for one board, or for all boards."""
+    metadata_cache.invalidate(board_id)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_default_client() -> TrelloClient:
+    """Get the shared client used by the module-level functions, creating it on first use."""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = TrelloClient()
+    return _default_client
+
+def set_default_client(client: TrelloClient):
+    """Replace the shared client used by the module-level functions, eg. with one pointed at a stand-in server."""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+
+# An httpx.AsyncClient's connections belong to the event loop it was first used on, so each loop gets its own client.
+# A loop's client is dropped along with the loop
+_default_async_clients = weakref.WeakKeyDictionary() # event loop -> its AsyncTrelloClient
+_default_async_clients_lock = threading.Lock()
+
+def get_default_async_client() -> AsyncTrelloClient:
+    """Get the running event loop's client, used by the module-level async functions, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _default_async_clients_lock:
+        client = _default_async_clients.get(loop)
+        if client is None:
+            client = _default_async_clients[loop] = AsyncTrelloClient()
+    return client
+
+def set_default_async_client(client: AsyncTrelloClient):
+    """Replace the running event loop's client used by the module-level async functions."""
+    loop = asyncio.get_running_loop()
+    with _default_async_clients_lock:
+        _default_async_clients[loop] = client
+
+
 @contextmanager
 def test_board():
     """
@@ -36,71 +479,34 @@ def test_board():
         delete_board(board_id)
 
 def create_board(name: str):
-    url = "https://api.trello.com/1/boards/"
-
-    query = {
-        'name': name,
-        'key': TRELLO_API_KEY,
-        'token': TRELLO_OAUTH_TOKEN
-    }
-
-    response = requests.request(
-        "POST",
-        url,
-        params=query
-    )
-
-    return json.loads(response.text)['id']
+    board_id = get_default_client().create_board(name)
+    metadata_cache.put('board_id', name, board_id)
+    return board_id
 
 def delete_board(board_id: str):
-    url = f"https://api.trello.com/1/boards/{board_id}"
-
-    query = {
-        'key': TRELLO_API_KEY,
-        'token': TRELLO_OAUTH_TOKEN
-    }
-
-    response = requests.request(
-        "DELETE",
-        url,
-        params=query
-    )
+    get_default_client().delete_board(board_id)
+    metadata_cache.invalidate(board_id)
  
 def get_boards():
-    url = 'https://api.trello.com/1/members/me/boards'
-
-    query = {
-        'key': TRELLO_API_KEY,
-        'token': TRELLO_OAUTH_TOKEN
-    }
+    return get_default_client().get_boards()
 
-    response = requests.get(url, params=query)
-    return response.json()
+def get_board_actions(board_id: str, since: Optional[str] = None, limit: int = 1000):
+    return get_default_client().get_board_actions(board_id, since, limit)
 
 def get_board_id(board_name: str):
-    boards = get_boards()
-    return _find_dict_by_name(boards, board_name)['id']
+    board_id = metadata_cache.get('board_id', board_name)
+    if board_id is None:
+        boards = get_boards()
+        board_id = _find_dict_by_name(boards, board_name)['id']
+        metadata_cache.put('board_id', board_name, board_id)
+    return board_id
 
 def get_lists_on_board(board_id: str):
-    url = f"https://api.trello.com/1/boards/{board_id}/lists"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    'key': TRELLO_API_KEY,
-    'token': TRELLO_OAUTH_TOKEN
-    }
-
-    response = requests.request(
-    "GET",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
+    lists = metadata_cache.get('lists', board_id)
+    if lists is None:
+        lists = get_default_client().get_lists_on_board(board_id)
+        metadata_cache.put('lists', board_id, lists)
+    return list(lists)
 
 def get_list_id(board_id: str, list_name: str):
     lists = get_lists_on_board(board_id)
@@ -111,187 +517,102 @@ def get_list_id(board_id: str, list_name: str):
 
 def create_list(board_id: str,
                 name: str):
-    # https://developer.atlassian.com/cloud/trello/rest/api-group-lists/#api-lists-post
-    url = "https://api.trello.com/1/lists"
-
-    query = {
-    'name': name,
-    'idBoard': board_id,
-    'key': os.environ['TRELLO_API_KEY'],
-    'token': os.environ['TRELLO_OAUTH_TOKEN']
-    }
-
-    response = requests.request(
-    "POST",
-    url,
-    params=query
-    )
-
-    return json.loads(response.text)
+    new_list = get_default_client().create_list(board_id, name)
+    metadata_cache.append('lists', board_id, new_list)
+    return new_list
 
 def get_labels_on_board(board_id: str):
-    url = f"https://api.trello.com/1/boards/{board_id}/labels"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    'key': TRELLO_API_KEY,
-    'token': TRELLO_OAUTH_TOKEN,
-    'limit': 1000,
-    }
-
-    response = requests.request(
-    "GET",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
+    labels = metadata_cache.get('labels', board_id)
+    if labels is None:
+        labels = get_default_client().get_labels_on_board(board_id)
+        metadata_cache.put('labels', board_id, labels)
+    return list(labels)
 
 def create_label(board_id: str,
                  name: str,
                  color: str = 'sky'):
-    url = f"https://api.trello.com/1/boards/{board_id}/labels"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    'name': name,
-    'color': color,
-    'idBoard': board_id,
-    'key': TRELLO_API_KEY,
-    'token': TRELLO_OAUTH_TOKEN,
-    }
-
-    response = requests.request(
-    "POST",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
+    label = get_default_client().create_label(board_id, name, color)
+    metadata_cache.append('labels', board_id, label)
+    return label
 
 def get_cards_on_board(board_id: str):
-    url = f"https://api.trello.com/1/boards/{board_id}/cards"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    'key': TRELLO_API_KEY,
-    'token': TRELLO_OAUTH_TOKEN
-    }
-
-    response = requests.request(
-    "GET",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
+    return get_default_client().get_cards_on_board(board_id)
 
 def get_card(card_id: str):
-    url = f"https://api.trello.com/1/cards/{card_id}"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    'key': TRELLO_API_KEY,
-    'token': TRELLO_OAUTH_TOKEN
-    }
-
-    response = requests.request(
-    "GET",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
+    return get_default_client().get_card(card_id)
 
 def create_card(list_id: str,
                 name: str,
                 description: str = '',
                 label_ids: list[str] = [],
                 due: Optional[str] = None) -> dict[str, Any]:
-    # https://developer.atlassian.com/cloud/trello/rest/api-group-cards/#api-cards-post
-    url = "https://api.trello.com/1/cards"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    'name': name,
-    'desc': description,
-    'idList': list_id,
-    'idLabels': label_ids,
-    'key': os.environ['TRELLO_API_KEY'],
-    'token': os.environ['TRELLO_OAUTH_TOKEN']
-    }
-
-    if due: query['due'] = due
-
-    response = requests.request(
-    "POST",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
-
+    return get_default_client().create_card(list_id, name, description, label_ids, due)
 
 def delete_card(id: str):
-    url = f"https://api.trello.com/1/cards/{id}"
-
-    query = {
-        'key': TRELLO_API_KEY,
-        'token': TRELLO_OAUTH_TOKEN
-    }
-
-    response = requests.request(
-        "DELETE",
-        url,
-        params=query
-    )
-
-    return json.loads(response.text)
+    return get_default_client().delete_card(id)
 
 def update_card(id: str,
                 update_field: str,
                 updated_value: Any):
     """
-    Update the description of a card.
+    Update a single field of a card.
     """
-    # https://developer.atlassian.com/cloud/trello/rest/api-group-cards/#api-cards-post
-    url = f"https://api.trello.com/1/cards/{id}"
-
-    headers = {
-    "Accept": "application/json"
-    }
-
-    query = {
-    update_field: updated_value,
-    'key': os.environ['TRELLO_API_KEY'],
-    'token': os.environ['TRELLO_OAUTH_TOKEN']
-    }
-
-    response = requests.request(
-    "PUT",
-    url,
-    headers=headers,
-    params=query
-    )
-
-    return json.loads(response.text)
\ No newline at end of file
+    return get_default_client().update_card(id, update_field, updated_value)
+
+### Async versions ###
+
+async def aget_board_id(board_name: str):
+    board_id = metadata_cache.get('board_id', board_name)
+    if board_id is None:
+        boards = await get_default_async_client().get_boards()
+        board_id = _find_dict_by_name(boards, board_name)['id']
+        metadata_cache.put('board_id', board_name, board_id)
+    return board_id
+
+async def aget_lists_on_board(board_id: str):
+    lists = metadata_cache.get('lists', board_id)
+    if lists is None:
+        lists = await get_default_async_client().get_lists_on_board(board_id)
+        metadata_cache.put('lists', board_id, lists)
+    return list(lists)
+
+async def acreate_list(board_id: str,
+                       name: str):
+    new_list = await get_default_async_client().create_list(board_id, name)
+    metadata_cache.append('lists', board_id, new_list)
+    return new_list
+
+async def aget_labels_on_board(board_id: str):
+    labels = metadata_cache.get('labels', board_id)
+    if labels is None:
+        labels = await get_default_async_client().get_labels_on_board(board_id)
+        metadata_cache.put('labels', board_id, labels)
+    return list(labels)
+
+async def acreate_label(board_id: str,
+                        name: str,
+                        color: str = 'sky'):
+    label = await get_default_async_client().create_label(board_id, name, color)
+    metadata_cache.append('labels', board_id, label)
+    return label
+
+async def aget_cards_on_board(board_id: str):
+    return await get_default_async_client().get_cards_on_board(board_id)
+
+async def aget_card(card_id: str):
+    return await get_default_async_client().get_card(card_id)
+
+async def acreate_card(list_id: str,
+                       name: str,
+                       description: str = '',
+                       label_ids: list[str] = [],
+                       due: Optional[str] = None) -> dict[str, Any]:
+    return await get_default_async_client().create_card(list_id, name, description, label_ids, due)
+
+async def adelete_card(id: str):
+    return await get_default_async_client().delete_card(id)
+
+async def aupdate_card(id: str,
+                       update_field: str,
+                       updated_value: Any):
+    return await get_default_async_client().update_card(id, update_field, updated_value)
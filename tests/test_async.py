@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import weakref
+
+import pytest
+
+import secretary.tasks as tasks
+import secretary.utils_openai as ai
+import secretary.utils_trello as utils_trello
+from secretary.utils_trello import BoardMetadataCache
+
+
+class FakeAsyncTrelloClient():
+    """Stands in for AsyncTrelloClient, recording the event loop it was created on."""
+    created = []
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.cards = {'c1': {'id': 'c1', 'name': 'Buy eggs', 'idLabels': []}}
+        FakeAsyncTrelloClient.created.append(self)
+
+    async def get_boards(self):
+        return [{'id': 'b1', 'name': tasks.BOARD_NAME}]
+
+    async def get_lists_on_board(self, board_id):
+        return [{'id': 'l1', 'name': 'Action Items'}]
+
+    async def get_labels_on_board(self, board_id):
+        return [{'id': 'x1', 'name': 'home'}]
+
+    async def create_card(self, list_id, name, description='', label_ids=[], due=None):
+        card = {'id': f'c{len(self.cards) + 1}', 'name': name, 'idList': list_id, 'idLabels': label_ids, 'due': due}
+        self.cards[card['id']] = card
+        return card
+
+    async def get_card(self, card_id):
+        return self.cards[card_id]
+
+    async def delete_card(self, id):
+        return self.cards.pop(id)
+
+
+@pytest.fixture
+def trello(monkeypatch):
+    FakeAsyncTrelloClient.created = []
+    monkeypatch.setattr(utils_trello, 'AsyncTrelloClient', FakeAsyncTrelloClient)
+    monkeypatch.setattr(utils_trello, '_default_async_clients', weakref.WeakKeyDictionary())
+    monkeypatch.setattr(utils_trello, 'metadata_cache', BoardMetadataCache())
+    monkeypatch.setattr(tasks, 'card_store', None)
+    return FakeAsyncTrelloClient
+
+
+def test_each_event_loop_gets_its_own_client(trello, monkeypatch):
+    class FakeAsyncOpenAI():
+        def __init__(self, **kwargs):
+            self.loop = asyncio.get_running_loop()
+    monkeypatch.setattr(ai, 'AsyncOpenAI', FakeAsyncOpenAI)
+    monkeypatch.setattr(ai, '_async_clients', weakref.WeakKeyDictionary())
+
+    async def clients():
+        return [utils_trello.get_default_async_client(), utils_trello.get_default_async_client(),
+                ai.get_async_client(), ai.get_async_client()]
+
+    first = asyncio.run(clients())
+    second = asyncio.run(clients())
+    assert first[0] is first[1] and first[2] is first[3] # shared within a loop
+    assert second[0] is not first[0] and second[2] is not first[2] # but not across loops
+    assert second[0].loop is not first[0].loop
+    assert len(trello.created) == 2
+
+
+def test_aadd_new_tasks_embeds_the_new_cards(trello, monkeypatch):
+    embedded = []
+    monkeypatch.setattr(tasks, 'embedding_store', object()) # only its presence matters here
+    monkeypatch.setattr(tasks, 'get_task_embeddings', lambda cards: embedded.append(([card['name'] for card in cards], threading.get_ident())))
+    new_task = {'summary': 'Pay rent.', 'type': 'Action Items', 'topics': ['home'], 'due_date': None,
+                'requestor': None, 'actor': None, 'notes': ''}
+
+    async def add():
+        return await tasks.aadd_new_tasks([new_task]), threading.get_ident()
+
+    (cards, failures), loop_thread = asyncio.run(add())
+    assert [card['name'] for card in cards] == ['Pay rent'] and failures == []
+    assert cards[0]['idLabels'] == ['x1']
+    assert [names for names, _ in embedded] == [['Pay rent']] # like add_new_tasks()
+    assert embedded[0][1] != loop_thread # in a thread, not on the event loop
+
+
+def test_amark_task_completed_records_the_deletion_off_the_loop(trello, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(tasks, '_record_deleted_card', lambda id: recorded.append((id, threading.get_ident())))
+
+    async def complete():
+        return await tasks.amark_task_completed('c1'), threading.get_ident()
+
+    card, loop_thread = asyncio.run(complete())
+    assert card['name'] == 'Buy eggs'
+    assert [id for id, _ in recorded] == ['c1']
+    assert recorded[0][1] != loop_thread
@@ -0,0 +1,154 @@
+import json
+
+import pytest
+
+import secretary.tasks as tasks
+import secretary.utils_trello as utils_trello
+from secretary.card_store import CardStore
+
+
+class FakeResponse():
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+
+class FakeTrello():
+    """An in-memory board, with an actions feed, standing in for the Trello API."""
+
+    def __init__(self):
+        self.cards = {}
+        self.actions = [] # newest first
+        self.calls = []
+        self.lists = [{'id': 'l1', 'name': 'Action Items'}]
+        self.labels = []
+
+    def act(self, action_type, card_id=None):
+        action = {'id': f'a{len(self.actions) + 1:04d}', 'type': action_type, 'data': {}}
+        if card_id is not None:
+            action['data']['card'] = {'id': card_id}
+        self.actions.insert(0, action)
+
+    def add_card(self, card_id, name):
+        self.cards[card_id] = {'id': card_id, 'name': name, 'idBoard': 'b1', 'closed': False}
+        self.act('createCard', card_id)
+
+    # The utils_trello functions and client methods the store uses
+    def get_board_id(self, board_name):
+        return 'b1'
+
+    def get_board_actions(self, board_id, since=None, limit=1000):
+        self.calls.append(('actions', since))
+        return [action for action in self.actions if since is None or action['id'] > since][:limit]
+
+    def get_cards_on_board(self, board_id):
+        self.calls.append('cards')
+        return [card for card in self.cards.values() if not card['closed']]
+
+    def get_lists_on_board(self, board_id):
+        self.calls.append('lists')
+        return list(self.lists)
+
+    def get_labels_on_board(self, board_id):
+        self.calls.append('labels')
+        return list(self.labels)
+
+    def request(self, method, path):
+        card_id = path.split('/')[-1]
+        self.calls.append(('card', card_id))
+        if card_id not in self.cards:
+            return FakeResponse(404, 'not found')
+        return FakeResponse(200, self.cards[card_id])
+
+
+@pytest.fixture
+def trello(monkeypatch):
+    trello = FakeTrello()
+    for name in ['get_board_id', 'get_board_actions', 'get_cards_on_board']:
+        monkeypatch.setattr(utils_trello, name, getattr(trello, name))
+    monkeypatch.setattr(utils_trello, '_default_client', trello)
+    monkeypatch.setattr(utils_trello, 'metadata_cache', utils_trello.BoardMetadataCache())
+    return trello
+
+
+def names(cards):
+    return sorted(card['name'] for card in cards)
+
+
+def test_full_load_then_incremental_sync(trello):
+    trello.add_card('c1', 'Buy eggs')
+    trello.add_card('c2', 'Pay rent')
+    store = CardStore(':memory:', 'Secretary', max_staleness=30)
+    assert names(store.get_cards()) == ['Buy eggs', 'Pay rent']
+    assert store.version == 1
+    assert 'cards' in trello.calls and store.get_lists() == trello.lists
+
+    # Fresh enough: served locally, without asking Trello
+    trello.calls.clear()
+    store.get_cards()
+    assert trello.calls == []
+
+    # Only the cards that have actions since the last sync are fetched, and removed cards are dropped
+    trello.cards['c1']['name'] = 'Buy a dozen eggs'
+    trello.act('updateCard', 'c1')
+    trello.act('deleteCard', 'c2')
+    del trello.cards['c2']
+    trello.add_card('c3', 'Call Silvia')
+    trello.cards['c4'] = {'id': 'c4', 'name': 'Elsewhere', 'idBoard': 'b2', 'closed': False}
+    trello.act('moveCardToBoard', 'c4')
+    assert names(store.get_cards(consistent=True)) == ['Buy a dozen eggs', 'Call Silvia']
+    assert trello.calls == [('actions', 'a0002'), ('card', 'c4'), ('card', 'c3'), ('card', 'c1')]
+    assert store.version == 2
+
+    # Nothing new: the replica and its version are unchanged
+    store.get_cards(consistent=True)
+    assert store.version == 2
+
+    # A list action reloads the lists
+    trello.lists.append({'id': 'l2', 'name': 'Waiting'})
+    trello.act('createList')
+    assert len(store.get_lists(consistent=True)) == 2
+
+
+def test_full_reload_when_the_actions_page_is_full(trello):
+    trello.add_card('c1', 'Buy eggs')
+    store = CardStore(':memory:', 'Secretary')
+    store.refresh()
+    for i in range(1000):
+        trello.act('updateCard', 'c1')
+    trello.cards['c1']['name'] = 'Buy a dozen eggs'
+    trello.calls.clear()
+    assert names(store.get_cards(consistent=True)) == ['Buy a dozen eggs']
+    assert 'cards' in trello.calls and ('card', 'c1') not in trello.calls
+    assert store.version == 2
+
+
+def test_consistent_card_reads_and_local_writes(trello):
+    trello.add_card('c1', 'Buy eggs')
+    store = CardStore(':memory:', 'Secretary')
+    store.refresh()
+
+    trello.cards['c1']['closed'] = True
+    assert store.get_card('c1') is not None # stale, but within max_staleness
+    assert store.get_card('c1', consistent=True) is None
+    version = store.version
+
+    store.upsert_card({'id': 'c2', 'name': 'Pay rent'})
+    store.remove_card('c2')
+    assert store.version == version + 2
+    assert store.get_card('c2') is None
+
+
+def test_due_index_is_rebuilt_per_store_version(trello, monkeypatch, tmp_path):
+    monkeypatch.setattr(tasks, 'card_store', None) # restored after the test
+    trello.add_card('c1', 'Buy eggs')
+    store = tasks.enable_card_store(str(tmp_path / 'board.sqlite'), board_name='Secretary')
+    index = tasks.get_due_index()
+    assert tasks.get_due_index() is index
+    store.upsert_card({'id': 'c2', 'name': 'Pay rent', 'due': '2024-08-20T17:00:00.000Z'})
+    assert len(tasks.get_due_index()) == 2
+
+    # A new store starts at version 0 again, and doesn't reuse the old store's index
+    other = CardStore(':memory:', 'Secretary')
+    monkeypatch.setattr(tasks, 'card_store', other)
+    assert len(tasks.get_due_index()) == 1
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import secretary.utils_openai as ai
+
+
+def _messages(current_time, comment):
+    return [{"role": "system", "content": f"Extract tasks.\nThe current date and time is {current_time}."},
+            {"role": "user", "content": comment}]
+
+
+def test_cache_key_ignores_time_of_day_unless_content_depends_on_it():
+    key = lambda current_time, comment: ai._cache_key('gpt-4o', _messages(current_time, comment), None, 0)
+
+    assert key('2024-08-20 12:00:00 +0000', 'Buy eggs tomorrow') == key('2024-08-20 12:05:00 +0000', 'Buy eggs tomorrow')
+    assert key('2024-08-20 12:00:00 +0000', 'Buy eggs tomorrow') != key('2024-08-21 12:00:00 +0000', 'Buy eggs tomorrow')
+    assert key('2024-08-20 12:00:00 +0000', 'Call Bob in 2 hours') != key('2024-08-20 12:05:00 +0000', 'Call Bob in 2 hours')
+
+
+def test_completion_cache_tiers(tmp_path):
+    path = str(tmp_path / 'completions.sqlite')
+    cache = ai.CompletionCache(max_entries=1, path=path, max_disk_bytes=10)
+    cache.put('a', '12345')
+    cache.put('b', '67890')
+    assert cache.get('b') == '67890' # from memory
+    assert cache.get('a') == '12345' # evicted from memory, but still on disk
+    cache.put('c', 'abcde') # over max_disk_bytes, so the least recently used entry is evicted from disk
+    assert cache.stats()['hits'] == {'memory': 1, 'disk': 1}
+
+    cache = ai.CompletionCache(path=path, max_disk_bytes=10)
+    assert cache.get('b') is None
+    assert cache.get('a') == '12345'
+    assert cache.get('c') == 'abcde'
+    assert ai.CompletionCache(path=path, ttl=0).get('a') is None
+
+
+class FakeChatClient():
+    """Stands in for the OpenAI client, answering with the current time from the system message."""
+
+    def __init__(self):
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, temperature, tools, messages):
+        self.requests += 1
+        message = SimpleNamespace(content=f'Answer to request {self.requests}', tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def test_date_relative_questions_are_not_replayed_later_in_the_day(monkeypatch):
+    client = FakeChatClient()
+    monkeypatch.setattr(ai, 'get_client', lambda: client)
+    monkeypatch.setattr(ai, 'completion_cache', ai.CompletionCache())
+    tools = [{'type': 'function', 'function': {'name': 'mark_task_completed'}}]
+
+    morning = ai.get_conversation_completion(_messages('2024-08-20 08:00:00 +0000', "What's overdue?"), tools=tools)
+    evening = ai.get_conversation_completion(_messages('2024-08-20 17:00:00 +0000', "What's overdue?"), tools=tools)
+    assert (morning[0], evening[0]) == ('Answer to request 1', 'Answer to request 2')
+
+    # Even when a caller opts in, a tool-calling request keeps the time of day in its key
+    asked_at = lambda current_time: ai.get_conversation_completion(_messages(current_time, "What's due today?"), tools=tools, use_cache=True)
+    assert asked_at('2024-08-20 08:00:00 +0000') != asked_at('2024-08-20 17:00:00 +0000')
+    assert client.requests == 4
+
+    # Extraction, which opts in without tools, is still reused within the day
+    extract = lambda current_time: ai.get_completion('Buy eggs tomorrow', f'Extract tasks.\nThe current date and time is {current_time}.', use_cache=True)
+    assert extract('2024-08-20 08:00:00 +0000') == extract('2024-08-20 17:00:00 +0000')
+    assert client.requests == 5
@@ -0,0 +1,82 @@
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytz
+from slack_sdk.errors import SlackApiError
+
+from secretary.digest import DigestEngine, SlackSender, compute_digest, render_digest
+from secretary.due_index import DueIndex
+from secretary.rate_limit import RequestScheduler
+
+CARDS = [{'id': '1', 'name': 'Pay rent', 'url': 'u1', 'due': '2024-08-20T10:00:00.000Z'},
+         {'id': '2', 'name': 'Call Silvia', 'url': 'u2', 'due': '2024-08-20T20:00:00.000Z'},
+         {'id': '3', 'name': 'Buy eggs', 'url': 'u3', 'due': None}]
+AS_OF = datetime(2024, 8, 20, 15, tzinfo=pytz.utc).timestamp()
+
+
+def test_compute_digest_in_each_users_time_zone():
+    index = DueIndex(CARDS)
+    london = compute_digest(index, 'Europe/London', AS_OF) # 16:00 local, so 20:00 UTC is 21:00 today
+    assert [card['name'] for card in london['due_later_today']] == ['Call Silvia']
+    assert [card['name'] for card in london['overdue']] == ['Pay rent']
+    kolkata = compute_digest(index, 'Asia/Kolkata', AS_OF) # 20:30 local, so 20:00 UTC is 01:30 tomorrow
+    assert kolkata['due_later_today'] == []
+    assert [card['name'] for card in kolkata['overdue']] == ['Pay rent']
+
+    text, blocks = render_digest('Jack', london)
+    assert text == 'Good morning Jack! You have 1 due later today and 1 overdue.'
+    assert [block['type'] for block in blocks] == ['section', 'section', 'divider', 'section']
+    assert '<u2|Call Silvia>' in blocks[1]['text']['text']
+
+
+class FakeSender():
+    def __init__(self):
+        self.sent = []
+
+    def send(self, channel, text, blocks=None):
+        self.sent.append((channel, text))
+        future = Future()
+        future.set_result({'ok': True})
+        return future
+
+
+def test_digest_engine_shares_snapshots_and_uses_prepared_digests():
+    snapshots = []
+    sender = FakeSender()
+    engine = DigestEngine(lambda board: snapshots.append(board) or DueIndex(CARDS), sender)
+    for user_id in ['U1', 'U2', 'U3']:
+        engine.prepare(user_id, user_id, 'Europe/London', 'Secretary', deliver_at=AS_OF)
+    engine.deliver('U4', 'U4', 'UTC', 'Secretary')
+    assert snapshots == ['Secretary'] # one snapshot for all four users
+    assert engine.stats['delivered_prepared'] == 0 # U4's digest wasn't prepared
+    assert len(sender.sent) == 1
+
+
+class FakeSlackResponse(dict):
+    def __init__(self, status_code, error=None, headers=None):
+        super().__init__(ok=error is None, error=error)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSlackClient():
+    """Stands in for a Slack WebClient: posting to 'C-gone' fails, and posting to 'C-busy' is always rate limited."""
+
+    def chat_postMessage(self, channel, text, blocks=None):
+        if channel == 'C-gone':
+            raise SlackApiError('not_in_channel', FakeSlackResponse(200, 'not_in_channel'))
+        if channel == 'C-busy':
+            raise SlackApiError('ratelimited', FakeSlackResponse(429, 'ratelimited', {'Retry-After': '0'}))
+        return FakeSlackResponse(200)
+
+
+def test_slack_sender_logs_and_counts_failed_posts(caplog):
+    sender = SlackSender(FakeSlackClient(), RequestScheduler(100, 1.0, base_backoff=0.001), max_retries=2)
+    futures = [sender.send(channel, 'Good morning!') for channel in ['U1', 'C-gone', 'C-busy']]
+    for future in futures:
+        future.exception(timeout=5)
+    sender._pool.shutdown(wait=True) # the done callbacks have run
+    assert sender.stats == {'sent': 1, 'failed': 2}
+    assert sender.rate_limiter.metrics()['rate_limited_responses'] == 2 # C-busy was retried twice, then given up on
+    assert sorted(record.getMessage() for record in caplog.records) == ['Could not post to C-busy (ratelimited)',
+                                                                       'Could not post to C-gone (not_in_channel)']
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta, timezone
+
+from secretary.due_index import DueIndex, parse_due
+
+
+def test_parse_due():
+    assert parse_due('2024-08-20T17:00:00.000Z') == datetime(2024, 8, 20, 17, tzinfo=timezone.utc).timestamp()
+    assert parse_due(None) is None
+    assert parse_due('not a date') is None
+
+
+def test_due_index_range_queries():
+    cards = [{'id': 'a', 'due': '2024-08-21T09:00:00.000Z'},
+             {'id': 'b', 'due': None},
+             {'id': 'c', 'due': '2024-08-20T17:00:00.000Z'},
+             {'id': 'd', 'due': '2024-08-22T00:00:00.000Z'},
+             {'id': 'e'}]
+    index = DueIndex(cards)
+
+    assert len(index) == 5
+    assert [card['id'] for card in index.undated] == ['b', 'e']
+
+    start = datetime(2024, 8, 21, tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+    # Range queries are inclusive at both ends, and come back in due date order
+    assert [card['id'] for card in index.between(start, end)] == ['a', 'd']
+    assert [card['id'] for card in index.before(start)] == ['c']
+    assert [card['id'] for card in index.before(end)] == ['c', 'a']
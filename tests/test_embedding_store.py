@@ -0,0 +1,43 @@
+import numpy as np
+
+from secretary.embedding_store import EmbeddingStore
+
+
+def test_embedding_store_reopens_from_disk(tmp_path):
+    store = EmbeddingStore(str(tmp_path), model='test-model', dims=4, initial_capacity=2)
+    vectors = {f'text {i}': np.arange(4, dtype=np.float32) + i for i in range(5)}
+    for i, (text, vector) in enumerate(vectors.items()):
+        store.put(text, vector, card_id=f'card{i}')
+    store.put('text 0', vectors['text 0']) # already stored, so not stored again
+    assert len(store) == 5
+    assert store.get('never embedded') is None
+    store.close()
+
+    store = EmbeddingStore(str(tmp_path), model='test-model', dims=4)
+    assert len(store) == 5
+    for text, vector in vectors.items():
+        assert np.array_equal(store.get(text), vector)
+
+    # Embeddings are keyed by model and dims too
+    assert EmbeddingStore(str(tmp_path), model='other-model', dims=4).get('text 0') is None
+
+
+def test_embedding_store_garbage_collects_deleted_cards(tmp_path):
+    store = EmbeddingStore(str(tmp_path), model='test-model', dims=2, gc_garbage_fraction=1.0)
+    store.put('keep', np.array([1, 0]), card_id='a')
+    store.put('delete', np.array([0, 1]), card_id='b')
+    store.put('old text', np.array([1, 1]), card_id='c')
+    store.put('new text', np.array([2, 2]), card_id='c')
+
+    store.remove_card('b')
+    store.gc()
+    assert len(store) == 2
+    assert store.get('delete') is None
+    assert store.get('old text') is None
+    store.close()
+
+    store = EmbeddingStore(str(tmp_path), model='test-model', dims=2)
+    assert len(store) == 2
+    assert np.array_equal(store.get('keep'), [1, 0])
+    assert np.array_equal(store.get('new text'), [2, 2])
+    assert len(list((tmp_path / 'test-model-2').glob('vectors-*.npy'))) == 1
@@ -0,0 +1,51 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import secretary.utils_openai as ai
+
+
+def fake_embedding(text):
+    return [float(len(text)), float(ord(text[0]))]
+
+
+class FakeEmbeddings():
+    """Stands in for client.embeddings, recording each request's inputs. The first request is the slowest."""
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def create(self, input, model):
+        with self.lock:
+            self.requests.append(list(input))
+            first = len(self.requests) == 1
+        if first:
+            time.sleep(0.05) # finishes after the later batches
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(text)) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1]) # the API doesn't promise to return the inputs in order
+
+
+def test_embedding_batches_respect_the_request_limits(monkeypatch):
+    monkeypatch.setattr(ai, 'EMBEDDING_BATCH_MAX_INPUTS', 3)
+    monkeypatch.setattr(ai, 'EMBEDDING_BATCH_MAX_TOKENS', 10)
+    texts = ['a', 'b', 'c', 'd', 'x' * 12, 'y' * 12, 'e', 'z' * 60, 'f'] # estimated at 1 token each, but 5 for x and y and 21 for z
+    # A text over the token limit on its own still gets a batch of its own
+    assert ai._batch_embedding_inputs(texts) == [['a', 'b', 'c'], ['d', 'x' * 12], ['y' * 12, 'e'], ['z' * 60], ['f']]
+
+
+def test_get_embeddings_dedups_and_keeps_the_order_across_batches(monkeypatch):
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(ai, 'get_client', lambda: SimpleNamespace(embeddings=embeddings))
+    monkeypatch.setattr(ai, 'EMBEDDING_BATCH_MAX_INPUTS', 2)
+
+    texts = ['Buy eggs', 'Pay rent', 'Buy eggs', '', 'Call Silvia', 'Book dentist', 'Pay rent']
+    matrix = ai.get_embeddings(texts, max_concurrent_requests=3)
+    assert matrix.dtype == np.float32
+    assert matrix.tolist() == [fake_embedding(text or ' ') for text in texts]
+    # Each distinct text is embedded once, empty texts as a space
+    assert embeddings.requests == [['Buy eggs', 'Pay rent'], [' ', 'Call Silvia'], ['Book dentist']]
+
+    assert ai.get_embeddings([]).shape == (0, ai.EMBEDDING_DIMS)
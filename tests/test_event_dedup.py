@@ -0,0 +1,25 @@
+from secretary.event_dedup import EventDedupStore, event_keys, retry_number
+
+
+def test_event_dedup_store(tmp_path):
+    body = {'event_id': 'Ev1', 'event': {'client_msg_id': 'm1', 'text': 'hi'}, 'retry_attempt': 1}
+    keys = event_keys(body)
+    assert keys == ['event:Ev1', 'msg:m1']
+    assert retry_number(body) == 1
+    assert retry_number({}, {'x-slack-retry-num': ['2']}) == 2
+
+    path = str(tmp_path / 'events.sqlite')
+    dedup = EventDedupStore(path=path)
+    assert dedup.claim(keys) == 'new'
+    assert dedup.claim(keys) == 'in_flight'
+    assert dedup.claim(['event:Ev2', 'msg:m1']) == 'in_flight' # the same message, in another event
+    dedup.finish(keys)
+    assert dedup.claim(keys) == 'done'
+
+    assert EventDedupStore(path=path).claim(keys) == 'done' # remembered across restarts
+    assert EventDedupStore(path=path, window=-1).claim(keys) == 'new' # but only within the window
+
+    dedup.release(['event:Ev3'])
+    assert dedup.claim(['event:Ev3']) == 'new'
+    dedup.release(['event:Ev3'])
+    assert dedup.claim(['event:Ev3']) == 'new'
@@ -0,0 +1,35 @@
+import secretary.utils_openai as ai
+
+
+def test_trim_keeps_newest_messages_within_budget(monkeypatch):
+    monkeypatch.setattr(ai, 'get_completion', lambda **kwargs: ('The user wants to buy eggs.', None))
+    convo = ai.Messages(token_budget=100, summarize=True)
+    convo.add_message('user', 'Buy eggs')
+    convo.add_message('assistant', 'ok')
+    convo.add_message('user', 'x' * 600) # a pasted email, about 200 tokens
+
+    convo.trim()
+    ai._summary_pool.submit(lambda: None).result() # wait for the summary
+
+    # The pasted email is kept whole, even though it is over the budget on its own
+    assert convo.messages == [{'role': 'user', 'content': 'x' * 600}]
+    assert convo.tokens > 100
+    window = convo.window()
+    assert window[0] == {'role': 'system', 'content': 'Summary of the earlier conversation:\nThe user wants to buy eggs.'}
+    assert window[1:] == convo.messages
+
+    convo.clear()
+    assert convo.window() == []
+
+
+def test_trim_never_cuts_the_newest_message():
+    convo = ai.Messages(token_budget=50)
+    email = 'Hi team, the notes from the meeting: ' + 'é' * 300 + ' Action items: send the report by Friday.'
+    convo.add_message('user', 'Buy eggs')
+    convo.add_message('user', email)
+    convo.trim()
+    assert convo.messages == [{'role': 'user', 'content': email}]
+
+    convo.add_message('assistant', 'ok')
+    convo.trim()
+    assert convo.messages == [{'role': 'assistant', 'content': 'ok'}]
@@ -0,0 +1,88 @@
+import pytest
+
+import secretary.utils_trello as utils_trello
+from secretary.utils_trello import BoardMetadataCache
+
+
+class FakeClient():
+    """Stands in for TrelloClient, counting the metadata requests."""
+
+    def __init__(self):
+        self.lists = {'b1': [{'id': 'l1', 'name': 'Action Items'}]}
+        self.labels = {'b1': [{'id': 'x1', 'name': 'home'}]}
+        self.calls = []
+
+    def get_boards(self):
+        self.calls.append('boards')
+        return [{'id': 'b1', 'name': 'Secretary'}]
+
+    def get_lists_on_board(self, board_id):
+        self.calls.append('lists')
+        return list(self.lists[board_id])
+
+    def create_list(self, board_id, name):
+        new_list = {'id': f'l{len(self.lists[board_id]) + 1}', 'name': name}
+        self.lists[board_id].append(new_list)
+        return new_list
+
+    def get_labels_on_board(self, board_id):
+        self.calls.append('labels')
+        return list(self.labels[board_id])
+
+    def create_label(self, board_id, name, color='sky'):
+        label = {'id': f'x{len(self.labels[board_id]) + 1}', 'name': name}
+        self.labels[board_id].append(label)
+        return label
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(utils_trello, '_default_client', client)
+    monkeypatch.setattr(utils_trello, 'metadata_cache', BoardMetadataCache(ttl=300))
+    return client
+
+
+def test_metadata_is_cached_and_written_through(client):
+    assert utils_trello.get_board_id('Secretary') == 'b1'
+    assert utils_trello.get_board_id('Secretary') == 'b1'
+    assert utils_trello.get_list_id('b1', 'Action Items') == 'l1'
+    assert utils_trello.get_labels_on_board('b1') == [{'id': 'x1', 'name': 'home'}]
+    assert client.calls == ['boards', 'lists', 'labels']
+
+    # New lists and labels are written through to the cached ones, without fetching them again
+    utils_trello.create_list('b1', 'Waiting')
+    utils_trello.create_label('b1', 'work')
+    assert utils_trello.get_list_id('b1', 'Waiting') == 'l2'
+    assert [label['name'] for label in utils_trello.get_labels_on_board('b1')] == ['home', 'work']
+    assert client.calls == ['boards', 'lists', 'labels']
+
+    # Callers get copies, so they can't change the cached lists
+    utils_trello.get_lists_on_board('b1').clear()
+    assert len(utils_trello.get_lists_on_board('b1')) == 2
+
+
+def test_invalidate(client):
+    utils_trello.get_board_id('Secretary')
+    utils_trello.get_lists_on_board('b1')
+    utils_trello.invalidate('b1') # drops the board's lists and labels, and its id
+    utils_trello.get_board_id('Secretary')
+    utils_trello.get_lists_on_board('b1')
+    assert client.calls == ['boards', 'lists', 'boards', 'lists']
+
+    utils_trello.invalidate()
+    utils_trello.get_lists_on_board('b1')
+    assert client.calls[-1] == 'lists'
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils_trello.time, 'monotonic', lambda: now[0])
+    cache = BoardMetadataCache(ttl=60)
+    cache.put('lists', 'b1', [{'id': 'l1'}])
+    now[0] += 59
+    assert cache.get('lists', 'b1') == [{'id': 'l1'}]
+    now[0] += 1
+    assert cache.get('lists', 'b1') is None
+    cache.append('lists', 'b1', {'id': 'l2'}) # nothing cached to write through to
+    assert cache.get('lists', 'b1') is None
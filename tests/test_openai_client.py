@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import secretary.utils_openai as ai
+
+
+class FakeOpenAI():
+    """Stands in for the OpenAI client class, recording the clients it builds."""
+    built = []
+
+    def __init__(self, base_url=None, timeout=None, max_retries=None, http_client=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.closed = False
+        FakeOpenAI.built.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    FakeOpenAI.built = []
+    monkeypatch.setattr(ai, 'OpenAI', FakeOpenAI)
+    monkeypatch.setattr(ai, '_client', None)
+    monkeypatch.setattr(ai, '_client_settings', dict(ai._client_settings))
+    monkeypatch.setattr(ai, 'MODELS', dict(ai.MODELS))
+    return FakeOpenAI
+
+
+def test_one_client_is_shared_across_threads(fake_openai):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: ai.get_client(), range(32)))
+    assert len(fake_openai.built) == 1
+    assert all(client is fake_openai.built[0] for client in clients)
+
+
+def test_configure_closes_the_old_client(fake_openai):
+    old = ai.get_client()
+    ai.configure(models={'fast': 'local-model'}, base_url='http://localhost:8000/v1', timeout=10)
+    assert old.closed
+    assert ai.MODELS['fast'] == 'local-model'
+
+    new = ai.get_client()
+    assert new is not old and not new.closed
+    assert (new.base_url, new.timeout) == ('http://localhost:8000/v1', 10)
+
+    with pytest.raises(ValueError):
+        ai.configure(proxy='http://proxy')
+    assert not new.closed
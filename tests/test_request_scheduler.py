@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+import secretary.rate_limit as rate_limit
+from secretary.rate_limit import RequestScheduler
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bursts_are_limited_to_the_bucket_size():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_requests=3, window=3.0, clock=clock)
+    for _ in range(3):
+        scheduler.acquire()
+    assert scheduler.try_acquire() == pytest.approx(1.0) # the bucket is empty, and refills one token a second
+
+    clock.now += 0.5
+    assert scheduler.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert scheduler.try_acquire() == 0
+    clock.now += 100 # an idle bucket refills only up to its size
+    assert [scheduler.try_acquire() for _ in range(4)][-1] > 0
+
+    metrics = scheduler.metrics()
+    assert metrics['requests']['interactive'] == 3 and metrics['throttled_requests']['interactive'] == 0
+
+
+def test_background_requests_yield_to_waiting_interactive_ones():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_requests=1, window=0.01, clock=clock) # short real waits while the clock is stopped
+    scheduler.acquire('background')
+
+    waiter = threading.Thread(target=scheduler.acquire, args=('interactive',))
+    waiter.start()
+    while scheduler.metrics()['queue_depth']['interactive'] == 0:
+        time.sleep(0.001)
+    # Holding the scheduler's lock keeps the interactive request from taking the refilled token meanwhile
+    with scheduler._lock:
+        clock.now += 1
+        assert scheduler.try_acquire('background') > 0
+    waiter.join(timeout=5)
+    assert not waiter.is_alive()
+    assert scheduler.metrics()['throttled_requests']['interactive'] == 1
+
+    # With no interactive request waiting, background requests get tokens
+    clock.now += 1
+    assert scheduler.try_acquire('background') == 0
+
+
+def test_rate_limited_pauses_for_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda low, high: high) # the most jitter
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_requests=10, window=1.0, base_backoff=0.5, clock=clock)
+
+    scheduler.rate_limited(0, retry_after='7')
+    assert scheduler.try_acquire() == pytest.approx(7.5) # Retry-After, plus up to base_backoff of jitter
+    clock.now += 7.5
+    assert scheduler.try_acquire() == 0
+
+    # Without a Retry-After, the pause backs off exponentially with the attempt
+    scheduler.rate_limited(2)
+    assert scheduler.try_acquire() == pytest.approx(4.0)
+    assert scheduler.metrics()['rate_limited_responses'] == 2
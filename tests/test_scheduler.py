@@ -0,0 +1,120 @@
+from datetime import date, datetime
+import threading
+import time
+
+import pytz
+
+from secretary.scheduler import Scheduler
+
+LA = pytz.timezone('America/Los_Angeles')
+
+def _timestamp(*args):
+    return LA.localize(datetime(*args)).timestamp()
+
+
+def test_deadlines_follow_dst_and_jitter():
+    scheduler = Scheduler(max_jitter=300)
+    scheduler.add_job('morning', '07:00', lambda key: None)
+    scheduler.add_job('night', '02:30', lambda key: None)
+    scheduler.schedule('morning', 'U1', 'America/Los_Angeles')
+    scheduler.schedule('night', 'U1', 'America/Los_Angeles')
+
+    jitter = scheduler.jitter('morning', 'U1')
+    assert 0 <= jitter <= 300 and jitter != scheduler.jitter('morning', 'U2')
+    # 07:00 local is 14:00 UTC before DST ends, and 15:00 UTC after
+    assert scheduler.deadline('morning', 'U1', date(2024, 11, 2)) - jitter == datetime(2024, 11, 2, 14, tzinfo=pytz.utc).timestamp()
+    assert scheduler.deadline('morning', 'U1', date(2024, 11, 4)) - jitter == datetime(2024, 11, 4, 15, tzinfo=pytz.utc).timestamp()
+    # 02:30 doesn't exist when springing forward, so it runs at 03:30 PDT
+    night = scheduler.deadline('night', 'U1', date(2024, 3, 10)) - scheduler.jitter('night', 'U1')
+    assert night == datetime(2024, 3, 10, 10, 30, tzinfo=pytz.utc).timestamp()
+
+    due, day = scheduler.next_run('morning', 'U1', _timestamp(2024, 8, 20, 8, 0))
+    assert day == date(2024, 8, 21) # today's run has passed, and there's nothing to catch up on yet
+
+
+def test_catch_up_after_downtime(tmp_path):
+    path = str(tmp_path / 'schedule.json')
+    scheduler = Scheduler(state_path=path, catch_up_window=3 * 3600)
+    scheduler.add_job('morning', '07:00', lambda key: None)
+    scheduler.schedule('morning', 'U1', 'America/Los_Angeles')
+    scheduler._schedules[('morning', 'U1')]['last_run'] = '2024-08-18'
+    scheduler.save()
+
+    restarted = Scheduler(state_path=path, catch_up_window=3 * 3600)
+    restarted.add_job('morning', '07:00', lambda key: None)
+    assert restarted.scheduled('morning') == ['U1']
+    # Down through the 19th's and 20th's runs: only the 20th's, an hour ago, is caught up
+    now = _timestamp(2024, 8, 20, 8, 0)
+    assert restarted.next_run('morning', 'U1', now) == (now, date(2024, 8, 20))
+    # Too late to catch up
+    assert restarted.next_run('morning', 'U1', _timestamp(2024, 8, 20, 11, 0))[1] == date(2024, 8, 21)
+
+
+def test_worker_runs_due_jobs():
+    ran = threading.Event()
+    scheduler = Scheduler()
+    scheduler.add_job('now', datetime.now(LA).strftime('%H:%M'), lambda key: ran.set())
+    scheduler.schedule('now', 'U1', 'America/Los_Angeles')
+    scheduler._schedules[('now', 'U1')]['last_run'] = '2000-01-01' # so this minute's run is caught up
+    scheduler.add_job('now', datetime.now(LA).strftime('%H:%M'), lambda key: ran.set())
+    scheduler.start()
+    assert ran.wait(5)
+    scheduler.stop()
+    assert scheduler.stats['runs'] == 1
+
+
+def _due_now(scheduler, jobs, keys):
+    """Schedule jobs for keys so that they are all due now, as catch-up runs."""
+    local_time = datetime.now(LA).strftime('%H:%M')
+    for job, fcn in jobs.items():
+        scheduler.add_job(job, local_time, fcn)
+        for key in keys:
+            scheduler.schedule(job, key, 'America/Los_Angeles')
+            scheduler._schedules[(job, key)]['last_run'] = '2000-01-01'
+    for job, fcn in jobs.items():
+        scheduler.add_job(job, local_time, fcn) # queues the runs again, now that they have a last run
+
+
+def test_slow_runs_only_hold_up_their_own_key(caplog):
+    release = threading.Event()
+    events = []
+    def prepare(key):
+        events.append(('prepare', key))
+        if key == 'U1':
+            assert release.wait(5)
+        if key == 'U3':
+            raise RuntimeError('Slack is down')
+    def send(key):
+        events.append(('send', key))
+
+    scheduler = Scheduler(workers=2)
+    _due_now(scheduler, {'prepare': prepare, 'send': send}, ['U1', 'U2', 'U3'])
+    scheduler.start()
+    deadline = time.time() + 5
+    while len(events) < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    # U1's slow run holds one worker, and U2's and U3's runs go through the other
+    assert sorted(events) == [('prepare', 'U1'), ('prepare', 'U2'), ('prepare', 'U3'), ('send', 'U2'), ('send', 'U3')]
+
+    release.set() # then U1's send, which waited for its prepare
+    scheduler.stop()
+    assert events[-1] == ('send', 'U1')
+    assert scheduler.stats == {'runs': 6, 'catch_up_runs': 6, 'failures': 1}
+    assert [record.getMessage() for record in caplog.records] == ['Scheduled job prepare for U3 failed']
+
+
+def test_rescheduling_during_a_run_leaves_one_pending_run():
+    ran = threading.Event()
+    def send(key):
+        scheduler.schedule('send', key, 'Pacific/Honolulu')
+        ran.set()
+
+    scheduler = Scheduler()
+    _due_now(scheduler, {'send': send}, ['U1'])
+    scheduler.start()
+    assert ran.wait(5)
+    scheduler.stop()
+    schedule = scheduler._schedules[('send', 'U1')]
+    pending = [run for run in scheduler._heap if run[2:4] == ('send', 'U1')]
+    assert len(pending) == 1 and pending[0][4] == schedule['version']
+    assert pending[0][5] > schedule['last_run'] # not a second run for the day that just ran
@@ -7,6 +7,8 @@ from secretary.utils_trello import create_board, delete_board  # Import the func
 import secretary.secretary_slack_bot as sb
 import secretary.tasks as tasks
 tasks.BOARD_NAME = 'Test'
+if tasks.card_store is not None: # a replica from SECRETARY_CARD_STORE mirrors the board it was created for
+    tasks.enable_card_store(tasks.card_store.path, tasks.card_store.max_staleness)
 
 # Fixture to create and delete a board
 @pytest.fixture
@@ -110,7 +112,7 @@ def test_processing_user_messages(test_board):
 
     # Test answering a question by retrieving the task from the database
     tools_called = sb.handle_message('Jack', 'clear') # clear conversation history so Secretary has to look at the tasks, not the conversation
-    assert len(sb.convo_global.messages) == 0
+    assert len(sb.current_session().messages.messages) == 0
     responses, tools_called = sb.handle_message('Jack', 'What do I need to buy at the store?')
     assert responses['initial'] is not None
     assert 'bacon' in responses['initial'].lower()
@@ -132,7 +134,7 @@ def test_processing_user_messages(test_board):
 
     # Test answering a question by retrieving the task from the database, and make sure that Secretary added cheese to the card as we just asked.
     tools_called = sb.handle_message('Jack', 'clear') # clear conversation history so Secretary has to look at the tasks, not the conversation
-    assert len(sb.convo_global.messages) == 0
+    assert len(sb.current_session().messages.messages) == 0
     responses, tools_called = sb.handle_message('Jack', 'What do I need to buy at the store?')
     assert responses['initial'] is not None
     assert 'bacon' in responses['initial'].lower()
@@ -143,7 +145,7 @@ def test_processing_user_messages(test_board):
 
     # Test giving the Secretary information about a partial completion to which it should confirm completion and should not mark the task as complete
     tools_called = sb.handle_message('Jack', 'clear') # clear conversation history so Secretary has to look at the tasks, not the conversation
-    assert len(sb.convo_global.messages) == 0
+    assert len(sb.current_session().messages.messages) == 0
     responses, tools_called = sb.handle_message('Jack', "I bought eggs.")
     cards = tasks.get_tasks()
     assert responses['initial'] is not None
@@ -152,7 +154,7 @@ def test_processing_user_messages(test_board):
 
     # Test marking tasks as complete, in which case they should be removed from the board
     tools_called = sb.handle_message('Jack', 'clear') # clear conversation history so Secretary has to look at the tasks, not the conversation
-    assert len(sb.convo_global.messages) == 0
+    assert len(sb.current_session().messages.messages) == 0
     responses, tools_called = sb.handle_message('Jack', "I finished the grocery shopping!")
     cards = tasks.get_tasks()
     assert len(tools_called) == 1
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from secretary.sessions import SessionStore, current_session, default_session, use_session
+
+
+def test_session_store_evicts_least_recently_used_and_idle_sessions():
+    store = SessionStore(max_sessions=2, idle_timeout=60)
+    a = store.get('a')
+    store.get('b')
+    assert store.get('a') is a
+    store.get('c') # 'b' is the least recently used
+    assert 'b' not in store and 'a' in store and 'c' in store
+
+    with use_session(a):
+        a.last_used -= 120 # idle, but in use, so it's kept
+        store.get('c')
+        assert 'a' in store
+    a.last_used -= 120
+    store.get('c')
+    assert 'a' not in store
+
+
+def test_use_session_serializes_turns_per_session():
+    store = SessionStore()
+    events = []
+
+    def turn(key, name):
+        with use_session(store.get(key)) as session:
+            assert current_session() is session
+            events.append(('start', name))
+            time.sleep(0.05)
+            events.append(('end', name))
+
+    threads = [threading.Thread(target=turn, args=args) for args in [('a', 1), ('a', 2), ('b', 3)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    a_events = [event for event in events if event[1] in (1, 2)]
+    assert a_events[0][0] == 'start' and a_events[1] == ('end', a_events[0][1]) # one turn at a time for 'a'
+    assert events.index(('start', 3)) < events.index(('end', a_events[0][1])) # 'b' ran alongside 'a'
+    assert current_session() is default_session
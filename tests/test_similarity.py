@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from secretary.similarity import SimilarityIndex
+
+
+@pytest.mark.parametrize('quantize', [False, True])
+def test_similarity_index_top_k(quantize):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((50, 16))
+    ids = [f'card{i}' for i in range(50)]
+    index = SimilarityIndex(dims=16, quantize=quantize, initial_capacity=4)
+    index.add(ids, embeddings)
+
+    query = embeddings[7] + 0.01 * rng.standard_normal(16)
+    expected = embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+    assert np.allclose(index.scores(query)[index.rows(ids)], expected, atol=0.02 if quantize else 1e-5)
+
+    top = index.top_k(query, k=5)
+    assert len(top) == 5
+    assert top[0][0] == 'card7'
+    assert [score for _, score in top] == sorted([score for _, score in top], reverse=True)
+    assert all(score >= 0.5 for _, score in index.top_k(query, k=5, threshold=0.5))
+
+    # A batch of queries gives the same answers as one query at a time
+    batch_top = index.top_k_batch(np.stack([query, embeddings[3]]), k=5)
+    assert [id for id, _ in batch_top[0]] == [id for id, _ in top]
+    assert batch_top[1][0][0] == 'card3'
+
+
+def test_similarity_index_add_and_remove():
+    index = SimilarityIndex(dims=2)
+    index.add(['a', 'b', 'c'], np.array([[1, 0], [0, 1], [1, 1]]))
+    index.remove(['a', 'missing'])
+    assert len(index) == 2
+    assert 'a' not in index
+    assert index.top_k(np.array([0, 1]), k=1)[0][0] == 'b'
+
+    # Adding an id that is already in the index replaces its row
+    index.add(['b'], np.array([[1, 0]]))
+    assert len(index) == 2
+    assert index.top_k(np.array([1, 0]), k=1)[0][0] == 'b'
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import secretary.utils_openai as ai
+
+
+def chunk(content=None, tool_calls=None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+def tool_call_delta(index, id=None, name=None, arguments=None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+class FakeStreamingClient():
+    """Stands in for the OpenAI client, streaming the given chunks. The stream records how far it has been read."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, temperature, tools, messages, stream):
+        assert stream
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def test_tool_calls_are_assembled_across_chunks(monkeypatch):
+    client = FakeStreamingClient([
+        chunk(content='Adding '),
+        chunk(content='them now.'),
+        SimpleNamespace(choices=[]), # eg. a usage-only chunk
+        chunk(tool_calls=[tool_call_delta(0, id='call_1', name='add_', arguments='')]),
+        chunk(tool_calls=[tool_call_delta(0, name='task', arguments='{"name": ')]),
+        chunk(tool_calls=[tool_call_delta(0, arguments='"Buy eggs"}')]),
+        chunk(tool_calls=[tool_call_delta(1, id='call_2', name='add_task', arguments='{"name": "Pay')]),
+        chunk(tool_calls=[tool_call_delta(1, arguments=' rent"}')]),
+    ])
+    monkeypatch.setattr(ai, 'get_client', lambda: client)
+
+    stream = ai.stream_conversation_completion([{'role': 'user', 'content': 'Buy eggs and pay rent'}], use_cache=False)
+    assert [next(stream), next(stream)] == [('text', 'Adding '), ('text', 'them now.')]
+
+    kind, first = next(stream)
+    assert kind == 'tool_call'
+    assert (first.id, first.function.name, first.function.arguments) == ('call_1', 'add_task', '{"name": "Buy eggs"}')
+    assert client.read == 7 # yielded as soon as the next tool call started, before the stream ended
+
+    kind, second = next(stream)
+    assert (second.id, second.function.name, second.function.arguments) == ('call_2', 'add_task', '{"name": "Pay rent"}')
+    assert list(stream) == []
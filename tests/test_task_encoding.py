@@ -0,0 +1,16 @@
+from secretary.task_encoding import TaskAliases
+
+
+def test_task_aliases_round_trip():
+    tasks = [{'id': '66c4a1f0e1b2c3d4e5f60718', 'name': 'Buy eggs', 'closed': False, 'url': 'https://trello.com/c/abc/1-buy-eggs',
+              'desc': 'Dozen\tlarge\nbrown'},
+             {'id': '66c4a1f0e1b2c3d4e5f60719', 'name': 'Call Silvia', 'closed': False, 'url': 'https://trello.com/c/def/2-call-silvia',
+              'due': '2024-08-20 17:00:00 -0700'}]
+    aliases = TaskAliases(tasks)
+
+    assert aliases.encode() == ('alias\tname\tdue\tdesc\n'
+                                'T1\tBuy eggs\t\tDozen large\\nbrown\n'
+                                'T2\tCall Silvia\t2024-08-20 17:00:00 -0700\t')
+    assert aliases.resolve_arguments({'id': 'T2', 'label_names': ['T1']}) == {'id': '66c4a1f0e1b2c3d4e5f60719', 'label_names': ['T1']}
+    assert aliases.resolve_arguments({'id': '66c4a1f0e1b2c3d4e5f60718'}) == {'id': '66c4a1f0e1b2c3d4e5f60718'}
+    assert aliases.attach_urls('Done: <T1|Buy eggs>, not <T9|Other>') == 'Done: <https://trello.com/c/abc/1-buy-eggs|Buy eggs>, not <T9|Other>'
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import secretary.tasks as tasks
+import secretary.utils_openai as ai
+import secretary.utils_trello as utils_trello
+from secretary.similarity import SimilarityIndex
+from secretary.utils_trello import BoardMetadataCache
+
+
+class FakeClient():
+    """Stands in for TrelloClient. Creating a card named fail_name fails."""
+
+    def __init__(self, fail_name=None):
+        self.fail_name = fail_name
+        self.created = []
+        self.created_labels = []
+
+    def get_boards(self):
+        return [{'id': 'b1', 'name': tasks.BOARD_NAME}]
+
+    def get_lists_on_board(self, board_id):
+        return [{'id': 'l1', 'name': 'Action Items'}]
+
+    def get_labels_on_board(self, board_id):
+        return [{'id': 'x1', 'name': 'home'}]
+
+    def create_label(self, board_id, name, color='sky'):
+        time.sleep(0.05) # long enough for a racing caller to miss the new label
+        self.created_labels.append(name)
+        return {'id': f'x{len(self.created_labels) + 1}', 'name': name}
+
+    def create_card(self, list_id, name, description='', label_ids=[], due=None):
+        if name == self.fail_name:
+            raise utils_trello.TrelloError(type('Response', (), {'status_code': 500, 'text': 'server error'})())
+        self.created.append(name)
+        return {'id': f'c{len(self.created)}', 'name': name, 'idList': list_id, 'idLabels': label_ids, 'due': due}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient(fail_name='Pay rent')
+    monkeypatch.setattr(utils_trello, '_default_client', client)
+    monkeypatch.setattr(utils_trello, 'metadata_cache', BoardMetadataCache())
+    monkeypatch.setattr(tasks, 'card_store', None)
+    monkeypatch.setattr(tasks, 'embedding_store', None)
+    return client
+
+
+def new_task(summary):
+    return {'summary': summary, 'type': 'Action Items', 'topics': ['home'], 'due_date': None,
+            'requestor': None, 'actor': None, 'notes': ''}
+
+
+def test_add_new_tasks_returns_the_failures(client):
+    cards, failures = tasks.add_new_tasks([new_task('Buy eggs.'), new_task('Pay rent'), new_task('Call Silvia')])
+    assert [card['name'] for card in cards] == ['Buy eggs', 'Call Silvia']
+    assert all(card['idLabels'] == ['x1'] for card in cards)
+    assert [(task['summary'], error.status_code) for task, error in failures] == [('Pay rent', 500)]
+
+
+
+def test_parallel_calls_create_a_missing_label_once(client):
+    results = []
+    def add_label():
+        results.append(tasks.eager_get_label_id_map(['Errands', 'home']))
+    threads = [threading.Thread(target=add_label) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.created_labels == ['errands']
+    assert results == [{'errands': 'x2', 'home': 'x1'}] * 2
+
+KEYWORDS = ['eggs', 'rent', 'dentist']
+
+def fake_embedding(text):
+    """An embedding with one axis per keyword in the text, plus a small component that tells texts apart."""
+    vector = np.zeros(ai.EMBEDDING_DIMS, dtype=np.float32)
+    for axis, word in enumerate(KEYWORDS):
+        vector[axis] = word in text.lower()
+    vector[len(KEYWORDS) + len(text) % 100] = 0.1
+    return vector
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    calls = []
+    def get_embeddings(texts):
+        calls.append(list(texts))
+        return np.array([fake_embedding(text) for text in texts])
+    monkeypatch.setattr(ai, 'get_embeddings', get_embeddings)
+    monkeypatch.setattr(ai, 'get_embedding', fake_embedding)
+    monkeypatch.setattr(tasks, 'embedding_store', None)
+    monkeypatch.setattr(tasks, 'similarity_index', SimilarityIndex(dims=ai.EMBEDDING_DIMS))
+    monkeypatch.setattr(tasks, '_indexed_texts', {})
+    monkeypatch.setattr(tasks, '_task_embeddings', OrderedDict())
+    return calls
+
+
+BOARD = [{'id': f't{i}', 'name': name, 'desc': ''}
+         for i, name in enumerate(['Buy eggs', 'Pay rent', 'Book dentist', 'Water plants', 'Call Silvia', 'Buy more eggs for the cake'])]
+
+
+def test_select_relevant_tasks(embeddings, monkeypatch):
+    messages = [{'role': 'user', 'content': 'I need eggs. And did I Call Silvia yet?'}]
+    relevant = tasks.select_relevant_tasks(BOARD, messages, top_k=2, threshold=0.2)
+    # The referenced task comes first, then the top_k most similar ones
+    assert relevant[0]['name'] == 'Call Silvia'
+    assert {task['name'] for task in relevant[1:]} == {'Buy eggs', 'Buy more eggs for the cake'}
+    assert len(embeddings) == 1 and len(embeddings[0]) == len(BOARD)
+
+    # Only edited tasks are embedded again
+    board = [dict(task, name='Pay the rent') if task['id'] == 't1' else task for task in BOARD]
+    relevant = tasks.select_relevant_tasks(board, [{'role': 'user', 'content': 'When is the rent due?'}], top_k=2, threshold=0.5)
+    assert [task['name'] for task in relevant] == ['Pay the rent']
+    assert embeddings[1:] == [['Pay the rent']]
+
+    # Small boards are returned whole, without embedding anything
+    monkeypatch.setattr(ai, 'get_embedding', None)
+    assert tasks.select_relevant_tasks(BOARD[:3], messages, top_k=3) == BOARD[:3]
+
+
+def test_long_conversations_are_cut_to_the_embedding_input_limit(embeddings, monkeypatch):
+    embedded = []
+    monkeypatch.setattr(ai, 'get_embedding', lambda text: embedded.append(text) or fake_embedding(text))
+    messages = [{'role': 'user', 'content': 'x' * 100_000}, {'role': 'user', 'content': 'When is the rent due?'}]
+    relevant = tasks.select_relevant_tasks(BOARD, messages, top_k=2, threshold=0.5)
+    assert ai.estimate_tokens(embedded[0]) <= ai.EMBEDDING_MAX_INPUT_TOKENS
+    assert embedded[0].endswith('When is the rent due?')
+    assert [task['name'] for task in relevant] == ['Pay rent']
+
+
+def test_select_relevant_tasks_falls_back_to_referenced_tasks(embeddings, monkeypatch, caplog):
+    def get_embedding(text):
+        raise RuntimeError('input too long')
+    monkeypatch.setattr(ai, 'get_embedding', get_embedding)
+    messages = [{'role': 'user', 'content': 'Did I Call Silvia yet?'}]
+    assert tasks.select_relevant_tasks(BOARD, messages, top_k=2) == [BOARD[4]]
+    assert 'Failed to embed the conversation' in caplog.text
+
+
+def test_task_embeddings_cache_is_bounded(embeddings, monkeypatch):
+    monkeypatch.setattr(tasks, 'TASK_EMBEDDING_CACHE_SIZE', 2)
+    vectors = tasks.get_task_embeddings(BOARD[:3])
+    assert all(vector.base is None for vector in vectors) # copies, not views of the batch's matrix
+    assert list(tasks._task_embeddings) == ['Pay rent', 'Book dentist']
+
+    tasks.get_task_embeddings(BOARD[1:2]) # a hit makes Pay rent the most recently used
+    tasks.get_task_embeddings(BOARD[:1])
+    assert list(tasks._task_embeddings) == ['Pay rent', 'Buy eggs']
+    assert embeddings == [['Buy eggs', 'Pay rent', 'Book dentist'], ['Buy eggs']]
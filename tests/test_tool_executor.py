@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+from typing import Annotated, Optional
+
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+
+import secretary.utils_openai as ai
+
+
+def _tool_call(i, name, **arguments):
+    return ChatCompletionMessageToolCall(id=f'call_{i}', type='function',
+                                         function=Function(name=name, arguments=json.dumps(arguments)))
+
+
+def test_tool_executor_runs_calls_concurrently_but_serializes_by_card():
+    running = {}
+    overlaps = []
+    lock = threading.Lock()
+    order = []
+
+    def update(id: Annotated[str, 'The card id'], value: Annotated[str, 'The new value']):
+        """Update a card."""
+        with lock:
+            running[id] = running.get(id, 0) + 1
+            if running[id] > 1:
+                overlaps.append(id)
+            order.append((id, value))
+        time.sleep(0.05)
+        with lock:
+            running[id] -= 1
+        return {'id': id, 'value': value}
+
+    def fail(id: Annotated[str, 'The card id']):
+        """Fail."""
+        raise ValueError('nope')
+
+    tools = {}
+    ai.add_function_to_tools(tools, update)
+    ai.add_function_to_tools(tools, fail)
+    executor = ai.ToolExecutor(tools, pool=ThreadPoolExecutor(max_workers=4))
+    calls = [_tool_call(0, 'update', id='a', value='1'),
+             _tool_call(1, 'update', id='b', value='1'),
+             _tool_call(2, 'fail', id='c'),
+             _tool_call(3, 'update', id='a', value='2'),
+             _tool_call(4, 'update', id='c', value='1'),
+             _tool_call(5, 'missing', id='d')]
+
+    start = time.monotonic()
+    for call in calls:
+        executor.submit(call)
+    results = executor.results()
+    elapsed = time.monotonic() - start
+
+    assert [result['tool_call_id'] for result in results] == [call.id for call in calls]
+    assert results[0]['result'] == {'id': 'a', 'value': '1'}
+    assert results[3]['result'] == {'id': 'a', 'value': '2'}
+    assert isinstance(results[2]['error'], ValueError)
+    assert isinstance(results[5]['error'], KeyError)
+    assert results[4]['error'] is None
+    assert overlaps == []
+    assert [value for id, value in order if id == 'a'] == ['1', '2']
+    assert elapsed < 0.2 # 4 updates of 0.05s each, but only the two on card 'a' have to run one after the other
+
+
+def test_tool_registry_schemas():
+    tools = ai.ToolRegistry()
+
+    @tools.register
+    def set_due(id: Annotated[str, 'The card id'],
+                due: Annotated[Optional[str], 'The due date, or null to clear it'],
+                labels: Annotated[list[str], 'Labels to add'] = [],
+                note: Annotated[str | None, 'A note to add, if any'] = None):
+        """Set the due date of a card."""
+        return id, due, labels
+
+    schemas = tools.schemas
+    parameters = schemas[0]['function']['parameters']
+    assert parameters['required'] == ['id', 'due']
+    assert parameters['properties']['due']['type'] == ['string', 'null']
+    assert parameters['properties']['note']['type'] == ['string', 'null']
+    assert parameters['properties']['labels'] == {'type': 'array', 'items': {'type': 'string'}, 'description': 'Labels to add'}
+    assert tools.schemas is schemas # reused, not rebuilt
+    assert tools.call('set_due', {'id': 'a', 'due': None}) == ('a', None, [])
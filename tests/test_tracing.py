@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import json
+
+import pytest
+
+import secretary.tracing as tracing
+
+
+class ListExporter():
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exporter():
+    exporter = ListExporter()
+    tracing.set_exporters([exporter])
+    yield exporter
+    tracing.set_exporters([])
+
+
+def test_spans_nest_within_a_trace(exporter):
+    with tracing.trace('turn', user_id='U1') as turn:
+        with tracing.span('trello.GET boards/:id/cards') as cards:
+            cards.set(cards=3)
+        # Threads running in a copy of the context nest their spans too
+        def tool_call():
+            with tracing.span('tool.extract_tasks'):
+                pass
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(contextvars.copy_context().run, tool_call).result()
+        with pytest.raises(ValueError):
+            with tracing.span('openai.chat_completion'):
+                raise ValueError('boom')
+    assert tracing.current_span() is None
+
+    names = [span.name for span in exporter.spans]
+    assert names == ['trello.GET boards/:id/cards', 'tool.extract_tasks', 'openai.chat_completion', 'turn']
+    assert {span.trace_id for span in exporter.spans} == {turn.trace_id}
+    assert all(span.parent_id == turn.span_id for span in exporter.spans[:3])
+    assert turn.parent_id is None and turn.attributes == {'user_id': 'U1'}
+    assert exporter.spans[0].attributes == {'cards': 3}
+    assert exporter.spans[2].error == "ValueError('boom')"
+
+    with tracing.span('outer') as outer:
+        with tracing.trace('scheduled') as new_trace:
+            pass
+    assert new_trace.trace_id != outer.trace_id and new_trace.parent_id is None
+
+
+def test_jsonl_export_and_summary(tmp_path, capsys):
+    path = str(tmp_path / 'traces.jsonl')
+    otlp_path = str(tmp_path / 'traces.otlp.jsonl')
+    tracing.set_exporters([tracing.JsonlExporter(path), tracing.OtlpJsonExporter(otlp_path)])
+    try:
+        with tracing.span('turn', tools=['extract_tasks']):
+            pass
+    finally:
+        tracing.set_exporters([])
+
+    spans = tracing.load_spans(path)
+    assert spans[0]['name'] == 'turn' and spans[0]['duration_ms'] >= 0
+    with open(otlp_path) as f:
+        request = json.loads(f.readline())
+    otlp = request['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert otlp['traceId'] == spans[0]['trace_id'] and len(otlp['traceId']) == 32 and len(otlp['spanId']) == 16
+    assert otlp['attributes'] == [{'key': 'tools', 'value': {'arrayValue': {'values': [{'stringValue': 'extract_tasks'}]}}}]
+
+    spans = [{'name': 'openai.chat_completion', 'duration_ms': float(ms), 'error': None} for ms in range(1, 101)]
+    spans.append({'name': 'slack.say', 'duration_ms': 5.0, 'error': 'SlackApiError()'})
+    summary = tracing.summarize(spans)
+    assert summary['openai.chat_completion']['count'] == 100
+    assert summary['openai.chat_completion']['p50'] == pytest.approx(50.5)
+    assert summary['openai.chat_completion']['p99'] == pytest.approx(99.01)
+    assert summary['slack.say']['errors'] == 1
+
+    tracing.main([path])
+    assert 'turn' in capsys.readouterr().out
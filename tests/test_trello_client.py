@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+import secretary.utils_trello as utils_trello
+from secretary.utils_trello import RequestScheduler, TrelloClient, TrelloError
+
+
+class FakeResponse():
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.headers = headers or {}
+
+
+class FakeSession():
+    """Stands in for requests.Session: returns the queued responses in order, and records the requests."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, params=None, timeout=None):
+        self.requests.append((method, url, params))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+def make_client(*responses):
+    client = TrelloClient(api_key='key', token='token', base_url='http://trello.test/1/',
+                          scheduler=RequestScheduler(max_requests=100, window=1, base_backoff=0.001))
+    client.session = FakeSession(*responses)
+    return client
+
+
+def test_requests_go_through_one_session_with_credentials():
+    client = make_client(FakeResponse(200, [{'id': 'c1'}]), FakeResponse(200, {'id': 'c2', 'name': 'Buy eggs'}))
+    assert client.get_cards_on_board('b1') == [{'id': 'c1'}]
+    assert client.create_card('l1', 'Buy eggs', due='2024-08-20T17:00:00.000Z')['id'] == 'c2'
+
+    (method, url, params), (create_method, create_url, create_params) = client.session.requests
+    assert (method, url) == ('GET', 'http://trello.test/1/boards/b1/cards')
+    assert params == {'key': 'key', 'token': 'token'}
+    assert (create_method, create_url) == ('POST', 'http://trello.test/1/cards')
+    assert create_params['idList'] == 'l1' and create_params['due'] == '2024-08-20T17:00:00.000Z'
+
+
+def test_errors_and_rate_limits():
+    client = make_client(FakeResponse(404, 'card not found'))
+    with pytest.raises(TrelloError) as error:
+        client.get_card('missing')
+    assert error.value.status_code == 404
+
+    # A 429 is retried, after the Retry-After pause
+    client = make_client(FakeResponse(429, 'slow down', {'Retry-After': '0'}), FakeResponse(200, {'id': 'c1'}))
+    assert client.get_card('c1') == {'id': 'c1'}
+    assert len(client.session.requests) == 2
+    assert client.scheduler.metrics()['rate_limited_responses'] == 1
+
+
+def test_missing_credentials(monkeypatch):
+    monkeypatch.setattr(utils_trello, 'TRELLO_API_KEY', None)
+    monkeypatch.setattr(utils_trello, 'TRELLO_OAUTH_TOKEN', None)
+    with pytest.raises(ValueError):
+        TrelloClient()
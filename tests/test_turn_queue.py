@@ -0,0 +1,53 @@
+import threading
+
+from secretary.turn_queue import TurnQueue
+
+
+def _blocking_queue(policy, **kwargs):
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handle(turn):
+        started.set()
+        release.wait()
+        handled.append((turn.key, turn.text))
+
+    return TurnQueue(handle, policy=policy, **{'workers': 2, **kwargs}), started, release, handled
+
+
+def test_merge_policy_merges_messages_while_a_turn_waits():
+    turns, started, release, handled = _blocking_queue('merge')
+    assert turns.submit('a', 'one') == 'queued'
+    started.wait()
+    assert turns.submit('a', 'two') == 'queued' # 'one' is running, so 'two' waits
+    assert turns.submit('a', 'three') == 'merged'
+    assert turns.submit('b', 'hi') == 'queued'
+    release.set()
+    assert turns.join(timeout=5)
+    assert [text for key, text in handled if key == 'a'] == ['one', 'two\n\nthree']
+    assert ('b', 'hi') in handled
+
+
+def test_reject_policy_and_total_bound():
+    turns, started, release, handled = _blocking_queue('reject', max_pending=1, workers=1)
+    assert turns.submit('a', 'one') == 'queued'
+    started.wait()
+    assert turns.submit('a', 'two') == 'rejected' # 'a' is busy
+    assert turns.submit('b', 'hi') == 'queued'
+    assert turns.submit('c', 'hi') == 'rejected' # one turn is already waiting
+    release.set()
+    assert turns.join(timeout=5)
+    assert handled == [('a', 'one'), ('b', 'hi')]
+
+
+def test_failed_turns_are_logged_and_counted(caplog):
+    def handle(turn):
+        raise RuntimeError('Trello is down')
+
+    turns = TurnQueue(handle, workers=1)
+    turns.submit('a', 'one')
+    assert turns.join(timeout=5)
+    assert turns.stats['failed'] == 1
+    assert [(record.levelname, record.getMessage()) for record in caplog.records] == [('ERROR', 'Turn for a failed')]
+    assert 'Trello is down' in caplog.text # with the traceback
@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pytest
+
+from secretary.user_profiles import UserProfileCache, profile_from_user
+
+
+def test_user_profile_cache_dedupes_and_expires():
+    calls = []
+
+    def fetch(user_id):
+        calls.append(user_id)
+        time.sleep(0.05)
+        return {'name': f'name-{len(calls)}', 'tz': 'America/Los_Angeles'}
+
+    profiles = UserProfileCache(fetch, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(profiles.get('U1'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['U1'] # one fetch shared by the concurrent lookups
+    assert results == [{'name': 'name-1', 'tz': 'America/Los_Angeles'}] * 5
+
+    profiles.put('U1', profile_from_user({'id': 'U1', 'tz': 'Asia/Tokyo', 'profile': {'real_name_normalized': 'Jack'}}))
+    assert profiles.get('U1') == {'name': 'Jack', 'tz': 'Asia/Tokyo'}
+    profiles.ttl = 0
+    assert profiles.get('U1')['name'] == 'name-2'
+
+
+def test_user_profile_cache_uses_stale_profile_when_refresh_fails(caplog):
+    def fetch(user_id):
+        raise RuntimeError('rate limited')
+
+    profiles = UserProfileCache(fetch, ttl=0)
+    with pytest.raises(RuntimeError):
+        profiles.get('U1')
+    profiles.put('U1', {'name': 'Jack', 'tz': 'UTC'})
+    assert profiles.get('U1') == {'name': 'Jack', 'tz': 'UTC'}
+    assert [record.levelname for record in caplog.records] == ['WARNING']
+    assert 'Could not refresh the profile of U1' in caplog.text